@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from influxdb_client import InfluxDBClient
 import subprocess
@@ -6,10 +6,18 @@ import sys
 import os
 import base64
 import json
+import re
 from datetime import datetime
 import threading
 import time
 
+from event_stream import Broadcaster, InfluxPoller
+from jobs import JobManager, JobQueueFull
+from influx_schema import MAX_SAMPLE_LIMIT, SchemaExplorer, stream_json_object
+from influx_writer import configure_detection_writer, get_detection_writer
+from joystick_history import JoystickHistory, parse_time
+from query_cache import QueryCache
+
 # ----------------- Flask App -----------------
 app = Flask(__name__)
 CORS(app)
@@ -23,15 +31,29 @@ BUCKET = "waste"
 client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=ORG)
 query_api = client.query_api()
 
-# Global variables for object detection
+# Dashboard queries are served from a short-lived cache (see query_cache.py)
+query_cache = QueryCache()
+# Joystick records of the last hour, synced incrementally (see joystick_history.py)
+joystick_history = JoystickHistory(query_api, BUCKET)
+# Measurement / field discovery for the debug endpoints (see influx_schema.py)
+schema_explorer = SchemaExplorer(query_api, BUCKET)
+# Detection events are written back in batches when enabled (see influx_writer.py)
+if os.environ.get("BOTTLE_INFLUX_WRITE", "0") == "1":
+    configure_detection_writer(INFLUX_URL, ORG, BUCKET, INFLUX_TOKEN)
+
+# Global variables for the fallback (subprocess) detection
 detection_process = None
 detection_results = None
 detection_lock = threading.Lock()
-detection_active = False
 
 # Import detection functions
 try:
     from object_detection_1 import detect_realtime_for_api
+    from model_server import get_inference_metrics
+    from model import MODEL_BACKENDS
+    from live_stream import STREAM_MAX_FPS, STREAM_QUALITY, STREAM_WIDTH, get_live_stream, live_stream_stats, BOUNDARY
+    from detection_pipeline import stop_all_pipelines
+    from frame_source import DEFAULT_FRAME_SOURCE, DEFAULT_SOURCE_NAME, NAMED_SOURCES, named_source_config
     DETECTION_AVAILABLE = True
     print("✅ Object detection module loaded successfully")
 except ImportError as e:
@@ -77,10 +99,8 @@ def run_object_detection():
         print(f"Detection error: {e}")
         return False
 
-def run_realtime_detection():
+def run_realtime_detection(backend=None, classify_materials=None, source=None, source_name=None):
     """Run real-time detection using the imported module"""
-    global detection_results, detection_active
-    
     if not DETECTION_AVAILABLE:
         return {
             "success": False,
@@ -88,32 +108,104 @@ def run_realtime_detection():
         }
     
     try:
-        detection_active = True
         print("🎥 Starting real-time bottle detection...")
         
         # Call the detection function
-        result = detect_realtime_for_api()
-        
-        detection_active = False
+        result = detect_realtime_for_api(source=source, backend=backend, classify_materials=classify_materials,
+                                         source_name=source_name)
         
         if result and result.get("success"):
-            with detection_lock:
-                detection_results = result
             return result
         else:
             return {
                 "success": False,
-                "error": "No bottle detected or detection failed"
+                "error": (result or {}).get("error", "No bottle detected or detection failed")
             }
             
     except Exception as e:
-        detection_active = False
         print(f"Real-time detection error: {e}")
         return {
             "success": False,
             "error": str(e)
         }
 
+def _source_lock(config):
+    """One lock per frame source: jobs for the same camera run one after another"""
+    # Keyed by the resolved config, so no source, "default" and two names for
+    # one device (e.g. 0 and "0") all share a lock
+    if config is None:
+        config = DEFAULT_FRAME_SOURCE
+    key = json.dumps(config, sort_keys=True, default=str) if isinstance(config, dict) else str(config)
+    with source_locks_lock:
+        return source_locks.setdefault(key, threading.Lock())
+
+def run_detection_job(backend=None, classify_materials=None, source=None):
+    """Job handler for "detect-bottle" jobs; `source` is a configured source name"""
+    config = named_source_config(source)
+    with _source_lock(config):
+        return run_realtime_detection(backend, classify_materials, config, source or DEFAULT_SOURCE_NAME)
+
+# Detection requests run as jobs on a bounded worker pool (see jobs.py)
+# Keyed by configured source config, so the number of locks is bounded
+source_locks = {}
+source_locks_lock = threading.Lock()
+job_manager = JobManager({"detect-bottle": run_detection_job}, on_update=lambda job: publish_job_event(job))
+
+def _json_body():
+    """JSON object request body ({} if empty); returns (data, error response)"""
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}, None
+    if not isinstance(data, dict):
+        return None, (jsonify({"success": False, "error": "Request body must be a JSON object"}), 400)
+    return data, None
+
+def _detection_job_params(data):
+    """Validate a detection request body; returns (params, error response)"""
+    backend = data.get("backend")
+    if backend is not None and not isinstance(backend, str):
+        return None, (jsonify({"success": False, "error": "backend must be a string"}), 400)
+    materials = data.get("materials")
+    if materials is not None and not isinstance(materials, bool):
+        return None, (jsonify({"success": False, "error": "materials must be true or false"}), 400)
+    if backend and DETECTION_AVAILABLE and backend not in MODEL_BACKENDS:
+        return None, (jsonify({
+            "success": False,
+            "error": f"Unknown model backend '{backend}'",
+            "available_backends": list(MODEL_BACKENDS)
+        }), 400)
+    # Only names of server-configured sources; never paths, URLs or configs from the client
+    source = data.get("source")
+    if DETECTION_AVAILABLE:
+        error = _unknown_source_error(source)
+        if error:
+            return None, error
+    return {
+        "backend": backend,
+        # Material classification: true / false, default on when a classifier checkpoint is configured
+        "classify_materials": materials,
+        "source": source,
+    }, None
+
+def _unknown_source_error(source):
+    """400 response for a source name that is not configured (None if it is)"""
+    try:
+        named_source_config(source)
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "available_sources": list(NAMED_SOURCES)
+        }), 400
+    return None
+
+def _submit_detection_job(params):
+    """Queue a detection job; returns (job, error response)"""
+    try:
+        return job_manager.submit("detect-bottle", params), None
+    except JobQueueFull as e:
+        return None, (jsonify({"success": False, "error": f"Detection queue is full: {e}"}), 429)
+
 def encode_image_to_base64(image_path):
     """Convert image file to base64 string"""
     try:
@@ -130,37 +222,44 @@ def detect_bottle():
     global detection_process, detection_results
     
     try:
-        data = request.get_json()
+        data, error = _json_body()
+        if error:
+            return error
         mode = data.get("mode", "auto-stop")
+        params, error = _detection_job_params(data)
+        if error:
+            return error
         
-        # Reset previous results
-        with detection_lock:
-            detection_results = None
-        
-        print(f"🎯 Starting bottle detection in {mode} mode...")
+        print(f"🎯 Starting bottle detection in {mode} mode ({params['backend'] or 'default'} detector)...")
         
         # Use real-time detection if available
         if DETECTION_AVAILABLE:
-            def detection_thread():
-                global detection_results
-                result = run_realtime_detection()
-                with detection_lock:
-                    detection_results = result
-            
-            thread = threading.Thread(target=detection_thread)
-            thread.start()
-            thread.join(timeout=25)  # Wait up to 25 seconds
+            # Kept for existing clients; new clients should use POST /api/jobs and poll
+            job, error = _submit_detection_job(params)
+            if error:
+                return error
+            if not job.wait(timeout=25):
+                return jsonify({
+                    "success": False,
+                    "job_id": job.id,
+                    "status": job.status,
+                    "message": f"Detection still running, poll /api/jobs/{job.id}"
+                }), 202
             
-            with detection_lock:
-                if detection_results and detection_results.get("success"):
-                    return jsonify(detection_results)
-                else:
-                    return jsonify({
-                        "success": False,
-                        "message": detection_results.get("error", "No bottle detected or detection failed")
-                    })
+            result = job.result or {"error": job.error}
+            if result.get("success"):
+                return jsonify({**result, "job_id": job.id})
+            else:
+                return jsonify({
+                    "success": False,
+                    "job_id": job.id,
+                    "message": result.get("error", "No bottle detected or detection failed")
+                })
         else:
             # Fallback to old method if module not available
+            with detection_lock:
+                detection_results = None
+            
             # Run detection in a separate thread to avoid blocking
             def detection_thread():
                 run_object_detection()
@@ -210,38 +309,30 @@ def detect_bottle():
 @app.route("/api/realtime-detect", methods=["POST"])
 def realtime_detect():
     """Real-time bottle detection endpoint"""
-    global detection_active
-    
     if not DETECTION_AVAILABLE:
         return jsonify({
             "success": False,
             "error": "Object detection module not available. Please ensure all dependencies are installed."
         }), 500
     
-    if detection_active:
-        return jsonify({
-            "success": False,
-            "error": "Detection already in progress"
-        }), 409
-    
     try:
         print("🔥 Starting real-time bottle detection...")
         
-        # Run detection in background thread
-        def detection_thread():
-            try:
-                result = run_realtime_detection()
-                print(f"Detection completed with result: {result.get('success', False)}")
-            except Exception as e:
-                print(f"Detection thread error: {e}")
-        
-        thread = threading.Thread(target=detection_thread)
-        thread.start()
+        data, error = _json_body()
+        if error:
+            return error
+        params, error = _detection_job_params(data)
+        if error:
+            return error
+        job, error = _submit_detection_job(params)
+        if error:
+            return error
         
         return jsonify({
             "success": True,
             "message": "Real-time detection started",
-            "status": "processing"
+            "status": "processing",
+            "job_id": job.id
         })
         
     except Exception as e:
@@ -252,60 +343,120 @@ def realtime_detect():
 
 @app.route("/api/detection-status", methods=["GET"])
 def get_detection_status():
-    """Get current detection status"""
-    global detection_active
+    """Get detection status of a job (?job_id=...) or of the latest detection job"""
+    job_id = request.args.get("job_id")
+    job = job_manager.get(job_id) if job_id else job_manager.latest("detect-bottle")
     
-    with detection_lock:
-        if detection_results:
-            return jsonify({
-                "status": "completed",
-                "active": detection_active,
-                "results": detection_results
-            })
-        else:
-            return jsonify({
-                "status": "running" if detection_active else "idle",
-                "active": detection_active
-            })
+    if job is None:
+        if job_id:
+            return jsonify({"status": "unknown", "active": False, "error": "Unknown job"}), 404
+        return jsonify({"status": "idle", "active": False})
+    if job.done:
+        return jsonify({
+            "status": "completed",
+            "active": False,
+            "job_id": job.id,
+            "results": job.result or {"success": False, "error": job.error}
+        })
+    return jsonify({"status": "running", "active": True, "job_id": job.id})
+
+# ----------------- Job Endpoints -----------------
+@app.route("/api/jobs", methods=["POST"])
+def create_job():
+    """Queue a detection job and return its ID immediately"""
+    data, error = _json_body()
+    if error:
+        return error
+    job_type = data.get("type", "detect-bottle")
+    if not isinstance(job_type, str) or job_type not in job_manager.handlers:
+        return jsonify({
+            "success": False,
+            "error": f"Unknown job type '{job_type}'",
+            "available_types": list(job_manager.handlers)
+        }), 400
+    
+    params, error = _detection_job_params(data)
+    if error:
+        return error
+    job, error = _submit_detection_job(params)
+    if error:
+        return error
+    
+    return jsonify({
+        "success": True,
+        **job.to_dict(include_result=False),
+        "status_url": f"/api/jobs/{job.id}"
+    }), 202
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Status, timing and (once finished) result of a job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown or expired job"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+@app.route("/api/jobs", methods=["GET"])
+def job_stats():
+    """Worker pool and job store statistics"""
+    return jsonify(job_manager.stats())
+
+# ----------------- Live Preview -----------------
+@app.route("/api/stream", methods=["GET"])
+def live_preview_stream():
+    """
+    MJPEG stream of the annotated frames of running detections
+
+    Query parameters: source (name of a configured frame source, default
+    camera), quality, width and fps, each capped by the server settings.
+    """
+    if not DETECTION_AVAILABLE:
+        return jsonify({"success": False, "error": "Object detection module not available"}), 500
+    try:
+        quality = min(int(request.args.get("quality", STREAM_QUALITY)), STREAM_QUALITY)
+        width = int(request.args.get("width", STREAM_WIDTH))
+        fps = min(float(request.args.get("fps", STREAM_MAX_FPS)), STREAM_MAX_FPS)
+    except ValueError:
+        return jsonify({"success": False, "error": "quality, width and fps must be numbers"}), 400
+    if STREAM_WIDTH:
+        width = min(width, STREAM_WIDTH) if width > 0 else STREAM_WIDTH
+
+    source = request.args.get("source")
+    error = _unknown_source_error(source)
+    if error:
+        return error
+    stream = get_live_stream(source)
+    return Response(stream.frames(quality, width, fps),
+                    mimetype=f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+                    headers={"Cache-Control": "no-cache, private", "X-Accel-Buffering": "no"})
+
+@app.route("/api/stream/stats", methods=["GET"])
+def live_preview_stats():
+    """Viewers and published / encoded / sent frames of every live stream"""
+    if not DETECTION_AVAILABLE:
+        return jsonify({})
+    return jsonify(live_stream_stats())
+
+@app.route("/api/inference/metrics", methods=["GET"])
+def inference_metrics():
+    """Get model service and micro-batching statistics"""
+    if not DETECTION_AVAILABLE:
+        return jsonify({"loaded": False, "error": "Object detection module not available"})
+    return jsonify(get_inference_metrics())
+
+def _wants_stream():
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
 @app.route("/api/debug/schema", methods=["GET"])
 def debug_schema():
-    """Check what measurements and fields are available"""
-    try:
-        # Get all measurements
-        measurements_query = f'''
-            import "influxdata/influxdb/schema"
-            schema.measurements(bucket: "{BUCKET}")
-        '''
-        measurements = []
-        measurements_result = query_api.query(measurements_query)
-        for table in measurements_result:
-            for record in table.records:
-                measurements.append(record.get_value())
-
-        # For each measurement, get field keys
-        fields_by_measurement = {}
-        for measurement in measurements:
-            fields_query = f'''
-                import "influxdata/influxdb/schema"
-                schema.measurementFieldKeys(
-                    bucket: "{BUCKET}", 
-                    measurement: "{measurement}"
-                )
-            '''
-            fields = []
-            try:
-                fields_result = query_api.query(fields_query)
-                for table in fields_result:
-                    for record in table.records:
-                        fields.append(record.get_value())
-                fields_by_measurement[measurement] = fields
-            except Exception:
-                fields_by_measurement[measurement] = ["Error querying fields"]
+    """
+    Check what measurements and fields are available
 
-        return jsonify({
-            "measurements": measurements,
-            "fields_by_measurement": fields_by_measurement
-        })
+    Cached (BOTTLE_SCHEMA_REFRESH); ?refresh=1 forces a new discovery.
+    """
+    try:
+        refresh = request.args.get("refresh", "").lower() in ("1", "true", "yes")
+        return jsonify(schema_explorer.schema(refresh=refresh))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -313,78 +464,143 @@ def debug_schema():
 
 @app.route("/api/debug/data", methods=["GET"])
 def debug_data():
-    """Get sample data from all measurements"""
+    """
+    Get sample data from all measurements
+
+    ?start=-1h and ?limit=5 (at most MAX_SAMPLE_LIMIT) select the rows; ?stream=1 streams the JSON
+    object measurement by measurement as the queries finish.
+    """
+    start = request.args.get("start", "-1h")
+    if not re.fullmatch(r"-\d+(ns|us|ms|s|m|h|d|w|mo|y)", start):
+        return jsonify({"error": "start must be a relative duration such as -1h"}), 400
+    try:
+        limit = int(request.args.get("limit", 5))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    if not 1 <= limit <= MAX_SAMPLE_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {MAX_SAMPLE_LIMIT}"}), 400
+
     try:
-        # Get all measurements
-        measurements_query = f'''
-            import "influxdata/influxdb/schema"
-            schema.measurements(bucket: "{BUCKET}")
-        '''
-        measurements = []
-        measurements_result = query_api.query(measurements_query)
-        for table in measurements_result:
-            for record in table.records:
-                measurements.append(record.get_value())
-
-        # For each measurement, fetch sample data
-        sample_data = {}
-        for measurement in measurements:
-            sample_query = f'''
-                from(bucket: "{BUCKET}")
-                    |> range(start: -1h)
-                    |> filter(fn: (r) => r._measurement == "{measurement}")
-                    |> limit(n: 5)
-            '''
-            try:
-                result = query_api.query(sample_query)
-                data = []
-                for table in result:
-                    for record in table.records:
-                        data.append({
-                            "time": record.get_time().isoformat(),
-                            "measurement": record.get_measurement(),
-                            "field": record.get_field(),
-                            "value": record.get_value(),
-                            "values": dict(record.values)
-                        })
-                sample_data[measurement] = data
-            except Exception as e:
-                sample_data[measurement] = f"Error: {str(e)}"
-
-        return jsonify(sample_data)
+        if _wants_stream():
+            # Measurements are looked up before the response starts, so errors still return 500
+            schema_explorer.measurements()
+            samples = schema_explorer.sample_data(start, limit)
+            # Same JSON encoding (e.g. of datetimes) as the jsonify() response below
+            return Response(stream_with_context(stream_json_object(samples, app.json.dumps)),
+                            mimetype="application/json")
+        return jsonify(dict(schema_explorer.sample_data(start, limit, ordered=True)))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 # ----------------- Joystick Endpoint -----------------
+def query_joystick(since=None, limit=50):
+    """Joystick movements (material only) newer than `since`, newest first"""
+    # At most one incremental sync per cache TTL, shared by all requests
+    query_cache.get("joystick-history", joystick_history.sync)
+    return joystick_history.rows(since, limit)
+
 @app.route("/api/joystick", methods=["GET"])
 def get_joystick_data():
-    """Fetch the latest joystick movements (material only)"""
-    query = f'''
-        from(bucket: "{BUCKET}")
-            |> range(start: -1h)
-            |> filter(fn: (r) => r.topic == "waste_sorting/joystick")
-            |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-            |> keep(columns: ["_time", "material"])
-            |> sort(columns: ["_time"], desc: true)
-            |> limit(n: 50)
-    '''
+    """
+    Fetch the latest joystick movements (material only)
+
+    ?since=<ISO time> returns only the rows after that time (all of them,
+    newest first); otherwise the latest `limit` (default 50) rows.
+    """
     try:
-        result = query_api.query(query)
-        data = []
-        for table in result:
-            for record in table.records:
-                row = {
-                    "time": record.get_time().isoformat(),
-                    "material": record.values.get("material")
-                }
-                data.append(row)
-        return jsonify(data)
+        since = request.args.get("since")
+        since = parse_time(since) if since else None
+        limit = int(request.args.get("limit", 0 if since else 50))
+        if limit < 0:
+            raise ValueError("negative limit")
+    except ValueError:
+        return jsonify({"error": "since must be an ISO 8601 time and limit a non-negative number"}), 400
+
+    try:
+        return jsonify(query_joystick(since, limit or None))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/joystick/stats", methods=["GET"])
+def joystick_history_stats():
+    """Records in memory and incremental sync counters"""
+    return jsonify(joystick_history.stats())
+
+
+# ----------------- Server-Sent Events -----------------
+# One producer per channel, fanned out to every open dashboard (see event_stream.py)
+detection_events = Broadcaster("detections")
+joystick_events = Broadcaster("joystick")
+joystick_poller = InfluxPoller(joystick_events, "joystick", query_joystick,
+                               interval=float(os.environ.get("BOTTLE_JOYSTICK_POLL_SECONDS", "2")))
+
+def publish_job_event(job):
+    """Push a job state change; the (large) image stays in GET /api/jobs/<id>"""
+    event = job.to_dict(include_result=False)
+    if job.done and job.result:
+        event["result"] = {key: value for key, value in job.result.items() if key != "image"}
+    detection_events.publish("job", event)
+
+def _event_stream(broadcaster):
+    subscription = broadcaster.subscribe(client=request.remote_addr)
+    return Response(stream_with_context(subscription.messages()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/events/detections", methods=["GET"])
+def detection_event_stream():
+    """SSE stream of detection job updates ("job" events)"""
+    return _event_stream(detection_events)
+
+@app.route("/api/events/joystick", methods=["GET"])
+def joystick_event_stream():
+    """SSE stream of joystick / material updates ("joystick" events, newest first)"""
+    joystick_poller.start()
+    return _event_stream(joystick_events)
+
+@app.route("/api/events/stats", methods=["GET"])
+def event_stream_stats():
+    """Subscribers and per-client sent / dropped counters of every channel"""
+    return jsonify({
+        "detections": detection_events.stats(),
+        "joystick": {**joystick_events.stats(), "poller": joystick_poller.stats()},
+    })
+
+
+@app.route("/api/influx/cache", methods=["GET"])
+def influx_cache_stats():
+    """InfluxDB query and schema cache hit / miss / coalescing statistics"""
+    return jsonify({"queries": query_cache.stats(), "schema": schema_explorer.stats()})
+
+
+@app.route("/api/influx/writer", methods=["GET"])
+def influx_writer_stats():
+    """Queued / written / retried / spilled counters of the detection event writer"""
+    writer = get_detection_writer()
+    if writer is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **writer.stats()})
+
+
+# ----------------- Shutdown -----------------
+def shutdown_app(timeout=10.0):
+    """
+    Graceful shutdown (called by serve.py)
+
+    Stops running detections so their cameras are released, fails queued
+    detection jobs instead of starting them, and flushes queued InfluxDB writes.
+    """
+    print("🛑 Shutting down: stopping detections...")
+    if DETECTION_AVAILABLE and not stop_all_pipelines(timeout):
+        print(f"⚠️ Detections still running after {timeout}s")
+    job_manager.shutdown(wait=False)
+    writer = get_detection_writer()
+    if writer is not None:
+        writer.close(timeout)
+    print("✅ Shutdown complete")
+
 
 # ----------------- Health Check -----------------
 @app.route("/health", methods=["GET"])
@@ -393,5 +609,6 @@ def health_check():
 
 
 # ----------------- Run App -----------------
+# Development server with the reloader; use serve.py for production
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
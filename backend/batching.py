@@ -0,0 +1,124 @@
+"""
+Dynamic Micro-Batching for Detector Inference
+
+Callers (HTTP requests, camera loops, remote clients) each submit single
+frames. A scheduler thread collects them until either the maximum batch size
+is reached or the oldest frame has waited for the batching deadline, runs one
+forward pass over the whole batch and routes each prediction back to the
+caller that submitted it.
+
+Classes:
+    MicroBatchScheduler: Batching queue in front of a batch inference function
+"""
+
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class MicroBatchScheduler:
+    """Collect frames from concurrent callers into batched forward passes"""
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0):
+        # run_batch(list_of_frames) -> list_of_predictions, same order
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches_run = 0
+        self._frames_processed = 0
+        self._batch_sizes = Counter()
+        self._total_wait = 0.0
+        self._total_forward = 0.0
+        self._running = True
+
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, frame):
+        """Queue one frame and return a Future for its prediction"""
+        if not self._running:
+            raise RuntimeError("Batch scheduler has been stopped")
+        future = Future()
+        self._queue.put((frame, future, time.time()))
+        return future
+
+    def infer(self, frames, timeout=None):
+        """Drop-in replacement for a batch inference call"""
+        futures = [self.submit(frame) for frame in frames]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def stop(self):
+        """Stop the scheduler thread once the queued frames are processed"""
+        self._running = False
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def metrics(self):
+        """Queue depth and batch size statistics"""
+        with self._stats_lock:
+            batches = self._batches_run
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches_run": batches,
+                "frames_processed": self._frames_processed,
+                "avg_batch_size": round(self._frames_processed / batches, 2) if batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "avg_queue_wait_ms": round(self._total_wait / self._frames_processed * 1000.0, 2) if self._frames_processed else 0.0,
+                "avg_forward_ms": round(self._total_forward / batches * 1000.0, 2) if batches else 0.0,
+            }
+
+    def _collect_batch(self):
+        """Block for the first frame, then gather more until full or deadline"""
+        item = self._queue.get()
+        if item is None:
+            return []
+
+        batch = [item]
+        deadline = item[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop marker back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if not batch:
+                if not self._running:
+                    break
+                continue
+
+            frames = [frame for frame, _, _ in batch]
+            start = time.time()
+            try:
+                preds = self.run_batch(frames)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            forward_time = time.time() - start
+
+            for (_, future, _), pred in zip(batch, preds):
+                future.set_result(pred)
+
+            with self._stats_lock:
+                self._batches_run += 1
+                self._frames_processed += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._total_wait += sum(start - submitted for _, _, submitted in batch)
+                self._total_forward += forward_time
@@ -0,0 +1,551 @@
+"""
+Staged Bottle Detection Pipeline
+
+One detection loop shared by every real-time detection function:
+
+    source -> preprocess -> infer -> postprocess -> sinks
+
+The stages are run for every frame (preprocess/infer/postprocess only on
+every DETECTION_INTERVAL-th frame), then the stop policies decide whether the
+loop ends. Sinks (display window, saved-frame store, base64 event recorder,
+...) and stop policies (auto-stop, duration, max frames, manual 'q') plug in,
+so an optimization to one stage applies to all detection modes, and the
+per-stage timing is measured in one place.
+
+Optionally, detection frames with bottles are handed to an asynchronous
+material classification stage (material_classification.py) on its own worker
+thread. When its results are ready, sinks with an on_materials() method add
+'material' / 'material_confidence' to the bottle dicts they produced. With the
+fused detector (model.FusedBottleMaterialDetector) the materials come with the
+detections and are delivered right after the sinks ran.
+
+Every run also publishes its annotated frames to the live MJPEG preview of
+its frame source (live_stream.py, GET /api/stream) while someone watches. On
+a headless server set BOTTLE_HEADLESS=1 to skip the OpenCV windows. When a
+detection writer is configured (influx_writer.py), detection events are also
+written to InfluxDB in batches.
+
+Classes:
+    DetectionPipeline: The staged loop
+    PipelineState: Per-run state handed to sinks and stop policies
+    DisplaySink, SavedFramesSink, EventRecorderSink, CallbackSink: Sinks
+    (plus live_stream.StreamSink, added to every run for the MJPEG preview,
+    and influx_writer.InfluxEventSink when InfluxDB write-back is enabled)
+    AutoStop, DurationLimit, MaxFrames: Stop policies
+
+stop_all_pipelines() stops every running pipeline (their frame sources,
+e.g. the camera, are released) and refuses new runs; used on server shutdown.
+
+Preprocessing (BGR frame -> detector input tensor) lives in preprocessing.py
+and postprocessing (detector output -> structured detection array) in
+postprocessing.py. Detections stay NumPy arrays inside the pipeline and are
+converted to dicts only by the sinks that hand results to the API.
+
+Functions:
+    draw_bottles(): Draw bottle boxes on a frame
+    encode_frame_base64(): JPEG + base64 encode a frame
+    stop_all_pipelines(): Stop running pipelines and refuse new ones
+"""
+
+import base64
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from frame_source import DEFAULT_SOURCE_NAME, open_frame_source
+from influx_writer import InfluxEventSink, get_detection_writer
+from live_stream import StreamSink, get_live_stream
+from material_classification import AsyncMaterialClassifier, attach_materials
+from model_server import infer
+from postprocessing import detections_to_dicts, empty_detections, postprocess_detections, postprocess_materials
+from preprocessing import FramePreprocessor
+
+# Default detection parameters
+DETECTION_INTERVAL = 3  # Process every 3rd frame for detection
+RESIZE_WIDTH = 320  # Smaller resolution for faster processing
+RESIZE_HEIGHT = 240
+CONFIDENCE_THRESHOLD = 0.6  # Base confidence threshold
+HIGH_CONFIDENCE_THRESHOLD = 0.8  # High confidence threshold for auto-stop
+
+# No OpenCV windows (server without a display); use the /api/stream preview instead
+HEADLESS = os.environ.get("BOTTLE_HEADLESS", "0") == "1"
+
+STAGES = ("capture", "preprocess", "infer", "postprocess", "sinks")
+
+# Stream / event name of sources passed as a raw config instead of a configured name
+CUSTOM_SOURCE_NAME = "custom"
+
+# Running pipelines, so a server shutdown can stop them and release their frame sources
+_running = set()
+_running_condition = threading.Condition()
+_shutting_down = False
+
+# Drawing colors (BGR)
+HIGH_CONFIDENCE_COLOR = (0, 255, 0)  # Green
+REGULAR_CONFIDENCE_COLOR = (0, 165, 255)  # Orange
+TEXT_COLOR = (255, 255, 255)
+
+
+# ----------------- Helpers -----------------
+def draw_bottles(frame, detections, high_confidence_threshold=HIGH_CONFIDENCE_THRESHOLD,
+                 high_label="HIGH", label_background=False, font_scale=0.6):
+    """Draw bottle boxes from a detection array, highlighting high confidence ones"""
+    for (x1, y1, x2, y2), confidence in zip(detections["bbox"].tolist(), detections["confidence"].tolist()):
+        if confidence > high_confidence_threshold:
+            color = HIGH_CONFIDENCE_COLOR
+            thickness = 3
+            label_text = f"{high_label}: {confidence:.2f}"
+        else:
+            color = REGULAR_CONFIDENCE_COLOR
+            thickness = 2
+            label_text = f"Bottle: {confidence:.2f}"
+
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+
+        if label_background:
+            label_size = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 2)[0]
+            cv2.rectangle(frame, (x1, y1 - 30), (x1 + label_size[0], y1), color, -1)
+            cv2.putText(frame, label_text, (x1, y1 - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, TEXT_COLOR, 2)
+        else:
+            cv2.putText(frame, label_text, (x1, y1 - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, 2)
+    return frame
+
+
+def stop_all_pipelines(timeout=10.0):
+    """
+    Stop every running pipeline and refuse new runs (server shutdown)
+
+    Waits up to `timeout` seconds for the runs to end and release their frame
+    sources; returns True when none is left running.
+    """
+    global _shutting_down
+    with _running_condition:
+        _shutting_down = True
+        for pipeline in _running:
+            pipeline.request_stop()
+        return _running_condition.wait_for(lambda: not _running, timeout)
+
+
+def encode_frame_base64(frame, quality=90):
+    """Encode a BGR frame as a base64 JPEG string"""
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return base64.b64encode(buffer).decode('utf-8')
+
+
+# ----------------- Pipeline State -----------------
+class PipelineState:
+    """State of one pipeline run, shared with sinks and stop policies"""
+
+    def __init__(self, high_confidence_threshold):
+        self.high_confidence_threshold = high_confidence_threshold
+        self.start_time = time.time()
+
+        self.frame = None
+        self.frame_number = 0
+        self.detected = False  # Detection ran on the current frame
+        self.detections = empty_detections()  # Latest detection results
+        self.detection_ms = None  # preprocess + infer + postprocess time of the latest detection
+        self.materials_expected = False  # on_materials() will follow for the current frame
+        self.frames_with_bottles = 0
+        self.fps = 0.0
+
+        self.stop_requested = False  # Set by sinks (e.g. 'q' key)
+        self.stop_reason = None
+        self.capture_stats = {}
+        self.material_stats = {}
+
+        self.stage_time = {stage: 0.0 for stage in STAGES}
+        self.stage_calls = {stage: 0 for stage in STAGES}
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    @property
+    def high_confidence(self):
+        """Latest detections above the high confidence threshold"""
+        return self.detections[self.detections["confidence"] > self.high_confidence_threshold]
+
+    @property
+    def bottles(self):
+        """Latest detections as dicts (for API responses and printing)"""
+        return detections_to_dicts(self.detections)
+
+    def timing_report(self):
+        """Average milliseconds spent per call of each stage"""
+        return {
+            stage: round(self.stage_time[stage] / self.stage_calls[stage] * 1000.0, 2)
+            for stage in STAGES if self.stage_calls[stage]
+        }
+
+
+# ----------------- Sinks -----------------
+class CallbackSink:
+    """Call a function for every frame"""
+
+    def __init__(self, on_frame, on_close=None):
+        self._on_frame = on_frame
+        self._on_close = on_close
+
+    def on_frame(self, state):
+        self._on_frame(state)
+
+    def close(self, state):
+        if self._on_close is not None:
+            self._on_close(state)
+
+
+class DisplaySink:
+    """
+    Show annotated frames in an OpenCV window; 'q' requests a manual stop
+
+    If the run ends through auto-stop, the last frame can be kept on screen
+    for hold_seconds with hold_text drawn on it before the window closes.
+    """
+
+    def __init__(self, window_name, overlay=None, position=None, hold_seconds=0, hold_text=None):
+        self.window_name = window_name
+        # overlay(state, display_frame) draws boxes and status text
+        self.overlay = overlay or (lambda state, display_frame: draw_bottles(
+            display_frame, state.detections, state.high_confidence_threshold))
+        self.position = position
+        self.hold_seconds = hold_seconds
+        self.hold_text = hold_text
+        self.display_frame = None
+
+    def on_frame(self, state):
+        if HEADLESS:
+            return
+        if self.display_frame is None and self.position is not None:
+            cv2.namedWindow(self.window_name, cv2.WINDOW_AUTOSIZE)
+            cv2.moveWindow(self.window_name, *self.position)
+
+        self.display_frame = state.frame.copy()
+        self.overlay(state, self.display_frame)
+        cv2.imshow(self.window_name, self.display_frame)
+
+        # Handle key presses
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            state.stop_requested = True
+
+    def close(self, state):
+        if HEADLESS:
+            return
+        if self.hold_seconds and self.display_frame is not None and state.stop_reason == AutoStop.reason:
+            if self.hold_text:
+                cv2.putText(self.display_frame, self.hold_text, (50, 50),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, HIGH_CONFIDENCE_COLOR, 3)
+            cv2.imshow(self.window_name, self.display_frame)
+            cv2.waitKey(int(self.hold_seconds * 1000))
+        cv2.destroyAllWindows()
+
+
+class SavedFramesSink:
+    """
+    Store frames with bottle detections
+
+    store(frame, detection_results) is called for every detection frame with
+    at least one bottle above min_confidence (see object_detection_1.py for
+    the saved_frames deque it feeds).
+    """
+
+    def __init__(self, store, min_confidence=CONFIDENCE_THRESHOLD, annotate=False, history=16):
+        self.store = store
+        self.min_confidence = min_confidence
+        self.annotate = annotate
+        self.count = 0
+        self.last_frame = None
+        self.last_results = None
+        # Recent results by frame number, for late material results
+        self._recent = deque(maxlen=history)
+
+    def on_frame(self, state):
+        if not state.detected:
+            return
+        detections = state.detections[state.detections["confidence"] > self.min_confidence]
+        if not len(detections):
+            return
+
+        frame = state.frame.copy()
+        if self.annotate:
+            draw_bottles(frame, detections, self.min_confidence, high_label="Bottle", font_scale=0.7)
+
+        self.last_results = {
+            'bottle_count': len(detections),
+            'bottles': detections_to_dicts(detections),
+            'timestamp': time.time(),
+            'frame_number': state.frame_number
+        }
+        self.last_frame = frame
+        self.count += 1
+        self._recent.append(self.last_results)
+        self.store(frame, self.last_results)
+
+    def on_materials(self, frame_number, detections, materials):
+        for results in list(self._recent):
+            if results['frame_number'] == frame_number:
+                attach_materials(results['bottles'], detections, materials)
+
+
+class EventRecorderSink:
+    """Record every detection with bottles as a base64 JPEG event"""
+
+    def __init__(self, min_confidence=CONFIDENCE_THRESHOLD, quality=95):
+        self.min_confidence = min_confidence
+        self.quality = quality
+        self.events = []
+
+    def on_frame(self, state):
+        if not state.detected:
+            return
+        detections = state.detections[state.detections["confidence"] > self.min_confidence]
+        if not len(detections):
+            return
+
+        detection_frame = state.frame.copy()
+        for x1, y1, x2, y2 in detections["bbox"].tolist():
+            cv2.rectangle(detection_frame, (x1, y1), (x2, y2), HIGH_CONFIDENCE_COLOR, 2)
+
+        self.events.append({
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "bottle_count": len(detections),
+            "bottles": detections_to_dicts(detections),
+            "image": f"data:image/jpeg;base64,{encode_frame_base64(detection_frame, self.quality)}",
+            "frame_number": state.frame_number
+        })
+
+    def on_materials(self, frame_number, detections, materials):
+        for event in reversed(self.events):
+            if event["frame_number"] == frame_number:
+                attach_materials(event["bottles"], detections, materials)
+                break
+
+    def best_event(self):
+        """Event with the highest single-bottle confidence"""
+        if not self.events:
+            return None
+        return max(self.events, key=lambda event: max(b['confidence'] for b in event['bottles']))
+
+
+# ----------------- Stop Policies -----------------
+class AutoStop:
+    """Stop on the first detection with a high confidence bottle"""
+
+    reason = "auto-stop"
+
+    def should_stop(self, state):
+        return state.detected and len(state.high_confidence) > 0
+
+
+class DurationLimit:
+    """Stop after a fixed number of seconds"""
+
+    reason = "duration"
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def should_stop(self, state):
+        return state.elapsed >= self.seconds
+
+
+class MaxFrames:
+    """Stop after a fixed number of frames"""
+
+    reason = "max-frames"
+
+    def __init__(self, max_frames):
+        self.max_frames = max_frames
+
+    def should_stop(self, state):
+        return state.frame_number >= self.max_frames
+
+
+# ----------------- Pipeline -----------------
+class DetectionPipeline:
+    """
+    source -> preprocess -> infer -> postprocess -> sinks, until a stop policy fires
+
+    A manual stop (state.stop_requested, e.g. the display window's 'q' key)
+    and the end of the frame source always end the run, as does request_stop()
+    from another thread (see stop_all_pipelines()).
+
+    With a material_classifier, bottle crops are classified on a worker
+    thread; the run waits up to material_timeout seconds at the end for
+    pending crops so the final results carry their materials.
+
+    Annotated frames go to the source's live stream (stream_overlay draws
+    them, default: bottle boxes); live_stream=False turns this off.
+    source_name is the configured name of `source` (frame_source.NAMED_SOURCES)
+    and names its live stream; sources given as raw configs (CLI tools) run
+    as CUSTOM_SOURCE_NAME.
+    """
+
+    def __init__(self, source=None, sinks=(), stop_policies=(),
+                 detection_interval=DETECTION_INTERVAL,
+                 resize=(RESIZE_WIDTH, RESIZE_HEIGHT),
+                 confidence_threshold=CONFIDENCE_THRESHOLD,
+                 high_confidence_threshold=HIGH_CONFIDENCE_THRESHOLD,
+                 backend=None, material_classifier=None, material_timeout=2.0,
+                 live_stream=True, stream_overlay=None, source_name=None):
+        self.source = source
+        self.source_name = source_name or (DEFAULT_SOURCE_NAME if source is None else CUSTOM_SOURCE_NAME)
+        self.sinks = list(sinks)
+        if live_stream:
+            self.sinks.append(StreamSink(get_live_stream(self.source_name), stream_overlay))
+        writer = get_detection_writer()
+        if writer is not None:
+            # Tagged with the name: never write source URLs (credentials) or paths to InfluxDB
+            self.sinks.append(InfluxEventSink(writer, {"source": self.source_name, "backend": backend}))
+        self.stop_policies = list(stop_policies)
+        self.detection_interval = detection_interval
+        self.resize_width, self.resize_height = resize
+        self.confidence_threshold = confidence_threshold
+        self.high_confidence_threshold = high_confidence_threshold
+        # Detector backend (see model.MODEL_BACKENDS); None uses the configured default
+        self.backend = backend
+        self.material_classifier = material_classifier
+        self.material_timeout = material_timeout
+        self.preprocess = FramePreprocessor(self.resize_width, self.resize_height)
+        self.cap = None
+        self._stop = threading.Event()
+
+    def request_stop(self):
+        """Ask a running loop to end after the current frame (thread-safe)"""
+        self._stop.set()
+
+    def open(self):
+        """Open the frame source; returns False if it is not available"""
+        self.cap = open_frame_source(self.source)
+        if not self.cap.isOpened():
+            self.cap.release()
+            return False
+        return True
+
+    def _materials_ready(self, frame_number, detections):
+        """Callback for the material worker: hand the results to the sinks"""
+        def deliver(materials):
+            for sink in self.sinks:
+                on_materials = getattr(sink, "on_materials", None)
+                if on_materials is not None:
+                    on_materials(frame_number, detections, materials)
+        return deliver
+
+    def _timed(self, state, stage, start):
+        now = time.time()
+        state.stage_time[stage] += now - start
+        state.stage_calls[stage] += 1
+        return now
+
+    def run(self):
+        """Run the loop until a stop policy fires; returns the PipelineState"""
+        with _running_condition:
+            if _shutting_down:
+                raise RuntimeError("Detection is shutting down")
+            _running.add(self)
+        try:
+            return self._run()
+        finally:
+            with _running_condition:
+                _running.discard(self)
+                _running_condition.notify_all()
+
+    def _run(self):
+        if self.cap is None and not self.open():
+            raise RuntimeError("Could not open frame source")
+
+        state = PipelineState(self.high_confidence_threshold)
+        materials = None
+        if self.material_classifier is not None:
+            materials = AsyncMaterialClassifier(self.material_classifier)
+        fps_counter = 0
+        fps_start_time = time.time()
+
+        try:
+            while not state.stop_requested:
+                if self._stop.is_set():
+                    state.stop_reason = "shutdown"
+                    break
+                start = time.time()
+
+                # Capture frame
+                ret, frame = self.cap.read()
+                if not ret:
+                    state.stop_reason = "source-ended"
+                    break
+                start = self._timed(state, "capture", start)
+
+                state.frame = frame
+                state.frame_number += 1
+                state.detected = False
+                state.materials_expected = False
+                fused_materials = None
+
+                # Only run detection every detection_interval frames
+                if state.frame_number % self.detection_interval == 0:
+                    detection_start = start
+                    img_tensor = self.preprocess(frame)
+                    start = self._timed(state, "preprocess", start)
+
+                    preds = infer([img_tensor], backend=self.backend)
+                    start = self._timed(state, "infer", start)
+
+                    state.detections = postprocess_detections(
+                        preds[0], frame.shape, (self.resize_width, self.resize_height),
+                        self.confidence_threshold
+                    )
+                    state.detected = True
+                    if len(state.detections):
+                        state.frames_with_bottles += 1
+                        if "materials" in preds[0]:
+                            # Fused detector: materials computed with the detections
+                            fused_materials = postprocess_materials(preds[0], self.confidence_threshold)
+                            state.materials_expected = True
+                        elif materials is not None:
+                            # Classified on the worker thread; the loop does not wait
+                            materials.submit(frame, state.detections["bbox"],
+                                             self._materials_ready(state.frame_number, state.detections))
+                            state.materials_expected = True
+                    start = self._timed(state, "postprocess", start)
+                    state.detection_ms = (start - detection_start) * 1000.0
+
+                # FPS tracking
+                fps_counter += 1
+                if time.time() - fps_start_time >= 1.0:
+                    state.fps = fps_counter / (time.time() - fps_start_time)
+                    fps_counter = 0
+                    fps_start_time = time.time()
+
+                for sink in self.sinks:
+                    sink.on_frame(state)
+                if fused_materials is not None:
+                    self._materials_ready(state.frame_number, state.detections)(fused_materials)
+                self._timed(state, "sinks", start)
+
+                if state.stop_requested:
+                    state.stop_reason = "manual"
+                    break
+                for policy in self.stop_policies:
+                    if policy.should_stop(state):
+                        state.stop_reason = policy.reason
+                        break
+                if state.stop_reason:
+                    break
+        finally:
+            state.capture_stats = self.cap.stats()
+            self.cap.release()
+            self.cap = None
+            if materials is not None:
+                materials.close(self.material_timeout)
+                state.material_stats = materials.stats()
+            for sink in self.sinks:
+                close = getattr(sink, "close", None)
+                if close is not None:
+                    close(state)
+
+        return state
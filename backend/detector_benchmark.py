@@ -0,0 +1,177 @@
+"""
+Detector Accuracy / Latency Comparison
+
+Runs several detector configurations over a local image set, resized to the
+320x240 input used by the real-time pipeline, and reports latency and
+box-level agreement with a baseline configuration.
+
+Agreement is measured on bottle detections above the confidence threshold:
+boxes are matched greedily at IoU >= 0.5, recall is the share of baseline
+boxes that were found, precision the share of candidate boxes that match a
+baseline box.
+
+Usage:
+    python detector_benchmark.py path/to/images [--limit 50]
+    python detector_benchmark.py path/to/images --backends    # Compare model backends
+
+Functions:
+    load_benchmark_frames(): Image directory -> detector input tensors
+    time_detector(): Run a detector on every frame and record latencies
+    box_agreement(): Compare two sets of predictions
+    compare_detectors(): Benchmark named detectors against a baseline
+"""
+
+import time
+
+import numpy as np
+import torch
+from torchvision.ops import box_iou
+
+from frame_source import ImageDirectorySource
+from postprocessing import postprocess_detections
+from preprocessing import FramePreprocessor, RESIZE_HEIGHT, RESIZE_WIDTH
+
+
+def load_benchmark_frames(image_dir, limit=None, width=RESIZE_WIDTH, height=RESIZE_HEIGHT):
+    """Read and preprocess the images of a directory like the real-time pipeline"""
+    source = ImageDirectorySource(image_dir)
+    preprocess = FramePreprocessor(width, height)
+
+    tensors = []
+    for frame in source:
+        # The preprocessor reuses its buffer, so keep a copy per frame
+        tensors.append(preprocess(frame).clone())
+        if limit is not None and len(tensors) >= limit:
+            break
+    return tensors
+
+
+def time_detector(detector, tensors, warmup=2):
+    """Run detector([tensor]) on every frame; returns predictions and latencies (s)"""
+    with torch.inference_mode():
+        for tensor in tensors[:warmup]:
+            detector([tensor])
+
+        preds, latencies = [], []
+        for tensor in tensors:
+            start = time.perf_counter()
+            preds.append(detector([tensor])[0])
+            latencies.append(time.perf_counter() - start)
+    return preds, latencies
+
+
+def box_agreement(reference, candidate, confidence_threshold=0.6, iou_threshold=0.5):
+    """Recall / precision / IoU / score agreement of bottle boxes between two runs"""
+    matched = ref_total = cand_total = 0
+    ious, score_diffs = [], []
+
+    for ref_pred, cand_pred in zip(reference, candidate):
+        ref = postprocess_detections(ref_pred, None, confidence_threshold=confidence_threshold)
+        cand = postprocess_detections(cand_pred, None, confidence_threshold=confidence_threshold)
+        ref_total += len(ref)
+        cand_total += len(cand)
+        if not len(ref) or not len(cand):
+            continue
+
+        iou = box_iou(torch.from_numpy(ref["bbox"]).float(), torch.from_numpy(cand["bbox"]).float())
+        # Degenerate (zero-area) boxes give NaN overlaps
+        iou = torch.nan_to_num(iou, nan=0.0)
+        # Greedy one-to-one matching, best overlaps first
+        while True:
+            best = iou.max()
+            if best < iou_threshold:
+                break
+            i, j = divmod(int(iou.argmax()), iou.shape[1])
+            matched += 1
+            ious.append(best.item())
+            score_diffs.append(abs(float(ref["confidence"][i]) - float(cand["confidence"][j])))
+            iou[i, :] = -1
+            iou[:, j] = -1
+
+    return {
+        "reference_boxes": ref_total,
+        "candidate_boxes": cand_total,
+        "recall": matched / ref_total if ref_total else 1.0,
+        "precision": matched / cand_total if cand_total else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "mean_score_diff": float(np.mean(score_diffs)) if score_diffs else None,
+    }
+
+
+def latency_stats(latencies):
+    """Mean / median / p95 latency in ms and throughput in frames/s"""
+    ms = np.array(latencies) * 1000.0
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "fps": float(1000.0 / ms.mean()),
+    }
+
+
+def compare_detectors(detectors, tensors, baseline=None, confidence_threshold=0.6):
+    """
+    Benchmark named detectors on the same frames
+
+    `detectors` maps a name to a callable taking a list of tensors and
+    returning torchvision-style predictions. Agreement is reported against
+    `baseline` (default: the first detector).
+    """
+    baseline = baseline or next(iter(detectors))
+    results = {}
+    for name, detector in detectors.items():
+        print(f"⏱️  Running {name} on {len(tensors)} frames...")
+        preds, latencies = time_detector(detector, tensors)
+        results[name] = {"preds": preds, **latency_stats(latencies)}
+
+    base = results[baseline]
+    print(f"\n📊 DETECTOR COMPARISON (baseline: {baseline}, {len(tensors)} frames)")
+    print(f"{'config':<40}{'mean ms':>9}{'p95 ms':>9}{'FPS':>7}{'speedup':>9}{'recall':>8}{'precision':>11}{'IoU':>7}")
+    print("-" * 100)
+    for name, result in results.items():
+        agreement = box_agreement(base["preds"], result["preds"], confidence_threshold)
+        result.update(agreement)
+        result["speedup"] = base["mean_ms"] / result["mean_ms"]
+        mean_iou = f"{agreement['mean_iou']:.3f}" if agreement["mean_iou"] is not None else "-"
+        print(f"{name:<40}{result['mean_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['fps']:>7.1f}"
+              f"{result['speedup']:>8.2f}x{agreement['recall']:>8.3f}{agreement['precision']:>11.3f}{mean_iou:>7}")
+
+    for result in results.values():
+        del result["preds"]
+    return results
+
+
+def main():
+    import argparse
+
+    from model import MODEL_BACKENDS, load_model
+
+    parser = argparse.ArgumentParser(description="Compare bottle-only / tuned detector configs with the baseline")
+    parser.add_argument("image_dir", help="Directory of test images")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of images")
+    parser.add_argument("--threshold", type=float, default=0.6, help="Confidence threshold for agreement")
+    parser.add_argument("--backends", action="store_true",
+                        help="Compare the model backends with ResNet-50 instead of the tuning configs")
+    args = parser.parse_args()
+
+    tensors = load_benchmark_frames(args.image_dir, args.limit)
+    if not tensors:
+        print(f"❌ No images found in {args.image_dir}")
+        return
+
+    if args.backends:
+        # Each backend with its torchvision defaults, ResNet-50 Faster R-CNN first as the baseline
+        detectors = {backend: load_model(backend, bottle_only=False) for backend in MODEL_BACKENDS}
+    else:
+        detectors = {
+            "baseline (91 classes)": load_model(bottle_only=False),
+            "bottle-only": load_model(bottle_only=True),
+            "bottle-only + 300 proposals": load_model(bottle_only=True, rpn_post_nms_top_n_test=300),
+            "bottle-only + native size": load_model(bottle_only=True, rpn_post_nms_top_n_test=300,
+                                                    min_size=RESIZE_HEIGHT, max_size=RESIZE_WIDTH),
+        }
+    compare_detectors(detectors, tensors, confidence_threshold=args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Server-Sent Events Broadcasting
+
+Pushes detection and joystick / material updates to the dashboards instead
+of every open page polling the API (and InfluxDB) every few seconds.
+
+One producer publishes each event once to a Broadcaster, which fans it out
+to every subscribed client. Each client has its own bounded queue: a slow
+client never blocks the producer or the other clients; when its queue is
+full the oldest waiting event is dropped and counted for that client. The
+latest event of each type is replayed to new subscribers, so a dashboard
+shows the current state as soon as it connects.
+
+The joystick producer (InfluxPoller) runs one InfluxDB query per interval
+while at least one client is subscribed, no matter how many dashboards are
+open, and only publishes when the result changed.
+
+Classes:
+    Broadcaster: Fan-out of published events to subscriber queues
+    Subscription: One client's queue and counters, iterable as SSE text
+    InfluxPoller: Background thread publishing query results on change
+
+Functions:
+    format_sse(): Encode one event in the text/event-stream format
+"""
+
+import itertools
+import json
+import queue
+import threading
+import time
+
+SUBSCRIBER_QUEUE_SIZE = 64
+HEARTBEAT_SECONDS = 15.0
+
+
+def format_sse(data, event=None, event_id=None):
+    """One text/event-stream message (data is JSON-encoded)"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'), default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    """A client's bounded event queue; iterate it to get SSE messages"""
+
+    def __init__(self, broadcaster, subscriber_id, client=None, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.broadcaster = broadcaster
+        self.id = subscriber_id
+        self.client = client
+        self.queue = queue.Queue(maxsize)
+        self.connected = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, message):
+        """Queue a message without blocking, dropping the oldest one when full"""
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def __iter__(self):
+        return self.messages()
+
+    def messages(self, heartbeat=HEARTBEAT_SECONDS):
+        """SSE messages until closed; comment lines keep idle connections alive"""
+        try:
+            yield "retry: 3000\n\n"
+            while not self.closed:
+                try:
+                    message = self.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                self.sent += 1
+                yield message
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broadcaster.unsubscribe(self)
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "client": self.client,
+            "connected_s": round(time.time() - self.connected, 1),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+        }
+
+
+class Broadcaster:
+    """Fan out published events to all subscribers of one channel"""
+
+    def __init__(self, name, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.name = name
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._event_ids = itertools.count(1)
+        self.published = 0
+        self.total_dropped = 0
+
+    def subscribe(self, client=None):
+        """New subscription, primed with the latest event of every type"""
+        with self._lock:
+            subscription = Subscription(self, next(self._ids), client, self.queue_size)
+            for message in self._latest.values():
+                subscription.put(message)
+            self._subscribers[subscription.id] = subscription
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if self._subscribers.pop(subscription.id, None) is not None:
+                self.total_dropped += subscription.dropped
+
+    def publish(self, event, data):
+        """Encode the event once and queue it for every subscriber"""
+        with self._lock:
+            message = format_sse(data, event, next(self._event_ids))
+            self._latest[event] = message
+            self.published += 1
+            subscribers = list(self._subscribers.values())
+        for subscription in subscribers:
+            subscription.put(message)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def close(self):
+        """Disconnect all subscribers"""
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for subscription in subscribers:
+            subscription.put(None)
+
+    def stats(self):
+        with self._lock:
+            clients = [subscription.stats() for subscription in self._subscribers.values()]
+        return {
+            "channel": self.name,
+            "subscribers": len(clients),
+            "published": self.published,
+            "dropped_disconnected": self.total_dropped,
+            "clients": clients,
+        }
+
+
+class InfluxPoller:
+    """
+    Publish the result of query() every `interval` seconds while anyone listens
+
+    The thread starts with the first start() call and idles while the
+    broadcaster has no subscribers. Unchanged results are not republished.
+    """
+
+    def __init__(self, broadcaster, event, query, interval=2.0):
+        self.broadcaster = broadcaster
+        self.event = event
+        self.query = query
+        self.interval = interval
+        self.queries = 0
+        self.errors = 0
+        self._last = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the thread (once) and poll right away for a new subscriber"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"{self.event}-poller", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self.broadcaster.subscriber_count:
+                continue
+            try:
+                data = self.query()
+                self.queries += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ {self.event} poll failed: {e}")
+                continue
+            if data != self._last:
+                self._last = data
+                self.broadcaster.publish(self.event, data)
+
+    def stats(self):
+        return {"interval_s": self.interval, "queries": self.queries, "errors": self.errors}
@@ -0,0 +1,286 @@
+"""
+TorchScript / ONNX Export and ONNX Runtime Inference
+
+Exports the bottle detector (model.py) and the material classifier
+(object_detection_2.py) to TorchScript and ONNX files, and runs them without
+the eager torchvision Python code.
+
+Runtimes (BOTTLE_MODEL_RUNTIME):
+- torch: eager PyTorch (default)
+- torchscript: torch.jit.load of the scripted detector / traced classifier
+- onnxruntime: ONNX Runtime CPU session; thread pools are set with
+  BOTTLE_ORT_INTRA_OP_THREADS / BOTTLE_ORT_INTER_OP_THREADS (0 = ORT default)
+
+The exported models take and return the same things as the PyTorch ones
+(a list of CHW tensors -> list of boxes / labels / scores dicts, and an
+NCHW batch -> logits), so get_model() / load_material_classifier() swap
+them in transparently. Missing artifacts are exported on first use into
+models/exported/; export them ahead of time on the target machine to skip
+the PyTorch weights entirely at startup.
+
+The exports are made from the fp32 model: the INT8 builds of
+optimize_model.py are not exportable to ONNX.
+
+Usage:
+    python export_models.py [--backend NAME] [--material-checkpoint PATH] [--verify path/to/images]
+
+Classes:
+    OnnxRuntimeDetector: ONNX Runtime session with the detector call signature
+    OnnxRuntimeClassifier: ONNX Runtime session with the classifier call signature
+
+Functions:
+    export_detector(): Write the TorchScript / ONNX detector
+    export_material_classifier(): Write the TorchScript / ONNX classifier
+    load_exported_detector(): Load (exporting if needed) a detector for a runtime
+    load_exported_material_classifier(): Same for the material classifier
+"""
+
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from material_classification import MATERIAL_INPUT_SIZE
+from model import BottleOnlyDetector, FusedBottleMaterialDetector, artifact_path, load_model, model_dir, resolve_backend
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+EXPORT_DIR = os.path.join(model_dir, "exported")
+EXTENSIONS = {"torchscript": ".pt", "onnxruntime": ".onnx"}
+
+ORT_INTRA_OP_THREADS = int(os.environ.get("BOTTLE_ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.environ.get("BOTTLE_ORT_INTER_OP_THREADS", "0"))
+
+# Detector input used for tracing (height, width); the ONNX graph accepts any size
+EXPORT_SIZE = (240, 320)
+ONNX_OPSET = 17
+
+
+class ScriptableDetector(nn.Module):
+    """
+    TorchScript entry point for a torchvision detector
+
+    Scripted detectors return (losses, detections); this keeps the eager
+    list-of-dicts interface and the bottle label of BottleOnlyDetector (or
+    `label`, for a bottle-only detector already unwrapped). Only meant to be
+    scripted, not run eagerly.
+    """
+
+    def __init__(self, detector, label=None):
+        super().__init__()
+        self.label = -1 if label is None else label
+        if isinstance(detector, BottleOnlyDetector):
+            self.label = detector.label
+            detector = detector.detector
+        self.detector = detector
+
+    def forward(self, images: List[torch.Tensor]) -> List[Dict[str, torch.Tensor]]:
+        _, detections = self.detector(images)
+        if self.label >= 0:
+            for detection in detections:
+                detection["labels"] = torch.full_like(detection["labels"], self.label)
+        return detections
+
+
+class OnnxDetector(nn.Module):
+    """
+    ONNX export entry point: one CHW image -> (boxes, labels, scores)
+
+    `label` maps the sliced head's class of an unwrapped bottle-only
+    detector back to the COCO bottle id (see BottleOnlyDetector).
+    """
+
+    def __init__(self, detector, label=None):
+        super().__init__()
+        self.detector = detector
+        self.label = label
+
+    def forward(self, image):
+        pred = self.detector([image])[0]
+        labels = pred["labels"]
+        if self.label is not None:
+            labels = torch.full_like(labels, self.label)
+        return pred["boxes"], labels, pred["scores"]
+
+
+def _session_options(intra_op_threads=None, inter_op_threads=None):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = ORT_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    options.inter_op_num_threads = ORT_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+    return options
+
+
+class OnnxRuntimeDetector:
+    """Runs an exported detector with ONNX Runtime, called like the torch model"""
+
+    def __init__(self, path, intra_op_threads=None, inter_op_threads=None):
+        self.path = path
+        self.session = ort.InferenceSession(path, _session_options(intra_op_threads, inter_op_threads),
+                                            providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images):
+        # The graph takes a single image; batches run frame by frame
+        preds = []
+        for image in images:
+            boxes, labels, scores = self.session.run(None, {self.input_name: image.detach().cpu().numpy()})
+            preds.append({
+                "boxes": torch.from_numpy(boxes),
+                "labels": torch.from_numpy(labels),
+                "scores": torch.from_numpy(scores),
+            })
+        return preds
+
+    def eval(self):
+        return self
+
+
+class OnnxRuntimeClassifier:
+    """Runs an exported material classifier with ONNX Runtime: NCHW batch -> logits"""
+
+    def __init__(self, path, intra_op_threads=None, inter_op_threads=None):
+        self.path = path
+        self.session = ort.InferenceSession(path, _session_options(intra_op_threads, inter_op_threads),
+                                            providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        array = np.ascontiguousarray(batch.detach().cpu().numpy(), dtype=np.float32)
+        return torch.from_numpy(self.session.run(None, {self.input_name: array})[0])
+
+    def eval(self):
+        return self
+
+
+# ----------------- Export -----------------
+def export_detector(detector, runtime, path):
+    """Write a detector as TorchScript (runtime="torchscript") or ONNX ("onnxruntime")"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    detector.eval()
+    label = None
+    if isinstance(detector, FusedBottleMaterialDetector):
+        print("⚠️ The fused material head is not exported; exporting the detector only")
+        # The fused detector has already unwrapped BottleOnlyDetector; keep its label
+        label = detector.label
+        detector = detector.detector
+    if runtime == "torchscript":
+        torch.jit.save(torch.jit.script(ScriptableDetector(detector, label)), path)
+    else:
+        # The legacy (TorchScript-based) exporter handles the detectors' control flow
+        torch.onnx.export(OnnxDetector(detector, label), (torch.zeros(3, *EXPORT_SIZE),), path,
+                          opset_version=ONNX_OPSET, input_names=["image"],
+                          output_names=["boxes", "labels", "scores"],
+                          dynamic_axes={"image": [1, 2], "boxes": [0], "labels": [0], "scores": [0]},
+                          dynamo=False)
+    return path
+
+
+def export_material_classifier(classifier, runtime, path):
+    """Write the material classifier as TorchScript or ONNX with a dynamic batch size"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    classifier.eval()
+    example = torch.zeros(1, 3, MATERIAL_INPUT_SIZE, MATERIAL_INPUT_SIZE)
+    if runtime == "torchscript":
+        with torch.no_grad():
+            torch.jit.save(torch.jit.trace(classifier, example), path)
+    else:
+        torch.onnx.export(classifier, (example,), path, opset_version=ONNX_OPSET,
+                          input_names=["input"], output_names=["logits"],
+                          dynamic_axes={"input": [0], "logits": [0]}, dynamo=False)
+    return path
+
+
+def _check_runtime(runtime):
+    if runtime not in EXTENSIONS:
+        raise ValueError(f"Unknown model runtime '{runtime}'. Available: torch, {', '.join(EXTENSIONS)}")
+    if runtime == "onnxruntime" and not ONNXRUNTIME_AVAILABLE:
+        print("⚠️ onnxruntime not installed, using the PyTorch model")
+        return False
+    return True
+
+
+def _load_artifact(path, runtime, session_class):
+    start = time.time()
+    if runtime == "torchscript":
+        loaded = torch.jit.load(path, map_location="cpu").eval()
+    else:
+        loaded = session_class(path)
+    print(f"✅ Loaded {runtime} model {path} in {time.time() - start:.2f}s")
+    return loaded
+
+
+def detector_artifact_path(backend, runtime, **overrides):
+    from optimize_model import detector_key
+
+    return artifact_path(EXPORT_DIR, backend, detector_key(**overrides), EXTENSIONS[runtime])
+
+
+def load_exported_detector(backend=None, runtime="onnxruntime", rebuild=False, **overrides):
+    """Load the detector for a runtime, exporting the PyTorch model on a cache miss"""
+    backend = resolve_backend(backend)
+    if not _check_runtime(runtime):
+        return load_model(backend, **overrides)
+
+    path = detector_artifact_path(backend, runtime, **overrides)
+    if rebuild or not os.path.exists(path):
+        start = time.time()
+        export_detector(load_model(backend, **overrides), runtime, path)
+        print(f"📦 Exported {backend} for {runtime} in {time.time() - start:.2f}s: {path}")
+    return _load_artifact(path, runtime, OnnxRuntimeDetector)
+
+
+def load_exported_material_classifier(checkpoint_path=None, runtime="onnxruntime", rebuild=False):
+    """Load the material classifier for a runtime, exporting it on a cache miss"""
+    from object_detection_2 import load_material_classifier
+    from optimize_model import file_digest
+
+    if not _check_runtime(runtime):
+        return load_material_classifier(checkpoint_path, optimized=False, runtime="torch")
+
+    path = artifact_path(EXPORT_DIR, "material_classifier", {"checkpoint": file_digest(checkpoint_path)},
+                         EXTENSIONS[runtime])
+    if rebuild or not os.path.exists(path):
+        classifier = load_material_classifier(checkpoint_path, optimized=False, runtime="torch")
+        export_material_classifier(classifier, runtime, path)
+        print(f"📦 Exported material classifier for {runtime}: {path}")
+    return _load_artifact(path, runtime, OnnxRuntimeClassifier)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the detector / material classifier to TorchScript and ONNX")
+    parser.add_argument("--backend", default=None, help="Detector backend (default: BOTTLE_MODEL_BACKEND)")
+    parser.add_argument("--material-checkpoint", default=None, help="Trained material classifier weights")
+    parser.add_argument("--runtime", action="append", choices=list(EXTENSIONS),
+                        help="Runtime to export for (repeatable, default: all)")
+    parser.add_argument("--verify", metavar="IMAGE_DIR", default=None,
+                        help="Compare latency / box agreement of the exports with eager PyTorch")
+    args = parser.parse_args()
+
+    runtimes = [runtime for runtime in args.runtime or list(EXTENSIONS) if _check_runtime(runtime)]
+    detectors = {"torch": load_model(args.backend)}
+    for runtime in runtimes:
+        detectors[runtime] = load_exported_detector(args.backend, runtime, rebuild=True)
+        load_exported_material_classifier(args.material_checkpoint, runtime, rebuild=True)
+
+    if args.verify:
+        from detector_benchmark import compare_detectors, load_benchmark_frames
+
+        tensors = load_benchmark_frames(args.verify)
+        if not tensors:
+            print(f"❌ No images found in {args.verify}")
+            return
+        compare_detectors(detectors, tensors)
+
+
+if __name__ == "__main__":
+    main()
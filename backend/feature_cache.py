@@ -0,0 +1,163 @@
+"""
+Persistent Backbone Feature Cache for Material-Classifier Training
+
+With a frozen backbone, only the final layer of the material classifier
+learns, yet every epoch re-decodes the JPEGs and re-runs ResNet-50. This
+module runs the frozen backbone once per image and stores the 2048-d
+embeddings in a memory-mapped .npy file, so the final layer trains from the
+cache in seconds and later runs only process new or changed images.
+
+Layout (one directory per ImageFolder split, e.g. cache/train/):
+    features.npy   float32 [num_images, views, 2048], opened with mmap
+    index.json     {"key": {...}, "files": [[sha1, label], ...]} row order
+
+Rows are keyed by the SHA-1 of the image file contents: unchanged images keep
+their features, edited or new images are recomputed and deleted ones are
+dropped when the cache is rewritten. A change of backbone, view count or
+torch version invalidates the whole split.
+
+View 0 of every image uses the deterministic validation preprocessing; views
+1..N-1 are random training augmentations, and CachedFeatureDataset samples
+one view per image and epoch for light augmentation.
+
+Classes:
+    CachedFeatureDataset: (features, label) samples from a cached split
+
+Functions:
+    build_feature_cache(): Create / update the cache of one split
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets
+
+INDEX_FILE = "index.json"
+FEATURES_FILE = "features.npy"
+
+
+def _file_sha1(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class _ViewDataset(Dataset):
+    """Images to embed: (path, view) pairs, view 0 with the val transform"""
+
+    def __init__(self, items, val_transform, train_transform):
+        self.items = items
+        self.val_transform = val_transform
+        self.train_transform = train_transform
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        path, view = self.items[i]
+        image = Image.open(path).convert("RGB")
+        transform = self.val_transform if view == 0 else self.train_transform
+        return transform(image)
+
+
+def _load_index(split_dir, key):
+    """Existing index entries and features, if the cache matches the key"""
+    index_path = os.path.join(split_dir, INDEX_FILE)
+    features_path = os.path.join(split_dir, FEATURES_FILE)
+    if not (os.path.exists(index_path) and os.path.exists(features_path)):
+        return [], None
+    with open(index_path) as f:
+        index = json.load(f)
+    if index.get("key") != key:
+        print(f"♻️ Feature cache settings changed, rebuilding {split_dir}")
+        return [], None
+    return index["files"], np.load(features_path, mmap_mode="r")
+
+
+def build_feature_cache(backbone, split_dir, cache_dir, val_transform, train_transform=None, views=1,
+                        batch_size=64, num_workers=4, device="cpu", key=None):
+    """
+    Embed every image of an ImageFolder split with the frozen backbone
+
+    Only images whose contents are not in the cache yet go through the
+    backbone. Returns (features, labels, classes) with features as a
+    read-only memory-mapped [N, views, 2048] array.
+    """
+    device = torch.device(device)
+    folder = datasets.ImageFolder(split_dir)
+    key = {**(key or {}), "views": views, "torch": torch.__version__}
+    os.makedirs(cache_dir, exist_ok=True)
+
+    start = time.time()
+    hashes = [_file_sha1(path) for path, _ in folder.samples]
+    files = [[sha, label] for sha, (_, label) in zip(hashes, folder.samples)]
+    old_files, old_features = _load_index(cache_dir, key)
+    old_rows = {sha: row for row, (sha, _) in enumerate(old_files)}
+    missing = [i for i, sha in enumerate(hashes) if sha not in old_rows]
+
+    # Features for the images that are not cached yet, computed in one pass
+    new_features = {}
+    if missing:
+        if views > 1 and train_transform is None:
+            raise ValueError("train_transform is required for more than one cached view")
+        items = [(folder.samples[i][0], view) for i in missing for view in range(views)]
+        loader = DataLoader(_ViewDataset(items, val_transform, train_transform), batch_size=batch_size,
+                            num_workers=num_workers, pin_memory=(device.type == "cuda"))
+        backbone.eval()
+        embedded = []
+        with torch.inference_mode():
+            for inputs in loader:
+                embedded.append(backbone(inputs.to(device, non_blocking=True)).float().cpu().numpy())
+        embedded = np.concatenate(embedded).reshape(len(missing), views, -1)
+        new_features = dict(zip(missing, embedded))
+
+    if files != old_files:
+        # Rewrite the split in the current file order, reusing cached rows
+        dim = next(iter(new_features.values())).shape[-1] if new_features else old_features.shape[-1]
+        tmp_path = os.path.join(cache_dir, FEATURES_FILE + ".tmp")
+        features = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                             shape=(len(hashes), views, dim))
+        for i, sha in enumerate(hashes):
+            features[i] = new_features[i] if i in new_features else old_features[old_rows[sha]]
+        features.flush()
+        del features, old_features
+        os.replace(tmp_path, os.path.join(cache_dir, FEATURES_FILE))
+        with open(os.path.join(cache_dir, INDEX_FILE), "w") as f:
+            json.dump({"key": key, "classes": folder.classes, "files": files}, f)
+
+    elapsed = time.time() - start
+    print(f"📦 Feature cache {cache_dir}: {len(hashes) - len(missing)} cached, "
+          f"{len(missing)} embedded in {elapsed:.1f}s")
+
+    features = np.load(os.path.join(cache_dir, FEATURES_FILE), mmap_mode="r")
+    labels = np.array([label for _, label in folder.samples], dtype=np.int64)
+    return features, labels, folder.classes
+
+
+class CachedFeatureDataset(Dataset):
+    """
+    (features, label) samples from a cached split
+
+    random_view=True picks one of the cached views per sample (training);
+    otherwise view 0, the deterministic preprocessing, is used.
+    """
+
+    def __init__(self, features, labels, random_view=False):
+        self.features = features
+        self.labels = torch.from_numpy(labels)
+        self.random_view = random_view and features.shape[1] > 1
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        view = np.random.randint(self.features.shape[1]) if self.random_view else 0
+        return torch.from_numpy(np.array(self.features[i, view])), self.labels[i]
@@ -0,0 +1,574 @@
+"""
+Frame Sources and Threaded Capture
+
+Pluggable frame sources for the detection loops, selected by config:
+camera index, video file, RTSP/HTTP stream URL, image directory or an
+in-memory array of frames. Recorded conveyor footage can be replayed faster
+than real time to benchmark throughput and check accuracy offline.
+
+Capture is decoupled from inference: a dedicated capture thread keeps reading
+frames into a preallocated ring of NumPy buffers while the detection loop
+always picks up the most recent frame; frames that were overwritten before
+the detection loop got to them are dropped and counted. Offline sources
+(video files, image directories, arrays) are replayed without dropping frames.
+
+Configuration:
+    BOTTLE_FRAME_SOURCE environment variable, or a config passed to
+    open_frame_source(), e.g.
+        0                                   camera index
+        "conveyor.mp4"                      video file
+        "rtsp://10.0.0.5/stream"            RTSP / HTTP stream
+        "recordings/frames/"                image directory
+        {"type": "video", "path": "conveyor.mp4", "loop": True}
+
+    The HTTP API never takes a config from the client: requests name one of
+    the sources configured on the server (named_source_config()).
+    BOTTLE_FRAME_SOURCES is a JSON object of name -> config, e.g.
+        {"conveyor": {"type": "video", "path": "/data/conveyor.mp4"}}
+    and "default" (BOTTLE_FRAME_SOURCE) is always available.
+
+Classes:
+    FrameSource: Base interface (cv2.VideoCapture-style read/isOpened/release)
+    CameraSource, VideoFileSource, RTSPSource, ImageDirectorySource,
+    ArraySource, SyntheticSource: Frame source backends
+    FrameRingBuffer: Preallocated ring of frame buffers (latest-frame reads)
+    ThreadedCapture: Capture thread with a cv2.VideoCapture-like read()
+
+Functions:
+    create_frame_source(): Build a frame source from a config
+    open_frame_source(): Build a frame source and start threaded capture
+    open_camera(): Open and configure a webcam behind a ThreadedCapture
+    named_source_config(): Config of a server-configured source name
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameRingBuffer:
+    """Preallocated ring of frame buffers; the reader always gets the latest frame"""
+
+    def __init__(self, capacity, shape, dtype=np.uint8):
+        # One slot is being written, one holds the latest frame, the rest absorb jitter
+        self.capacity = max(3, int(capacity))
+        self.buffers = np.empty((self.capacity, *shape), dtype=dtype)
+        self._cond = threading.Condition()
+        self._write_index = 0
+        self._latest_index = -1
+        self._latest_seq = 0
+        self._read_seq = 0
+        self._closed = False
+
+        self.frames_written = 0
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    def next_slot(self):
+        """Buffer the writer should fill next (never the latest committed frame)"""
+        with self._cond:
+            index = self._write_index
+            if index == self._latest_index:
+                index = (index + 1) % self.capacity
+            self._write_index = index
+            return self.buffers[index]
+
+    def commit(self):
+        """Publish the slot returned by next_slot() as the latest frame"""
+        with self._cond:
+            self._latest_index = self._write_index
+            self._write_index = (self._write_index + 1) % self.capacity
+            self._latest_seq += 1
+            self.frames_written += 1
+            self._cond.notify_all()
+
+    def write(self, frame):
+        """Copy a frame into the ring (for sources that cannot read in place)"""
+        slot = self.next_slot()
+        if slot.shape != frame.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match buffer shape {slot.shape}")
+        np.copyto(slot, frame)
+        self.commit()
+
+    def read_latest(self, out=None, timeout=None):
+        """
+        Copy the newest unread frame into `out` (allocated if None)
+
+        Returns (sequence_number, frame), or (None, None) if no new frame
+        arrived within the timeout or the buffer was closed.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._latest_seq > self._read_seq or self._closed, timeout):
+                return None, None
+            if self._latest_seq == self._read_seq:
+                return None, None
+
+            # Every frame written since the last read except the newest was skipped
+            self.frames_dropped += self._latest_seq - self._read_seq - 1
+            self.frames_read += 1
+            self._read_seq = self._latest_seq
+
+            latest = self.buffers[self._latest_index]
+            if out is None or out.shape != latest.shape:
+                out = latest.copy()
+            else:
+                np.copyto(out, latest)
+            return self._read_seq, out
+
+    def has_unread(self):
+        with self._cond:
+            return self._latest_seq > self._read_seq
+
+    def close(self):
+        """Wake up any waiting reader; no more frames will be written"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class ThreadedCapture:
+    """
+    Run a frame source on its own capture thread
+
+    Wraps a FrameSource (or any object with a cv2.VideoCapture-style
+    read()/isOpened()/release()). read() returns the most recent frame and
+    never the same frame twice.
+
+    With drop_frames=False the capture thread waits for the reader instead of
+    overwriting unread frames, so a video file can be replayed frame by frame.
+    """
+
+    def __init__(self, source, buffer_size=4, drop_frames=True, read_timeout=2.0):
+        self.source = source
+        self.buffer_size = buffer_size
+        self.drop_frames = drop_frames
+        self.read_timeout = read_timeout
+
+        self.ring = None
+        self._thread = None
+        self._running = False
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def set(self, prop_id, value):
+        # Only safe before the capture thread starts
+        return self.source.set(prop_id, value)
+
+    def get(self, prop_id):
+        return self.source.get(prop_id)
+
+    def start(self):
+        """Read the first frame to size the ring buffer and start capturing"""
+        if self._thread is not None:
+            return True
+
+        ret, first = self.source.read()
+        if not ret:
+            return False
+
+        self.ring = FrameRingBuffer(self.buffer_size, first.shape, first.dtype)
+        self.ring.write(first)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, name="frame-capture", daemon=True)
+        self._thread.start()
+        return True
+
+    def _capture_loop(self):
+        while self._running:
+            if not self.drop_frames:
+                # Wait until the reader has taken the previous frame
+                while self._running and self.ring.has_unread():
+                    time.sleep(0.001)
+
+            slot = self.ring.next_slot()
+            ret, frame = self.source.read(slot)
+            if not ret:
+                break
+            if frame is not slot:
+                # Source changed resolution or could not decode in place
+                if frame.shape != slot.shape:
+                    print(f"❌ Frame size changed to {frame.shape}, stopping capture")
+                    break
+                np.copyto(slot, frame)
+            self.ring.commit()
+
+        self.ring.close()
+
+    def read(self):
+        """Return (ret, frame) with the most recent frame, like cv2.VideoCapture.read()"""
+        if self._thread is None and not self.start():
+            return False, None
+
+        # A fresh array per call, since callers keep references to frames
+        _, frame = self.ring.read_latest(timeout=self.read_timeout)
+        if frame is None:
+            return False, None
+        return True, frame
+
+    def stats(self):
+        """Captured / processed / dropped frame counters"""
+        if self.ring is None:
+            return {"frames_captured": 0, "frames_processed": 0, "frames_dropped": 0}
+        return {
+            "frames_captured": self.ring.frames_written,
+            "frames_processed": self.ring.frames_read,
+            "frames_dropped": self.ring.frames_dropped,
+        }
+
+    def release(self):
+        """Stop the capture thread and release the underlying source"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.source.release()
+
+
+class FrameSource:
+    """
+    Base class for frame sources
+
+    Sources follow the cv2.VideoCapture interface so they can be used
+    directly or behind a ThreadedCapture. `realtime` sources (cameras,
+    streams) produce frames on their own clock and stale frames may be
+    dropped; offline sources are read as fast as the consumer allows.
+    """
+
+    realtime = True
+
+    def read(self, image=None):
+        """Return (ret, frame); fill `image` in place when possible"""
+        raise NotImplementedError
+
+    def isOpened(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def set(self, prop_id, value):
+        return False
+
+    def get(self, prop_id):
+        return 0.0
+
+    def __iter__(self):
+        while True:
+            ret, frame = self.read()
+            if not ret:
+                return
+            yield frame
+
+
+class _CaptureSource(FrameSource):
+    """Frame source backed by a cv2.VideoCapture"""
+
+    def __init__(self, cap):
+        self.cap = cap
+
+    def read(self, image=None):
+        if image is None:
+            return self.cap.read()
+        return self.cap.read(image)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+    def set(self, prop_id, value):
+        return self.cap.set(prop_id, value)
+
+    def get(self, prop_id):
+        return self.cap.get(prop_id)
+
+
+class CameraSource(_CaptureSource):
+    """Local webcam; falls back to other indices if the first one fails"""
+
+    def __init__(self, index=0, width=640, height=480, fps=30, fallback_indices=(1, 2, 3)):
+        self.index = None
+        cap = None
+        for candidate in (index, *[i for i in fallback_indices if i != index]):
+            cap = cv2.VideoCapture(candidate)
+            if cap.isOpened():
+                self.index = candidate
+                if candidate != index:
+                    print(f"✅ Camera found at index {candidate}")
+                break
+            cap.release()
+
+        super().__init__(cap)
+        if self.index is not None:
+            # Set camera properties before any capture thread starts
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            cap.set(cv2.CAP_PROP_FPS, fps)
+
+
+class RTSPSource(_CaptureSource):
+    """Network camera stream (RTSP / HTTP MJPEG)"""
+
+    def __init__(self, url):
+        self.url = url
+        cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+        # Keep the decoder from queueing old frames
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        super().__init__(cap)
+
+
+class VideoFileSource(_CaptureSource):
+    """
+    Recorded video file
+
+    By default frames are replayed as fast as they are consumed; set
+    realtime=True to pace playback at the file's own frame rate.
+    """
+
+    def __init__(self, path, loop=False, realtime=False):
+        self.path = path
+        self.loop = loop
+        self.realtime = realtime
+        super().__init__(cv2.VideoCapture(path))
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self._next_time = time.time()
+
+    def read(self, image=None):
+        ret, frame = super().read(image)
+        if not ret and self.loop and self.cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = super().read(image)
+
+        if ret and self.realtime:
+            delay = self._next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = max(self._next_time, time.time() - 1.0) + 1.0 / self.fps
+        return ret, frame
+
+
+class ImageDirectorySource(FrameSource):
+    """Images in a directory, read in file-name order"""
+
+    realtime = False
+    EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, directory, loop=False, pattern="*"):
+        self.directory = directory
+        self.loop = loop
+        self.paths = sorted(
+            path for path in glob.glob(os.path.join(directory, pattern))
+            if path.lower().endswith(self.EXTENSIONS)
+        )
+        self.position = 0
+
+    def read(self, image=None):
+        while self.paths:
+            if self.position >= len(self.paths):
+                if not self.loop:
+                    return False, None
+                self.position = 0
+
+            path = self.paths[self.position]
+            self.position += 1
+            frame = cv2.imread(path)
+            if frame is None:
+                print(f"⚠️ Skipping unreadable image: {path}")
+                continue
+            if image is not None and image.shape == frame.shape:
+                np.copyto(image, frame)
+                return True, image
+            return True, frame
+        return False, None
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.paths))
+        return 0.0
+
+
+class ArraySource(FrameSource):
+    """In-memory frames: a list of HxWx3 BGR arrays or an NxHxWx3 array"""
+
+    realtime = False
+
+    def __init__(self, frames, loop=False):
+        self.frames = frames
+        self.loop = loop
+        self.position = 0
+
+    def read(self, image=None):
+        if self.position >= len(self.frames):
+            if not self.loop or len(self.frames) == 0:
+                return False, None
+            self.position = 0
+
+        frame = self.frames[self.position]
+        self.position += 1
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def isOpened(self):
+        return len(self.frames) > 0
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.frames))
+        return 0.0
+
+
+class SyntheticSource(FrameSource):
+    """Camera-free frame generator (a bright "bottle" moving across the frame)"""
+
+    def __init__(self, width=640, height=480, fps=30, num_frames=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.num_frames = num_frames
+        self.frame_index = 0
+        self._opened = True
+        self._next_time = time.time()
+
+    def isOpened(self):
+        return self._opened
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop_id == cv2.CAP_PROP_FPS:
+            return float(self.fps or 0)
+        return 0.0
+
+    def read(self, image=None):
+        if not self._opened or (self.num_frames is not None and self.frame_index >= self.num_frames):
+            return False, None
+
+        # Pace like a real camera
+        if self.fps:
+            delay = self._next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = max(self._next_time, time.time() - 1.0) + 1.0 / self.fps
+
+        shape = (self.height, self.width, 3)
+        if image is None or image.shape != shape:
+            image = np.empty(shape, dtype=np.uint8)
+        image[:] = 40
+
+        # A bright "bottle" moving across the frame
+        bottle_w, bottle_h = self.width // 8, self.height // 2
+        x = (self.frame_index * 8) % max(1, self.width - bottle_w)
+        y = (self.height - bottle_h) // 2
+        image[y:y + bottle_h, x:x + bottle_w] = (60, 180, 60)
+
+        self.frame_index += 1
+        return True, image
+
+    def release(self):
+        self._opened = False
+
+
+# Frame source backends by config "type"
+FRAME_SOURCES = {
+    "camera": CameraSource,
+    "video": VideoFileSource,
+    "rtsp": RTSPSource,
+    "images": ImageDirectorySource,
+    "array": ArraySource,
+    "synthetic": SyntheticSource,
+}
+
+# Source used when a detection function is not given one
+DEFAULT_FRAME_SOURCE = os.environ.get("BOTTLE_FRAME_SOURCE", "0")
+
+DEFAULT_SOURCE_NAME = "default"
+
+
+def _load_named_sources():
+    sources = json.loads(os.environ.get("BOTTLE_FRAME_SOURCES", "{}"))
+    if not isinstance(sources, dict):
+        raise ValueError("BOTTLE_FRAME_SOURCES must be a JSON object of name -> source config")
+    # None = DEFAULT_FRAME_SOURCE
+    sources[DEFAULT_SOURCE_NAME] = None
+    return sources
+
+
+# Sources API clients may select, by name
+NAMED_SOURCES = _load_named_sources()
+
+
+def named_source_config(name=None):
+    """Config of a configured source name (None = default); ValueError for unknown names"""
+    if name is None:
+        name = DEFAULT_SOURCE_NAME
+    if not isinstance(name, str) or name not in NAMED_SOURCES:
+        raise ValueError(f"Unknown frame source {name!r}. Available: {', '.join(NAMED_SOURCES)}")
+    return NAMED_SOURCES[name]
+
+
+def create_frame_source(config=None):
+    """
+    Build a frame source from a config
+
+    `config` may be a FrameSource (returned as is), a camera index, a string
+    (camera index, stream URL, image directory or video file path) or a dict
+    with a "type" key from FRAME_SOURCES plus that backend's arguments.
+    """
+    if config is None:
+        config = DEFAULT_FRAME_SOURCE
+
+    if isinstance(config, FrameSource):
+        return config
+    if isinstance(config, dict):
+        options = dict(config)
+        source_type = options.pop("type", "camera")
+        if source_type not in FRAME_SOURCES:
+            raise ValueError(f"Unknown frame source type: {source_type}")
+        return FRAME_SOURCES[source_type](**options)
+    if isinstance(config, int):
+        return CameraSource(config)
+
+    config = str(config)
+    if config.isdigit():
+        return CameraSource(int(config))
+    if config.lower().startswith(("rtsp://", "rtmp://", "http://", "https://")):
+        return RTSPSource(config)
+    if os.path.isdir(config):
+        return ImageDirectorySource(config)
+    return VideoFileSource(config)
+
+
+def open_frame_source(config=None, buffer_size=4, drop_frames=None):
+    """
+    Create a frame source and wrap it in a ThreadedCapture
+
+    Live sources drop stale frames; offline sources are replayed frame by
+    frame unless drop_frames is given explicitly.
+    """
+    source = create_frame_source(config)
+    if drop_frames is None:
+        drop_frames = source.realtime
+    return ThreadedCapture(source, buffer_size=buffer_size, drop_frames=drop_frames)
+
+
+def open_camera(index=0, width=640, height=480, fps=30, buffer_size=4):
+    """Open a webcam, apply capture settings and wrap it in a ThreadedCapture"""
+    return open_frame_source(
+        {"type": "camera", "index": index, "width": width, "height": height, "fps": fps},
+        buffer_size=buffer_size,
+    )
@@ -0,0 +1,164 @@
+"""
+Parallel, Cached InfluxDB Schema Discovery
+
+Backs /api/debug/schema and /api/debug/data. They used to run one
+schema.measurementFieldKeys or sample query per measurement, one after the
+other, so latency grew with the number of measurements in the bucket.
+
+SchemaExplorer runs the per-measurement queries concurrently on a bounded
+thread pool. The schema rarely changes, so it is cached (QueryCache) and
+refreshed in the background once it is older than the refresh interval.
+Sample data is not cached. sample_data() yields each measurement as soon as
+its query finishes, with at most `workers` queries in flight, and
+stream_json_object() turns that into a JSON document written piece by piece,
+so a large dump holds only a few measurements' rows in memory at a time.
+Rows per measurement are capped at MAX_SAMPLE_LIMIT.
+
+Configuration (environment variables):
+    BOTTLE_SCHEMA_WORKERS    Concurrent per-measurement queries (default 8)
+    BOTTLE_SCHEMA_REFRESH    Seconds before the cached schema is refreshed (default 300)
+
+Classes:
+    SchemaExplorer: Measurements, field keys and sample rows of a bucket
+
+Functions:
+    stream_json_object(): (key, value) pairs -> chunks of one JSON object
+"""
+
+import json
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from query_cache import QueryCache
+
+SCHEMA_WORKERS = int(os.environ.get("BOTTLE_SCHEMA_WORKERS", "8"))
+SCHEMA_REFRESH = float(os.environ.get("BOTTLE_SCHEMA_REFRESH", "300"))
+
+# Maximum rows per measurement in a sample dump
+MAX_SAMPLE_LIMIT = 1000
+
+
+def stream_json_object(pairs, dumps=None):
+    """
+    Yield one JSON object chunk by chunk, one chunk per (key, value) pair
+
+    dumps(value) encodes keys and values; pass the Flask app's app.json.dumps
+    so the output matches jsonify().
+    """
+    dumps = dumps or (lambda value: json.dumps(value, default=str))
+    yield "{"
+    for index, (key, value) in enumerate(pairs):
+        separator = "," if index else ""
+        yield f"{separator}\n{dumps(key)}: {dumps(value)}"
+    yield "\n}\n"
+
+
+class SchemaExplorer:
+    """Measurements, field keys and sample rows of one bucket, queried in parallel"""
+
+    def __init__(self, query_api, bucket, workers=SCHEMA_WORKERS, refresh_interval=SCHEMA_REFRESH):
+        self.query_api = query_api
+        self.bucket = bucket
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="influx-schema")
+        # Served for another day after the refresh interval if InfluxDB is unreachable
+        self.cache = QueryCache(ttl=refresh_interval, stale_ttl=86400.0, max_entries=4)
+
+    def _values(self, flux):
+        return [record.get_value() for table in self.query_api.query(flux) for record in table.records]
+
+    def _measurements(self):
+        return self._values(f'''
+            import "influxdata/influxdb/schema"
+            schema.measurements(bucket: "{self.bucket}")
+        ''')
+
+    def _field_keys(self, measurement):
+        try:
+            return self._values(f'''
+                import "influxdata/influxdb/schema"
+                schema.measurementFieldKeys(
+                    bucket: "{self.bucket}",
+                    measurement: "{measurement}"
+                )
+            ''')
+        except Exception:
+            return ["Error querying fields"]
+
+    def _discover(self):
+        measurements = self._measurements()
+        fields = self._pool.map(self._field_keys, measurements)
+        return {
+            "measurements": measurements,
+            "fields_by_measurement": dict(zip(measurements, fields)),
+        }
+
+    def measurements(self):
+        return self.schema()["measurements"]
+
+    def schema(self, refresh=False):
+        """{"measurements": [...], "fields_by_measurement": {...}}, cached"""
+        if refresh:
+            self.cache.invalidate("schema")
+        return self.cache.get("schema", self._discover)
+
+    def _sample(self, measurement, start, limit):
+        query = f'''
+            from(bucket: "{self.bucket}")
+                |> range(start: {start})
+                |> filter(fn: (r) => r._measurement == "{measurement}")
+                |> limit(n: {int(limit)})
+        '''
+        try:
+            return [{
+                "time": record.get_time().isoformat(),
+                "measurement": record.get_measurement(),
+                "field": record.get_field(),
+                "value": record.get_value(),
+                "values": dict(record.values)
+            } for table in self.query_api.query(query) for record in table.records]
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def sample_data(self, start="-1h", limit=5, ordered=False):
+        """
+        Yield (measurement, rows) for every measurement, queried concurrently
+
+        Pairs come in completion order, or in measurement order with ordered=True.
+        At most `workers` queries are in flight, and a result is released as
+        soon as it has been yielded.
+        """
+        limit = max(1, min(int(limit), MAX_SAMPLE_LIMIT))
+        pending = iter(self.measurements())
+        # (future, measurement) in submission order
+        in_flight = deque()
+
+        def submit_next():
+            for measurement in pending:
+                in_flight.append((self._pool.submit(self._sample, measurement, start, limit), measurement))
+                return
+
+        try:
+            for _ in range(self.workers):
+                submit_next()
+            while in_flight:
+                if ordered:
+                    future, measurement = in_flight.popleft()
+                else:
+                    done, _ = wait([future for future, _ in in_flight], return_when=FIRST_COMPLETED)
+                    index = next(i for i, (future, _) in enumerate(in_flight) if future in done)
+                    future, measurement = in_flight[index]
+                    del in_flight[index]
+                result = future.result()
+                del future
+                submit_next()
+                yield measurement, result
+                del result
+        finally:
+            # Client went away: do not run the queries nobody will read
+            for future, _ in in_flight:
+                future.cancel()
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,444 @@
+"""
+Batched InfluxDB Write-Back of Detection Events
+
+Detections used to live only in memory (saved_frames, detection results)
+and were lost on restart. InfluxEventSink turns every detection frame with
+bottles into line-protocol points, and BatchedLineWriter sends them to the
+InfluxDB v2 write API (/api/v2/write) from a background thread:
+
+- Lines are queued in memory (at most max_queue lines) and flushed when
+  batch_size lines are waiting or flush_interval seconds have passed.
+- Failed writes (network errors, HTTP 429 / 5xx) are retried with
+  exponential backoff. Other HTTP errors mean bad data; the batch is dropped.
+- While InfluxDB is unreachable, batches that exhausted their retries and
+  lines that do not fit in the queue are appended to a spill file (bounded
+  by max_spill_bytes). The file is replayed after the next successful write.
+  Every process spills to its own file (the pid is added to the name), so
+  gunicorn workers never replay the same lines. Spill files left behind by
+  processes that no longer run are picked up and replayed as well.
+
+Points written (one per detection frame, one per bottle):
+    bottle_detection,source=..,backend=.. bottle_count=2i,max_confidence=0.91,latency_ms=41.2,frame=120i <ns>
+    bottle,source=..,backend=..,index=0,material=Plastic confidence=0.91,material_confidence=0.8,x1=10i,... <ns>
+
+Configuration (environment variables):
+    BOTTLE_INFLUX_WRITE=1            Enable the write-back in app.py
+    BOTTLE_INFLUX_BATCH_SIZE         Lines per write (default 500)
+    BOTTLE_INFLUX_FLUSH_SECONDS      Maximum time a line waits (default 1)
+    BOTTLE_INFLUX_MAX_QUEUE          Lines kept in memory (default 10000)
+    BOTTLE_INFLUX_SPILL_PATH         Spill file, before the pid is added (default influx_spill.lp)
+
+Usage:
+    python influx_writer.py    # Outage / recovery demo against a local HTTP stand-in
+
+Classes:
+    BatchedLineWriter: Background batching writer with retry and spill-to-disk
+    InfluxEventSink: Detection pipeline sink producing detection points
+
+Functions:
+    line_protocol(): One point in InfluxDB line protocol
+    detection_points(): Lines for one detection frame
+    configure_detection_writer() / get_detection_writer(): Shared writer
+"""
+
+import glob
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+
+BATCH_SIZE = int(os.environ.get("BOTTLE_INFLUX_BATCH_SIZE", "500"))
+FLUSH_SECONDS = float(os.environ.get("BOTTLE_INFLUX_FLUSH_SECONDS", "1"))
+MAX_QUEUE = int(os.environ.get("BOTTLE_INFLUX_MAX_QUEUE", "10000"))
+SPILL_PATH = os.environ.get("BOTTLE_INFLUX_SPILL_PATH", "influx_spill.lp")
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+# ----------------- Line Protocol -----------------
+def _escape_key(value):
+    """Measurement names, tag keys / values and field keys"""
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def _field_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def line_protocol(measurement, tags, fields, timestamp_ns):
+    """One point; None tag / field values are left out"""
+    tag_text = "".join(f",{_escape_key(key)}={_escape_key(value)}"
+                       for key, value in sorted(tags.items()) if value not in (None, ""))
+    field_text = ",".join(f"{_escape_key(key)}={_field_value(value)}"
+                          for key, value in fields.items() if value is not None)
+    return f"{_escape_key(measurement)}{tag_text} {field_text} {int(timestamp_ns)}"
+
+
+def detection_points(bottles, timestamp, tags=None, frame_number=None, latency_ms=None):
+    """Lines for one detection frame: a bottle_detection summary and one bottle point per box"""
+    tags = dict(tags or {})
+    timestamp_ns = int(timestamp * 1e9)
+    confidences = [bottle["confidence"] for bottle in bottles]
+    lines = [line_protocol("bottle_detection", tags, {
+        "bottle_count": len(bottles),
+        "max_confidence": round(float(max(confidences)), 4) if confidences else None,
+        "latency_ms": round(float(latency_ms), 2) if latency_ms is not None else None,
+        "frame": frame_number,
+    }, timestamp_ns)]
+    for index, bottle in enumerate(bottles):
+        x1, y1, x2, y2 = (int(v) for v in bottle["bbox"])
+        lines.append(line_protocol("bottle", {**tags, "index": index, "material": bottle.get("material")}, {
+            "confidence": round(float(bottle["confidence"]), 4),
+            "material_confidence": round(float(bottle["material_confidence"]), 4) if "material_confidence" in bottle else None,
+            "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+        }, timestamp_ns))
+    return lines
+
+
+# ----------------- Writer -----------------
+def _process_running(pid):
+    """Whether a process is still running (POSIX; on Windows assume it is)"""
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class BatchedLineWriter:
+    """
+    Queue line-protocol lines and write them to InfluxDB in batches
+
+    write() never blocks on the network. close() flushes what is queued
+    (spilling it if InfluxDB stays unreachable) and stops the thread.
+    """
+
+    def __init__(self, url, org, bucket, token=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_SECONDS,
+                 max_queue=MAX_QUEUE, spill_path=SPILL_PATH, max_spill_bytes=64 * 1024 * 1024,
+                 max_retries=3, backoff=0.5, max_backoff=30.0, timeout=10.0):
+        query = urllib.parse.urlencode({"org": org, "bucket": bucket, "precision": "ns"})
+        self.write_url = f"{url.rstrip('/')}/api/v2/write?{query}"
+        self.token = token
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.max_queue = max(self.batch_size, int(max_queue))
+        # One spill file per process: <name>.<pid><ext>
+        root, ext = os.path.splitext(spill_path)
+        self._spill_pattern = (f"{root}.", ext)
+        self.spill_path = f"{root}.{os.getpid()}{ext}"
+        self.max_spill_bytes = max_spill_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._closed = False
+        self._last_flush = time.time()
+        self._counters = dict.fromkeys(("queued", "written", "batches", "retries", "failed_batches",
+                                        "spilled", "replayed", "dropped"), 0)
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, name, amount=1):
+        self._counters[name] += amount
+
+    def write(self, lines):
+        """Queue lines; beyond max_queue they go straight to the spill file"""
+        if isinstance(lines, str):
+            lines = [lines]
+        overflow = []
+        with self._condition:
+            for line in lines:
+                if len(self._queue) < self.max_queue:
+                    self._queue.append(line)
+                    self._count("queued")
+                else:
+                    overflow.append(line)
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+        if overflow:
+            self._spill(overflow)
+
+    def _post(self, lines):
+        """One write request; returns True, or raises for retryable failures"""
+        request = urllib.request.Request(self.write_url, data="\n".join(lines).encode("utf-8"), method="POST")
+        request.add_header("Content-Type", "text/plain; charset=utf-8")
+        if self.token:
+            request.add_header("Authorization", f"Token {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                return True
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                raise
+            print(f"❌ InfluxDB rejected {len(lines)} lines (HTTP {e.code}), dropping them")
+            self._count("dropped", len(lines))
+            return False
+
+    def _send(self, lines, retries=None):
+        """Write a batch with retries and backoff; returns False if InfluxDB stayed unreachable"""
+        retries = self.max_retries if retries is None else retries
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            try:
+                if self._post(lines):
+                    self._count("written", len(lines))
+                    self._count("batches")
+                return True
+            except (urllib.error.URLError, OSError) as e:
+                if attempt == retries:
+                    print(f"⚠️ InfluxDB write failed after {retries + 1} attempts: {e}")
+                    break
+                self._count("retries")
+                # Wake up early when closing, but still try once more
+                with self._condition:
+                    self._condition.wait_for(lambda: self._closed, timeout=delay)
+                delay = min(delay * 2, self.max_backoff)
+        self._count("failed_batches")
+        return False
+
+    def _spill(self, lines, counter="spilled"):
+        with self._spill_lock:
+            try:
+                size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+                if size >= self.max_spill_bytes:
+                    self._count("dropped", len(lines))
+                    return
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                if counter:
+                    self._count(counter, len(lines))
+            except OSError as e:
+                print(f"❌ Could not spill {len(lines)} lines to {self.spill_path}: {e}")
+                self._count("dropped", len(lines))
+
+    def _orphaned_spill_files(self):
+        """Spill files of processes that no longer run"""
+        prefix, ext = self._spill_pattern
+        orphans = []
+        for path in glob.glob(glob.escape(prefix) + "*" + glob.escape(ext)):
+            pid = path[len(prefix):len(path) - len(ext)]
+            if pid.isdigit() and int(pid) != os.getpid() and not _process_running(int(pid)):
+                orphans.append(path)
+        return orphans
+
+    def _replay_spill(self):
+        """Send the spilled lines after a successful write; stops at the first failure"""
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            if not os.path.exists(replay_path):
+                # Our own spill file, else one left behind by a stopped process. The
+                # rename is atomic, so only one process claims an orphaned file.
+                for path in [self.spill_path] + self._orphaned_spill_files():
+                    try:
+                        os.replace(path, replay_path)
+                        break
+                    except FileNotFoundError:
+                        continue
+                else:
+                    return
+        with open(replay_path, encoding="utf-8") as f:
+            lines = [line for line in f.read().splitlines() if line]
+        for start in range(0, len(lines), self.batch_size):
+            batch = lines[start:start + self.batch_size]
+            if not self._send(batch, retries=0):
+                # Keep the rest for the next attempt
+                self._spill(lines[start:], counter=None)
+                break
+            self._count("replayed", len(batch))
+        os.remove(replay_path)
+
+    def _take_batch(self):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._closed or len(self._queue) >= self.batch_size
+                or (self._queue and time.time() - self._last_flush >= self.flush_interval),
+                timeout=self.flush_interval)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._last_flush = time.time()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                if self._send(batch):
+                    try:
+                        self._replay_spill()
+                    except OSError as e:
+                        # Keep the writer thread alive; the file is retried after the next write
+                        print(f"⚠️ Could not replay spilled InfluxDB lines: {e}")
+                else:
+                    self._spill(batch)
+            elif self._closed:
+                break
+
+    def flush(self, timeout=10.0):
+        """Wait until the queue is empty (True) or timeout"""
+        deadline = time.time() + timeout
+        with self._condition:
+            # Send what is queued now instead of after the flush interval
+            self._last_flush = 0.0
+            self._condition.notify()
+        while time.time() < deadline:
+            with self._condition:
+                if not self._queue:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def close(self, timeout=10.0):
+        """Flush the queue and stop the writer thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._condition:
+            queue_depth = len(self._queue)
+        spill_bytes = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+        return {**self._counters, "queue_depth": queue_depth, "spill_bytes": spill_bytes}
+
+
+def configure_detection_writer(url, org, bucket, token=None, **options):
+    """Create the shared writer used by InfluxEventSink in every pipeline run"""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+        _writer = BatchedLineWriter(url, org, bucket, token, **options)
+        print(f"✅ Detection events are written to InfluxDB bucket '{bucket}'")
+    return _writer
+
+
+def get_detection_writer():
+    """Shared writer, or None when write-back is not configured"""
+    return _writer
+
+
+# ----------------- Pipeline Sink -----------------
+class InfluxEventSink:
+    """
+    Write detection frames with bottles to InfluxDB
+
+    When materials are classified asynchronously the points are held until
+    the materials arrive (at most hold_seconds), so each bottle point carries
+    its material.
+    """
+
+    def __init__(self, writer, tags=None, min_confidence=0.0, hold_seconds=2.0):
+        self.writer = writer
+        self.tags = dict(tags or {})
+        self.min_confidence = min_confidence
+        self.hold_seconds = hold_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def on_frame(self, state):
+        self._flush_pending(older_than=time.time() - self.hold_seconds)
+        if not state.detected:
+            return
+        from postprocessing import detections_to_dicts
+
+        detections = state.detections[state.detections["confidence"] > self.min_confidence]
+        if not len(detections):
+            return
+        event = {
+            "bottles": detections_to_dicts(detections),
+            "timestamp": time.time(),
+            "frame_number": state.frame_number,
+            "latency_ms": state.detection_ms,
+        }
+        if state.materials_expected:
+            with self._lock:
+                self._pending[state.frame_number] = event
+        else:
+            self._write(event)
+
+    def on_materials(self, frame_number, detections, materials):
+        from material_classification import attach_materials
+
+        with self._lock:
+            event = self._pending.pop(frame_number, None)
+        if event is not None:
+            attach_materials(event["bottles"], detections, materials)
+            self._write(event)
+
+    def _flush_pending(self, older_than=None):
+        with self._lock:
+            ready = [number for number, event in self._pending.items()
+                     if older_than is None or event["timestamp"] < older_than]
+            events = [self._pending.pop(number) for number in ready]
+        for event in events:
+            self._write(event)
+
+    def _write(self, event):
+        self.writer.write(detection_points(event["bottles"], event["timestamp"], self.tags,
+                                           event["frame_number"], event["latency_ms"]))
+
+    def close(self, state):
+        self._flush_pending()
+
+
+def main():
+    """Send detection points to a local HTTP stand-in that is down for a while"""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    received = []
+    outage = {"until": time.time() + 1.5}
+
+    class StandIn(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            if time.time() < outage["until"]:
+                self.send_response(503)
+            else:
+                received.extend(body.splitlines())
+                self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    writer = BatchedLineWriter(f"http://127.0.0.1:{server.server_port}", "demo", "waste", batch_size=50,
+                               flush_interval=0.2, max_retries=1, backoff=0.2, spill_path="influx_demo_spill.lp")
+
+    bottle = {"bbox": [10, 20, 110, 220], "confidence": 0.91, "material": "Plastic", "material_confidence": 0.8}
+    sent = 0
+    for i in range(40):
+        lines = detection_points([bottle, bottle], time.time(), {"source": "demo"}, frame_number=i, latency_ms=40.0)
+        writer.write(lines)
+        sent += len(lines)
+        time.sleep(0.1)
+    writer.close()
+    server.shutdown()
+    if os.path.exists(writer.spill_path):
+        os.remove(writer.spill_path)
+
+    print(f"📊 {sent} lines sent, {len(received)} received by the stand-in (outage for the first 1.5s)")
+    print(f"   Writer: {json.dumps(writer.stats())}")
+
+
+if __name__ == "__main__":
+    main()
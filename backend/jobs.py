@@ -0,0 +1,243 @@
+"""
+Asynchronous Inference Jobs
+
+Detection requests run as jobs on a bounded worker pool instead of on the
+Flask request thread. submit() returns a Job immediately; clients poll its
+status and results by ID (GET /api/jobs/<id> in app.py), so any number of
+stations can request detections without pinning web workers or overwriting
+each other's results.
+
+Job states: queued -> running -> completed | failed. Every job records when
+it was created, started and finished (queue / run / total time in ms).
+
+Finished jobs are kept in an LRU store: reading a job marks it as recently
+used, and the least recently used finished jobs are evicted once the store
+holds `capacity` jobs. Queued and running jobs are never evicted; when
+`max_pending` jobs are already waiting, submit() raises JobQueueFull.
+
+Configuration (environment variables):
+    BOTTLE_JOB_WORKERS   Concurrent jobs (default 2)
+    BOTTLE_JOB_QUEUE     Maximum queued + running jobs (default 16)
+    BOTTLE_JOB_HISTORY   Jobs kept in the store (default 256)
+
+Classes:
+    Job: One inference request, its state, result and timing
+    JobStore: Thread-safe LRU store of jobs by ID
+    JobManager: Bounded worker pool running jobs from registered handlers
+    JobQueueFull: Raised when no more jobs can be queued
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("BOTTLE_JOB_WORKERS", "2"))
+JOB_QUEUE = int(os.environ.get("BOTTLE_JOB_QUEUE", "16"))
+JOB_HISTORY = int(os.environ.get("BOTTLE_JOB_HISTORY", "256"))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Too many queued / running jobs"""
+
+
+def _ms(start, end):
+    if start is None or end is None:
+        return None
+    return round((end - start) * 1000.0, 1)
+
+
+class Job:
+    """One inference request, its state, result and timing"""
+
+    def __init__(self, kind, params=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = dict(params or {})
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in (COMPLETED, FAILED)
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; returns False on timeout"""
+        return self._done.wait(timeout)
+
+    def _start(self):
+        self.started = time.time()
+        self.status = RUNNING
+
+    def _finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.status = FAILED if error is not None else COMPLETED
+        self._done.set()
+
+    def to_dict(self, include_result=True):
+        """JSON-serializable status (and result once finished)"""
+        now = time.time()
+        info = {
+            "job_id": self.id,
+            "type": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "created": self.created,
+            "timing": {
+                "queue_ms": _ms(self.created, self.started or (None if self.done else now)),
+                "run_ms": _ms(self.started, self.finished or (now if self.started else None)),
+                "total_ms": _ms(self.created, self.finished or now),
+            },
+        }
+        if self.error is not None:
+            info["error"] = self.error
+        if include_result and self.result is not None:
+            info["result"] = self.result
+        return info
+
+
+class JobStore:
+    """Thread-safe LRU store of jobs; only finished jobs are evicted"""
+
+    def __init__(self, capacity=JOB_HISTORY):
+        self.capacity = max(1, int(capacity))
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+
+    def get(self, job_id):
+        """Job by ID (None if unknown or evicted); marks it as recently used"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._jobs.move_to_end(job_id)
+            return job
+
+    def latest(self, kind=None):
+        """Most recently created job (of one kind)"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if kind is None or job.kind == kind]
+        return max(jobs, key=lambda job: job.created, default=None)
+
+    def _evict(self):
+        excess = len(self._jobs) - self.capacity
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done][:excess]:
+            del self._jobs[job_id]
+            self.evicted += 1
+
+    def counts(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING, COMPLETED, FAILED)}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+
+class JobManager:
+    """
+    Run jobs on a bounded worker pool
+
+    `handlers` maps a job type to a function called with the job params as
+    keyword arguments; its return value becomes the job result.
+    on_update(job), if given, is called whenever a job is queued, starts or
+    finishes (e.g. to push job events to clients).
+    """
+
+    def __init__(self, handlers, workers=JOB_WORKERS, max_pending=JOB_QUEUE, capacity=JOB_HISTORY,
+                 on_update=None):
+        self.handlers = dict(handlers)
+        self.on_update = on_update
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.store = JobStore(max(capacity, self.max_pending))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._run_time = 0.0
+        self._finished = 0
+
+    def submit(self, kind, params=None):
+        """Queue a job and return it without waiting"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job type '{kind}'. Available: {', '.join(self.handlers)}")
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"{self._pending} jobs already queued or running")
+            self._pending += 1
+
+        job = Job(kind, params)
+        self.store.add(job)
+        self._notify(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def latest(self, kind=None):
+        return self.store.latest(kind)
+
+    def _notify(self, job):
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(job)
+        except Exception as e:
+            print(f"⚠️ Job update callback failed: {e}")
+
+    def _run(self, job):
+        job._start()
+        self._notify(job)
+        try:
+            result = self.handlers[job.kind](**job.params)
+            job._finish(result=result)
+        except Exception as e:
+            print(f"❌ Job {job.id} ({job.kind}) failed: {e}")
+            job._finish(error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._finished += 1
+                self._run_time += job.finished - job.started
+            self._notify(job)
+
+    def stats(self):
+        """Pool size, queue depth, job counts and average run time"""
+        with self._lock:
+            pending, finished, run_time = self._pending, self._finished, self._run_time
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": pending,
+            "stored": len(self.store),
+            "capacity": self.store.capacity,
+            "evicted": self.store.evicted,
+            "jobs": self.store.counts(),
+            "avg_run_ms": round(run_time / finished * 1000.0, 1) if finished else None,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,139 @@
+"""
+Incremental Joystick / Material History
+
+Instead of re-querying and re-pivoting the whole last hour on every request,
+JoystickHistory keeps the recent joystick records in memory, in time order,
+and each sync() only asks InfluxDB for rows newer than the last one it has.
+Records older than the window are evicted, and /api/joystick is answered
+from memory (optionally only the rows after a client's `since=` time).
+
+Every sync re-reads a short overlap before the last seen time so rows that
+reach InfluxDB slightly late are still picked up; rows already in the
+buffer are recognized (same time and same values) and skipped. Distinct
+rows with the same timestamp are all kept.
+
+Classes:
+    TimeWindowBuffer: Time-ordered records of the last `window` seconds
+    JoystickHistory: TimeWindowBuffer kept in sync with InfluxDB
+"""
+
+import bisect
+import threading
+from datetime import datetime, timedelta, timezone
+
+HISTORY_WINDOW = timedelta(hours=1)
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def parse_time(value):
+    """ISO 8601 string -> timezone-aware datetime (naive times are UTC)"""
+    parsed = datetime.fromisoformat(value.strip().replace(" ", "+"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class TimeWindowBuffer:
+    """Records (dicts with a datetime "time") of the last `window`, oldest first"""
+
+    def __init__(self, window=HISTORY_WINDOW):
+        self.window = window
+        self._times = []
+        self._records = []
+        self._lock = threading.Lock()
+
+    def add(self, records):
+        """Insert records (any order); records already stored (equal dicts) are skipped"""
+        added = 0
+        with self._lock:
+            for record in sorted(records, key=lambda r: r["time"]):
+                first = bisect.bisect_left(self._times, record["time"])
+                position = bisect.bisect_right(self._times, record["time"], lo=first)
+                if record in self._records[first:position]:
+                    continue
+                self._times.insert(position, record["time"])
+                self._records.insert(position, record)
+                added += 1
+        return added
+
+    def evict(self, now=None):
+        """Drop records older than the window"""
+        cutoff = (now or datetime.now(timezone.utc)) - self.window
+        with self._lock:
+            position = bisect.bisect_left(self._times, cutoff)
+            del self._times[:position], self._records[:position]
+        return position
+
+    @property
+    def last_time(self):
+        with self._lock:
+            return self._times[-1] if self._times else None
+
+    def since(self, time=None, limit=None):
+        """Records newer than `time` (all if None), newest first, at most `limit` (None or 0: all)"""
+        if limit is not None and limit < 0:
+            raise ValueError(f"limit must not be negative, got {limit}")
+        with self._lock:
+            start = bisect.bisect_right(self._times, time) if time is not None else 0
+            records = self._records[start:]
+        records = records[::-1]
+        return records[:limit] if limit else records
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+
+class JoystickHistory:
+    """The joystick records of the last hour, fetched incrementally from InfluxDB"""
+
+    def __init__(self, query_api, bucket, window=HISTORY_WINDOW, overlap=SYNC_OVERLAP):
+        self.query_api = query_api
+        self.bucket = bucket
+        self.overlap = overlap
+        self.buffer = TimeWindowBuffer(window)
+        self.syncs = 0
+        self.rows_fetched = 0
+        self.rows_added = 0
+
+    def _flux(self, start):
+        if start is None:
+            window_range = f"-{int(self.buffer.window.total_seconds())}s"
+        else:
+            window_range = f'time(v: "{start.astimezone(timezone.utc).isoformat()}")'
+        return f'''
+            from(bucket: "{self.bucket}")
+                |> range(start: {window_range})
+                |> filter(fn: (r) => r.topic == "waste_sorting/joystick")
+                |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
+                |> keep(columns: ["_time", "material"])
+                |> sort(columns: ["_time"])
+        '''
+
+    def sync(self):
+        """Fetch the rows after the last seen time (the whole window on the first call)"""
+        last_time = self.buffer.last_time
+        start = last_time - self.overlap if last_time is not None else None
+        records = []
+        for table in self.query_api.query(self._flux(start)):
+            for record in table.records:
+                records.append({"time": record.get_time(), "material": record.values.get("material")})
+
+        self.syncs += 1
+        self.rows_fetched += len(records)
+        self.rows_added += self.buffer.add(records)
+        self.buffer.evict()
+        return self.buffer.last_time
+
+    def rows(self, since=None, limit=None):
+        """JSON rows (newest first) newer than `since`"""
+        return [{"time": record["time"].isoformat(), "material": record["material"]}
+                for record in self.buffer.since(since, limit)]
+
+    def stats(self):
+        last_time = self.buffer.last_time
+        return {
+            "records": len(self.buffer),
+            "last_time": last_time.isoformat() if last_time else None,
+            "syncs": self.syncs,
+            "rows_fetched": self.rows_fetched,
+            "rows_added": self.rows_added,
+        }
@@ -0,0 +1,192 @@
+"""
+MJPEG Live Preview of the Detection Pipeline
+
+Streams the annotated frames of running detection pipelines to any number of
+browser viewers (GET /api/stream in app.py) as multipart/x-mixed-replace
+JPEG, so the live view no longer needs a cv2.imshow window on the server.
+
+Every pipeline run publishes to the LiveStream of its frame source through
+a StreamSink. Streams are keyed and reported by source name (see
+frame_source.NAMED_SOURCES), never by the source config, so stream URLs and
+file paths stay on the server. Publishing only hands over the annotated frame; it is JPEG
+encoded at most once per frame and output variant (quality, width), by the
+first viewer that asks for it, and every other viewer sends the same bytes.
+Nothing is drawn or encoded while nobody watches, and a max-FPS cap bounds
+the encode work when the pipeline runs faster than the viewers need.
+
+Configuration (environment variables, per-viewer overrides in the URL are
+clamped to them):
+    BOTTLE_STREAM_QUALITY   JPEG quality (default 70)
+    BOTTLE_STREAM_WIDTH     Maximum frame width, 0 = pipeline size (default 640)
+    BOTTLE_STREAM_MAX_FPS   Maximum frames per second per viewer (default 15)
+
+Classes:
+    LiveStream: Latest annotated frame of one source and its cached encodings
+    StreamSink: Pipeline sink publishing annotated frames to a LiveStream
+
+Functions:
+    get_live_stream(): Shared LiveStream for a frame source name
+    live_stream_stats(): Viewer / frame / encode counters of all streams
+"""
+
+import os
+import threading
+import time
+
+import cv2
+
+from frame_source import DEFAULT_SOURCE_NAME
+
+STREAM_QUALITY = int(os.environ.get("BOTTLE_STREAM_QUALITY", "70"))
+STREAM_WIDTH = int(os.environ.get("BOTTLE_STREAM_WIDTH", "640"))
+STREAM_MAX_FPS = float(os.environ.get("BOTTLE_STREAM_MAX_FPS", "15"))
+
+# Resend the last frame this often when the pipeline is idle, so proxies keep the connection
+IDLE_RESEND_SECONDS = 2.0
+
+BOUNDARY = "frame"
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def get_live_stream(name=None):
+    """
+    The shared LiveStream of a frame source name (None = default source)
+
+    Streams are never removed, so only pass names of server-configured
+    sources (see frame_source.named_source_config()), never raw client input.
+    """
+    name = name or DEFAULT_SOURCE_NAME
+    with _streams_lock:
+        if name not in _streams:
+            _streams[name] = LiveStream(name)
+        return _streams[name]
+
+
+def live_stream_stats():
+    with _streams_lock:
+        streams = list(_streams.values())
+    return {stream.name: stream.stats() for stream in streams}
+
+
+class LiveStream:
+    """Latest annotated frame of one source, JPEG-encoded once per variant"""
+
+    def __init__(self, name):
+        self.name = name
+        self.viewers = 0
+        self.frames_published = 0
+        self.frames_encoded = 0
+        self.frames_sent = 0
+        self._frame = None
+        self._sequence = 0
+        self._encoded = {}
+        self._condition = threading.Condition()
+        self._encode_lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.viewers > 0
+
+    def publish(self, frame):
+        """Hand over a new annotated BGR frame (not copied; do not modify it afterwards)"""
+        with self._condition:
+            self._frame = frame
+            self._sequence += 1
+            self._encoded = {}
+            self.frames_published += 1
+            self._condition.notify_all()
+
+    def _jpeg(self, quality, width):
+        """JPEG of the current frame for one variant, encoded on first request"""
+        variant = (quality, width)
+        # One encoder at a time: viewers asking for the same frame wait and reuse it
+        with self._encode_lock:
+            with self._condition:
+                sequence, frame = self._sequence, self._frame
+                cached = self._encoded.get(variant)
+            if cached is not None or frame is None:
+                return sequence, cached
+
+            if width and frame.shape[1] > width:
+                height = int(frame.shape[0] * width / frame.shape[1])
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                return sequence, None
+            jpeg = buffer.tobytes()
+            self.frames_encoded += 1
+
+            with self._condition:
+                if self._sequence == sequence:
+                    self._encoded[variant] = jpeg
+        return sequence, jpeg
+
+    def frames(self, quality=STREAM_QUALITY, width=STREAM_WIDTH, max_fps=STREAM_MAX_FPS):
+        """multipart/x-mixed-replace body: one JPEG part per new frame, at most max_fps"""
+        quality = max(10, min(int(quality), 95))
+        width = int(width) if width else 0
+        min_interval = 1.0 / max_fps if max_fps and max_fps > 0 else 0.0
+        last_sequence = -1
+        last_sent = 0.0
+
+        with self._condition:
+            self.viewers += 1
+        try:
+            while True:
+                wait = last_sent + min_interval - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                with self._condition:
+                    if self._sequence == last_sequence:
+                        self._condition.wait(IDLE_RESEND_SECONDS)
+                # After an idle wait this resends the current frame from the cache
+                sequence, jpeg = self._jpeg(quality, width)
+                if jpeg is None:
+                    # No frame yet (or it failed to encode): wait for the next one
+                    last_sequence = sequence
+                    continue
+                last_sequence, last_sent = sequence, time.time()
+                self.frames_sent += 1
+                yield (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(jpeg)}\r\n\r\n").encode() + jpeg + b"\r\n"
+        finally:
+            with self._condition:
+                self.viewers -= 1
+
+    def stats(self):
+        return {
+            "viewers": self.viewers,
+            "frames_published": self.frames_published,
+            "frames_encoded": self.frames_encoded,
+            "frames_sent": self.frames_sent,
+        }
+
+
+class StreamSink:
+    """
+    Publish annotated frames of a pipeline run to a LiveStream
+
+    overlay(state, display_frame) draws on the frame like DisplaySink's; by
+    default the bottle boxes are drawn. Frames are skipped entirely while the
+    stream has no viewers or faster than max_fps.
+    """
+
+    def __init__(self, stream, overlay=None, max_fps=STREAM_MAX_FPS):
+        from detection_pipeline import draw_bottles
+
+        self.stream = stream
+        self.overlay = overlay or (lambda state, display_frame: draw_bottles(
+            display_frame, state.detections, state.high_confidence_threshold))
+        self.min_interval = 1.0 / max_fps if max_fps and max_fps > 0 else 0.0
+        self._last_published = 0.0
+
+    def on_frame(self, state):
+        now = time.time()
+        if not self.stream.active or now - self._last_published < self.min_interval:
+            return
+        display_frame = state.frame.copy()
+        self.overlay(state, display_frame)
+        self.stream.publish(display_frame)
+        self._last_published = now
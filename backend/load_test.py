@@ -0,0 +1,161 @@
+"""
+Load Test for /api/detect-bottle
+
+Sends concurrent POST /api/detect-bottle requests to a running server (see
+serve.py) with a video file as the frame source, and reports throughput
+(requests/second) and latency percentiles (p50 / p90 / p99).
+
+The API only accepts names of sources configured on the server, so the
+video is configured there (BOTTLE_FRAME_SOURCES, see frame_source.py) and
+the test sends its name. Requests for the same source are run one after
+another by the server (one reader per frame source, like a camera);
+configure copies of the clip under several names and give several --source
+options to measure parallel detections. --make-video writes a synthetic
+test clip.
+
+Usage:
+    python load_test.py --make-video test_clip.avi                      # test clip
+    export BOTTLE_FRAME_SOURCES='{"clip": {"type": "video", "path": "/abs/path/test_clip.avi"}}'
+    python serve.py --threads 4 --preload                               # server
+    python load_test.py --source clip --concurrency 4 --requests 40
+
+Functions:
+    make_test_video(): Write a synthetic clip (a bright "bottle" moving across the frame)
+    run_load_test(): Send the requests and collect per-request results
+    summarize(): Throughput, latency percentiles and outcome counts
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def make_test_video(path, num_frames=90, width=640, height=480, fps=30):
+    """Write a synthetic test clip (MJPG AVI) using the synthetic frame source"""
+    import cv2
+
+    from frame_source import SyntheticSource
+
+    source = SyntheticSource(width, height, fps=0, num_frames=num_frames)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    frames = 0
+    while True:
+        ret, frame = source.read()
+        if not ret:
+            break
+        writer.write(frame)
+        frames += 1
+    writer.release()
+    print(f"🎞️ Wrote {frames} frames to {path}")
+    return path
+
+
+def _post(url, body, timeout):
+    """One request; returns (status, outcome, seconds)"""
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, payload = response.status, json.loads(response.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        status, payload = e.code, {}
+    except Exception as e:
+        return None, type(e).__name__, time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    if status == 200:
+        outcome = "detected" if payload.get("success") else "no-bottle"
+    elif status == 202:
+        outcome = "still-running"
+    elif status == 429:
+        outcome = "queue-full"
+    elif status == 400:
+        outcome = "bad-request"
+    else:
+        outcome = f"http-{status}"
+    return status, outcome, elapsed
+
+
+def run_load_test(url, sources, concurrency=4, requests=40, backend=None, timeout=60.0):
+    """Send `requests` requests from `concurrency` threads; returns (results, wall time)"""
+    endpoint = url.rstrip("/") + "/api/detect-bottle"
+    results = []
+    lock = threading.Lock()
+
+    def send(index):
+        body = {"source": sources[index % len(sources)]}
+        if backend:
+            body["backend"] = backend
+        result = _post(endpoint, body, timeout)
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(requests)))
+    return results, time.perf_counter() - start
+
+
+def _percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, max(0, int(round(percent / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, wall_time):
+    latencies = sorted(elapsed for status, outcome, elapsed in results if status is not None)
+    summary = {
+        "requests": len(results),
+        "seconds": round(wall_time, 2),
+        "requests_per_second": round(len(results) / wall_time, 2) if wall_time else None,
+        "outcomes": dict(Counter(outcome for status, outcome, elapsed in results)),
+    }
+    if latencies:
+        summary.update({
+            "p50_ms": round(_percentile(latencies, 50) * 1000.0, 1),
+            "p90_ms": round(_percentile(latencies, 90) * 1000.0, 1),
+            "p99_ms": round(_percentile(latencies, 99) * 1000.0, 1),
+            "max_ms": round(latencies[-1] * 1000.0, 1),
+        })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test POST /api/detect-bottle with video file sources")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--source", action="append", dest="sources",
+                        help="Name of a video source configured on the server (repeatable)")
+    parser.add_argument("--make-video", help="Write a synthetic test clip to this path and exit")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--backend", help="Detector backend (default: the server's)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.make_video:
+        make_test_video(args.make_video)
+        print(f"   Configure it on the server: BOTTLE_FRAME_SOURCES='{{\"clip\": "
+              f"{{\"type\": \"video\", \"path\": \"{os.path.abspath(args.make_video)}\"}}}}'")
+        return
+    if not args.sources:
+        parser.error("--source is required (or --make-video to create a test clip)")
+
+    print(f"📊 {args.requests} requests, {args.concurrency} concurrent, {len(args.sources)} source(s) -> {args.url}")
+    results, wall_time = run_load_test(args.url, args.sources, args.concurrency, args.requests, args.backend,
+                                       args.timeout)
+    summary = summarize(results, wall_time)
+    print(f"   Throughput: {summary['requests_per_second']} req/s ({summary['requests']} in {summary['seconds']}s)")
+    if "p99_ms" in summary:
+        print(f"   Latency p50 / p90 / p99 / max: {summary['p50_ms']} / {summary['p90_ms']} / "
+              f"{summary['p99_ms']} / {summary['max_ms']} ms")
+    print(f"   Outcomes: {summary['outcomes']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Batched Bottle Material Classification
+
+Classifies every detected bottle of a frame in one forward pass of the
+material classifier (see object_detection_2.py).
+
+The original loop cropped each bottle with PIL, resized it and ran the
+classifier once per bottle, so latency grew linearly with the number of
+bottles on the belt. crop_and_resize() instead cuts all boxes out of the
+normalized frame tensor with a single roi_align call (bilinear sampling with
+averaging, which also anti-aliases large crops) into one N x 3 x 224 x 224
+batch, and classify_materials() runs the classifier once on that batch.
+
+In the real-time pipeline the classifier runs as an asynchronous second
+stage (AsyncMaterialClassifier): detection frames keep flowing on the capture
+thread while a worker thread classifies the crops, and results are attached
+to the detections once they are ready. Set BOTTLE_MATERIAL_CHECKPOINT to the
+trained classifier weights to enable it for the API.
+
+Classes:
+    AsyncMaterialClassifier: Worker thread running classify_materials()
+
+Functions:
+    normalize_image(): CHW [0, 1] tensor -> ImageNet-normalized tensor
+    frame_to_tensor(): BGR uint8 frame -> CHW [0, 1] RGB tensor
+    crop_and_resize(): Frame tensor + boxes -> batch of classifier inputs
+    classify_materials(): Material name and probability for every box
+    attach_materials(): Add material fields to bottle result dicts
+    get_material_classifier(): Shared classifier loaded from BOTTLE_MATERIAL_CHECKPOINT
+"""
+
+import os
+import queue
+import threading
+import time
+
+import torch
+from torchvision.ops import roi_align
+
+# Material labels
+MATERIAL_LABELS = {0: "Glass", 1: "Metal", 2: "Plastic"}
+
+# Classifier input (ImageNet-pretrained ResNet-50)
+MATERIAL_INPUT_SIZE = 224
+MATERIAL_MEAN = (0.485, 0.456, 0.406)
+MATERIAL_STD = (0.229, 0.224, 0.225)
+
+# Trained classifier weights; material classification is off by default without them
+MATERIAL_CHECKPOINT = os.environ.get("BOTTLE_MATERIAL_CHECKPOINT")
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def normalize_image(image):
+    """ImageNet-normalize a CHW float tensor in [0, 1]"""
+    mean = torch.tensor(MATERIAL_MEAN, dtype=image.dtype).view(3, 1, 1)
+    std = torch.tensor(MATERIAL_STD, dtype=image.dtype).view(3, 1, 1)
+    return (image - mean) / std
+
+
+def frame_to_tensor(frame):
+    """BGR uint8 HWC frame -> RGB CHW float tensor in [0, 1]"""
+    return torch.from_numpy(frame[:, :, ::-1].transpose(2, 0, 1).copy()).float().div_(255.0)
+
+
+def crop_and_resize(image, boxes, size=MATERIAL_INPUT_SIZE, normalized=False):
+    """
+    Cut every box out of a CHW image tensor and resize it to size x size
+
+    `boxes` is an N x 4 (x1, y1, x2, y2) tensor or array in image pixels.
+    Returns an N x 3 x size x size batch, ImageNet-normalized unless the image
+    already is (normalized=True).
+    """
+    if not normalized:
+        image = normalize_image(image)
+    boxes = torch.as_tensor(boxes, dtype=image.dtype).reshape(-1, 4)
+    if not len(boxes):
+        return image.new_empty((0, 3, size, size))
+
+    # roi_align takes boxes prefixed with their batch index
+    rois = torch.cat([boxes.new_zeros((len(boxes), 1)), boxes], dim=1)
+    return roi_align(image.unsqueeze(0), rois, output_size=(size, size),
+                     spatial_scale=1.0, sampling_ratio=2, aligned=True)
+
+
+def classify_materials(material_model, image, boxes, size=MATERIAL_INPUT_SIZE):
+    """
+    Classify the material of every bottle box in one batch
+
+    Returns a list of (material_name, probability) tuples in box order.
+    """
+    crops = crop_and_resize(image, boxes, size)
+    if not len(crops):
+        return []
+
+    with torch.inference_mode():
+        probabilities = torch.softmax(material_model(crops), dim=1)
+    confidence, material = probabilities.max(dim=1)
+    return [
+        (MATERIAL_LABELS.get(index, "Unknown"), probability)
+        for index, probability in zip(material.tolist(), confidence.tolist())
+    ]
+
+
+def attach_materials(bottles, detections, materials):
+    """
+    Add 'material' / 'material_confidence' to bottle dicts in place
+
+    Bottles are matched to the classified detections by their box, so the
+    dicts may be any subset of the detections (e.g. only high confidence ones).
+    """
+    by_box = {tuple(bbox): material for bbox, material in zip(detections["bbox"].tolist(), materials)}
+    for bottle in bottles:
+        match = by_box.get(tuple(bottle['bbox']))
+        if match is not None:
+            bottle['material'], bottle['material_confidence'] = match
+
+
+def get_material_classifier(checkpoint_path=None):
+    """Shared material classifier, loaded once (None without a checkpoint)"""
+    global _classifier
+
+    checkpoint_path = checkpoint_path or MATERIAL_CHECKPOINT
+    if not checkpoint_path:
+        return None
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                from object_detection_2 import load_material_classifier
+                _classifier = load_material_classifier(checkpoint_path)
+                print(f"✅ Material classifier loaded from {checkpoint_path}")
+    return _classifier
+
+
+class AsyncMaterialClassifier:
+    """
+    Classify bottle crops on a worker thread
+
+    submit() never blocks the caller: at most max_pending frames wait for
+    the worker, and when it falls behind the oldest waiting frame is dropped
+    in favor of the newest. callback(materials) runs on the worker thread.
+    """
+
+    def __init__(self, material_model, max_pending=2):
+        self.material_model = material_model
+        self.queue = queue.Queue(max_pending)
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.classify_time = 0.0
+        self._closing = False
+        # Set when close() gave up waiting: the worker skips the frames left
+        self._abandon = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, boxes, callback):
+        """Queue a BGR frame and its bottle boxes (frame pixels) for classification"""
+        if self._closing:
+            return
+        self.submitted += 1
+        self._put_dropping_oldest((frame, boxes, callback))
+
+    def _put_dropping_oldest(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    if self.queue.get_nowait() is not None:
+                        self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None or self._abandon.is_set():
+                break
+            frame, boxes, callback = item
+            try:
+                start = time.time()
+                materials = classify_materials(self.material_model, frame_to_tensor(frame), boxes)
+                self.classify_time += time.time() - start
+                self.completed += 1
+                callback(materials)
+            except Exception as e:
+                print(f"⚠️ Material classification error: {e}")
+
+    def close(self, timeout=2.0):
+        """Finish the queued frames (up to timeout seconds) and stop the worker"""
+        self._closing = True
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            # Worker is still behind: drop the waiting frames so the sentinel
+            # always gets in, and skip any frame it picks up before that
+            self._abandon.set()
+            self._put_dropping_oldest(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        """Submitted / completed / dropped frames and the average classification time"""
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "avg_ms": round(self.classify_time / self.completed * 1000.0, 2) if self.completed else None,
+        }
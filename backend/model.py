@@ -1,6 +1,11 @@
 import torch
+import torch.nn as nn
 import torchvision
+from torchvision.ops import MultiScaleRoIAlign
+import hashlib
+import json
 import os
+import threading
 
 # Create a directory for models in your project
 model_dir = "models"
@@ -9,26 +14,272 @@ os.makedirs(model_dir, exist_ok=True)
 # Set the torch hub directory to your project folder
 torch.hub.set_dir(model_dir)
 
-# Now load the model - it will download to your project/models folder
-model = torchvision.models.detection.fasterrcnn_resnet50_fpn(weights="DEFAULT")
-model.eval()
-
-# Make the model available for import
-__all__ = ['model']
-
-# def load_model():
-#     """Load the Faster R-CNN model with custom storage location"""
-#     # Use a different directory name
-#     model_dir = "model_checkpoints"
-#     os.makedirs(model_dir, exist_ok=True)
-    
-#     # Set the torch hub directory
-#     torch.hub.set_dir(model_dir)
-    
-#     # Load the model
-#     model = torchvision.models.detection.fasterrcnn_resnet50_fpn(weights="DEFAULT")
-#     model.eval()
-#     return model
-
-# # Create the model instance
-# model = load_model()
\ No newline at end of file
+# COCO class id of "bottle"
+BOTTLE_LABEL = 44
+
+# glass / metal / plastic (see material_classification.MATERIAL_LABELS)
+NUM_MATERIALS = 3
+
+# Interchangeable COCO detectors; all use the same label ids and return the
+# same boxes / labels / scores predictions
+MODEL_BACKENDS = {
+    "fasterrcnn_resnet50_fpn": torchvision.models.detection.fasterrcnn_resnet50_fpn,
+    "fasterrcnn_mobilenet_v3_large_fpn": torchvision.models.detection.fasterrcnn_mobilenet_v3_large_fpn,
+    "fasterrcnn_mobilenet_v3_large_320_fpn": torchvision.models.detection.fasterrcnn_mobilenet_v3_large_320_fpn,
+    "ssdlite320_mobilenet_v3_large": torchvision.models.detection.ssdlite320_mobilenet_v3_large,
+}
+DEFAULT_BACKEND = os.environ.get("BOTTLE_MODEL_BACKEND", "fasterrcnn_resnet50_fpn")
+
+# Faster R-CNN settings; unset values keep each backend's torchvision default
+# - bottle_only: score / regress only the bottle class in the box predictor
+# - rpn_post_nms_top_n_test: proposals kept per image for the ROI heads
+# - box_detections_per_img: maximum detections returned per image
+# - min_size / max_size: internal resize range of the detector input
+# - material_head: trained material head weights for the fused detector
+MODEL_CONFIG = {
+    "bottle_only": os.environ.get("BOTTLE_ONLY_MODEL", "0") == "1",
+}
+if os.environ.get("BOTTLE_MATERIAL_HEAD"):
+    MODEL_CONFIG["material_head"] = os.environ["BOTTLE_MATERIAL_HEAD"]
+for _option, _variable in (("rpn_post_nms_top_n_test", "BOTTLE_RPN_POST_NMS_TOP_N"),
+                           ("box_detections_per_img", "BOTTLE_DETECTIONS_PER_IMG"),
+                           ("min_size", "BOTTLE_MODEL_MIN_SIZE"),
+                           ("max_size", "BOTTLE_MODEL_MAX_SIZE")):
+    if os.environ.get(_variable):
+        MODEL_CONFIG[_option] = int(os.environ[_variable])
+
+# Load the cached INT8 / channels-last build instead (see optimize_model.py)
+OPTIMIZED_MODEL = os.environ.get("BOTTLE_OPTIMIZED_MODEL", "0") == "1"
+
+# Execution runtime: "torch" (eager), "torchscript" or "onnxruntime" (see export_models.py)
+MODEL_RUNTIMES = ("torch", "torchscript", "onnxruntime")
+MODEL_RUNTIME = os.environ.get("BOTTLE_MODEL_RUNTIME", "torch")
+
+# Shared model instances per backend, created on first use instead of at import time
+_models = {}
+_model_lock = threading.Lock()
+
+
+class BottleClassScore(nn.Module):
+    """
+    Two-way [background, bottle] classifier from the full COCO classifier
+
+    All non-bottle logits are folded into the background logit with
+    logsumexp, so the bottle softmax score is exactly the one the 91-class
+    head would give and the usual confidence thresholds still apply.
+    """
+
+    def __init__(self, cls_score, label=BOTTLE_LABEL):
+        super().__init__()
+        self.cls_score = cls_score
+        self.label = label
+
+    def forward(self, x):
+        logits = self.cls_score(x)
+        bottle = logits[:, self.label:self.label + 1]
+        rest = torch.cat([logits[:, :self.label], logits[:, self.label + 1:]], dim=1)
+        return torch.cat([rest.logsumexp(dim=1, keepdim=True), bottle], dim=1)
+
+
+class BottleOnlyDetector(nn.Module):
+    """Detector whose ROI heads only decode and NMS the bottle class"""
+
+    def __init__(self, detector, label=BOTTLE_LABEL):
+        super().__init__()
+        predictor = detector.roi_heads.box_predictor
+        predictor.cls_score = BottleClassScore(predictor.cls_score, label)
+
+        # Keep only the background and bottle box regressors
+        rows = torch.cat([torch.arange(0, 4), torch.arange(label * 4, label * 4 + 4)])
+        bbox_pred = nn.Linear(predictor.bbox_pred.in_features, 8)
+        with torch.no_grad():
+            bbox_pred.weight.copy_(predictor.bbox_pred.weight[rows])
+            bbox_pred.bias.copy_(predictor.bbox_pred.bias[rows])
+        predictor.bbox_pred = bbox_pred
+
+        self.detector = detector
+        self.label = label
+
+    def forward(self, images, targets=None):
+        outputs = self.detector(images, targets)
+        if self.training:
+            return outputs
+        # The sliced head reports class 1; map it back to the COCO bottle id
+        for output in outputs:
+            output["labels"] = torch.full_like(output["labels"], self.label)
+        return outputs
+
+
+class MaterialHead(nn.Module):
+    """
+    Small glass / metal / plastic classifier on the detector's FPN features
+
+    Boxes are RoI-aligned from the same multi-scale features the box head
+    uses, so classifying a bottle costs one 3x3 conv on a 7x7 patch instead
+    of a second ResNet-50 pass over the crop.
+    """
+
+    def __init__(self, featmap_names=("0", "1", "2", "3"), in_channels=256, hidden_channels=256,
+                 num_classes=NUM_MATERIALS, pool_size=7):
+        super().__init__()
+        self.roi_pool = MultiScaleRoIAlign(list(featmap_names), output_size=pool_size, sampling_ratio=2)
+        self.classifier = nn.Sequential(
+            nn.Conv2d(in_channels, hidden_channels, 3, padding=1),
+            nn.ReLU(inplace=True),
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+            nn.Linear(hidden_channels, num_classes),
+        )
+
+    def forward(self, features, boxes, image_sizes):
+        """Material logits for every box (boxes in transformed-image coordinates)"""
+        pooled = self.roi_pool(features, boxes, image_sizes)
+        return self.classifier(pooled)
+
+
+class FusedBottleMaterialDetector(nn.Module):
+    """
+    Faster R-CNN detector that also classifies the material of every box
+
+    Predictions get two extra entries: "materials" (material class index)
+    and "material_scores" (its softmax probability), computed from the
+    detector's own FPN features.
+    """
+
+    def __init__(self, detector, material_head):
+        super().__init__()
+        self.label = None
+        if isinstance(detector, BottleOnlyDetector):
+            self.label = detector.label
+            detector = detector.detector
+        self.detector = detector
+        self.material_head = material_head
+
+    def forward(self, images):
+        detector = self.detector
+        original_sizes = [image.shape[-2:] for image in images]
+        image_list, _ = detector.transform(images)
+        features = detector.backbone(image_list.tensors)
+        proposals, _ = detector.rpn(image_list, features)
+        detections, _ = detector.roi_heads(features, proposals, image_list.image_sizes)
+
+        boxes = [detection["boxes"] for detection in detections]
+        if sum(len(b) for b in boxes):
+            probabilities = torch.softmax(self.material_head(features, boxes, image_list.image_sizes), dim=1)
+            scores, materials = probabilities.max(dim=1)
+        else:
+            scores = boxes[0].new_empty(0)
+            materials = torch.empty(0, dtype=torch.int64)
+        for detection, material, score in zip(detections, materials.split([len(b) for b in boxes]),
+                                              scores.split([len(b) for b in boxes])):
+            detection["materials"] = material
+            detection["material_scores"] = score
+            if self.label is not None:
+                detection["labels"] = torch.full_like(detection["labels"], self.label)
+
+        return detector.transform.postprocess(detections, image_list.image_sizes, original_sizes)
+
+
+def build_material_head(detector):
+    """Material head matching a Faster R-CNN detector's box RoI pooling"""
+    detector = getattr(detector, "detector", detector)
+    return MaterialHead(detector.roi_heads.box_roi_pool.featmap_names, detector.backbone.out_channels)
+
+
+def load_material_head(path, detector):
+    """Load trained material head weights (see model_creation.train_material_head)"""
+    checkpoint = torch.load(path, map_location="cpu")
+    head = build_material_head(detector)
+    head.load_state_dict(checkpoint["state_dict"])
+    return head.eval(), checkpoint.get("backend")
+
+
+def resolve_backend(backend=None):
+    """Validate a backend name (None selects the configured default)"""
+    backend = backend or DEFAULT_BACKEND
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend '{backend}'. Available: {', '.join(MODEL_BACKENDS)}")
+    return backend
+
+
+def artifact_path(directory, name, key, extension=".pt"):
+    """Cache file for a converted model, keyed by its settings and the torch version"""
+    key = {**key, "torch": torch.__version__}
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(directory, f"{name}-{digest}{extension}")
+
+
+def load_model(backend=None, pretrained=True, **overrides):
+    """
+    Load a detector backend with custom storage location
+
+    pretrained=False builds the architecture without downloading any weights,
+    for callers that load their own state dict.
+    """
+    backend = resolve_backend(backend)
+    config = {**MODEL_CONFIG, **overrides}
+    bottle_only = config.pop("bottle_only", False)
+    material_head = config.pop("material_head", None)
+
+    is_faster_rcnn = backend.startswith("fasterrcnn")
+    if not is_faster_rcnn:
+        # Faster R-CNN tunables and the material head do not apply to single-stage detectors
+        if config or bottle_only or material_head:
+            print(f"⚠️ Ignoring Faster R-CNN settings for {backend}")
+        config, bottle_only, material_head = {}, False, None
+
+    # Loads the weights from (or downloads them to) the project models folder
+    if pretrained:
+        model = MODEL_BACKENDS[backend](weights="DEFAULT", **config)
+    else:
+        model = MODEL_BACKENDS[backend](weights=None, weights_backbone=None, **config)
+    if bottle_only:
+        model = BottleOnlyDetector(model)
+    if material_head:
+        head, head_backend = load_material_head(material_head, model)
+        if head_backend and head_backend != backend:
+            print(f"⚠️ Material head was trained on {head_backend} features, not {backend}")
+        model = FusedBottleMaterialDetector(model, head)
+    model.eval()
+    return model
+
+
+def get_model(backend=None):
+    """Return the shared instance of a backend, loading it once on first call"""
+    backend = resolve_backend(backend)
+
+    if backend not in _models:
+        with _model_lock:
+            if backend not in _models:
+                if MODEL_RUNTIME != "torch":
+                    from export_models import load_exported_detector
+                    _models[backend] = load_exported_detector(backend, MODEL_RUNTIME)
+                elif OPTIMIZED_MODEL:
+                    from optimize_model import load_optimized_detector
+                    _models[backend] = load_optimized_detector(backend)
+                else:
+                    _models[backend] = load_model(backend)
+    return _models[backend]
+
+
+def __getattr__(name):
+    # Keep `from model import model` working for existing importers
+    if name == "model":
+        return get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Public API (`from model import model` still works through __getattr__, but is not
+# exported so `import *` does not load the weights)
+__all__ = ['load_model', 'get_model', 'resolve_backend', 'artifact_path', 'MODEL_BACKENDS',
+           'MODEL_CONFIG', 'MODEL_RUNTIME', 'BottleOnlyDetector', 'MaterialHead', 'FusedBottleMaterialDetector',
+           'build_material_head', 'load_material_head']
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Download (first run) and load the weights into the models folder
+    backend = resolve_backend(sys.argv[1] if len(sys.argv) > 1 else None)
+    get_model(backend)
+    print(f"✅ Model {backend} ready in {model_dir}/")
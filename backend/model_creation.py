@@ -2,77 +2,314 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
+import torch.nn.functional as F
 from torchvision import datasets, models, transforms
 from torch.utils.data import DataLoader
 import os
+import random
+import time
+
+MATERIAL_TRANSFORMS = {
+    'train': transforms.Compose([
+        transforms.RandomResizedCrop(224),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ]),
+    'val': transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ]),
+}
+
+
+def _make_loader(dataset, batch_size, shuffle, num_workers, device):
+    """DataLoader with pinned memory (GPU) and workers kept alive between epochs"""
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+                      pin_memory=(device.type == "cuda"), persistent_workers=(num_workers > 0))
+
+
+def _run_epoch(model, loader, criterion, device, optimizer=None, scaler=None, amp=False):
+    """One pass over a loader; trains when an optimizer is given. Returns (loss, acc, images/sec)"""
+    training = optimizer is not None
+    running_loss = 0.0
+    running_corrects = 0
+    seen = 0
+    start = time.time()
+
+    with torch.set_grad_enabled(training):
+        for inputs, labels in loader:
+            inputs = inputs.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
+            with torch.autocast(device.type, enabled=amp):
+                outputs = model(inputs)
+                loss = criterion(outputs, labels)
+
+            if training:
+                optimizer.zero_grad(set_to_none=True)
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
+
+            running_loss += loss.item() * inputs.size(0)
+            running_corrects += (outputs.argmax(dim=1) == labels).sum().item()
+            seen += inputs.size(0)
+
+    elapsed = time.time() - start
+    return running_loss / max(seen, 1), running_corrects / max(seen, 1), seen / max(elapsed, 1e-9)
+
+
+def train_material_classifier(data_dir, save_path="bottle_material_classifier.pth", num_epochs=25,
+                              batch_size=32, lr=0.001, num_workers=4, freeze_backbone=False,
+                              cache_features=False, feature_cache_dir=None, feature_views=1,
+                              packed=False, packed_dir=None, mixed_precision=True, resume=False, patience=5, device=None):
+    """
+    Train the glass / metal / plastic classifier (object_detection_2.BottleMaterialClassifier)
+
+    - freeze_backbone: only train the final layer (minutes instead of hours on CPU)
+    - cache_features: with a frozen backbone, train the final layer on 2048-d
+      features kept in a memory-mapped cache (feature_cache.py, default
+      <data_dir>/.feature_cache); only new or changed images are embedded.
+      feature_views > 1 also caches augmented views of the training images
+    - packed: read the images from packed uint8 memory maps (packed_dataset.py,
+      default <data_dir>/.packed) instead of decoding the JPEGs every epoch;
+      the splits are packed on first use and repacked when files change
+    - mixed_precision: float16 autocast + gradient scaling on CUDA
+    - Validates every epoch and saves the best model (by val accuracy) to
+      save_path, loadable with load_material_classifier()
+    - Training state is saved to save_path + ".state" after every epoch;
+      resume=True continues from it
+    - Stops early after `patience` epochs without val improvement (None: never)
+    """
+    from object_detection_2 import BottleMaterialClassifier
+
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    amp = mixed_precision and device.type == "cuda"
+    state_path = save_path + ".state"
+    if cache_features and not freeze_backbone:
+        print("⚠️ Feature caching needs a frozen backbone, enabling freeze_backbone")
+        freeze_backbone = True
+
+    if cache_features and packed:
+        print("⚠️ Cached features already skip decoding, ignoring packed")
+
+    # Create datasets
+    image_datasets = {
+        x: datasets.ImageFolder(os.path.join(data_dir, x), MATERIAL_TRANSFORMS[x])
+        for x in ['train', 'val']
+    }
+
+    # Pre-trained ResNet with a 3-class (glass, metal, plastic) final layer
+    model = BottleMaterialClassifier(num_classes=3).to(device)
+    if freeze_backbone:
+        for name, param in model.named_parameters():
+            param.requires_grad_(name.startswith("resnet.fc."))
+
+    if cache_features:
+        # Frozen backbone: embed the images once, then train only the final layer
+        from feature_cache import CachedFeatureDataset, build_feature_cache
+
+        cache_dir = feature_cache_dir or os.path.join(data_dir, ".feature_cache")
+        fc = model.resnet.fc
+        model.resnet.fc = nn.Identity()
+        dataloaders = {}
+        for x in ['train', 'val']:
+            features, labels, _ = build_feature_cache(
+                model, os.path.join(data_dir, x), os.path.join(cache_dir, x),
+                MATERIAL_TRANSFORMS['val'], MATERIAL_TRANSFORMS['train'],
+                views=feature_views if x == 'train' else 1, batch_size=batch_size,
+                num_workers=num_workers, device=device,
+                key={"backbone": "resnet50", "weights": str(models.ResNet50_Weights.DEFAULT)})
+            dataloaders[x] = DataLoader(CachedFeatureDataset(features, labels, random_view=(x == 'train')),
+                                        batch_size=batch_size, shuffle=(x == 'train'))
+        model.resnet.fc = fc
+        trained = fc
+    elif packed:
+        # Decoded once into memory maps; batches are read and augmented as whole tensors
+        from packed_dataset import PackedImageDataset, pack_image_folder
+
+        pack_root = packed_dir or os.path.join(data_dir, ".packed")
+        dataloaders = {}
+        for x in ['train', 'val']:
+            pack_image_folder(os.path.join(data_dir, x), os.path.join(pack_root, x), num_workers=num_workers)
+            dataloaders[x] = PackedImageDataset(os.path.join(pack_root, x), train=(x == 'train')).batch_loader(
+                batch_size, num_workers=num_workers, pin_memory=(device.type == "cuda"))
+        trained = model
+    else:
+        dataloaders = {
+            x: _make_loader(image_datasets[x], batch_size, x == 'train', num_workers, device)
+            for x in ['train', 'val']
+        }
+        trained = model
+
+    # Loss function and optimizer
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.SGD([p for p in trained.parameters() if p.requires_grad], lr=lr, momentum=0.9)
+    scaler = torch.amp.GradScaler(device.type, enabled=amp)
+
+    start_epoch, best_acc, stale_epochs = 0, -1.0, 0
+    if resume and os.path.exists(state_path):
+        state = torch.load(state_path, map_location=device)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scaler.load_state_dict(state["scaler"])
+        start_epoch, best_acc, stale_epochs = state["epoch"] + 1, state["best_acc"], state["stale_epochs"]
+        print(f"▶️ Resuming from epoch {start_epoch} (best val acc {best_acc:.4f})")
+
+    for epoch in range(start_epoch, num_epochs):
+        trained.train()
+        if freeze_backbone and not cache_features:
+            # Keep the frozen BatchNorm statistics
+            model.eval()
+        train_loss, train_acc, train_speed = _run_epoch(trained, dataloaders['train'], criterion, device,
+                                                        optimizer, scaler, amp)
+        trained.eval()
+        val_loss, val_acc, val_speed = _run_epoch(trained, dataloaders['val'], criterion, device, amp=amp)
+
+        print(f'Epoch {epoch}/{num_epochs - 1} - Train Loss: {train_loss:.4f} Acc: {train_acc:.4f} '
+              f'({train_speed:.1f} img/s) - Val Loss: {val_loss:.4f} Acc: {val_acc:.4f} ({val_speed:.1f} img/s)')
+
+        if val_acc > best_acc:
+            best_acc, stale_epochs = val_acc, 0
+            torch.save(model.state_dict(), save_path)
+            print(f"   💾 Best model saved to {save_path}")
+        else:
+            stale_epochs += 1
+
+        torch.save({
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scaler": scaler.state_dict(),
+            "epoch": epoch,
+            "best_acc": best_acc,
+            "stale_epochs": stale_epochs,
+        }, state_path)
+
+        if patience is not None and stale_epochs >= patience:
+            print(f"⏹️ Early stopping: no val improvement for {patience} epochs")
+            break
+
+    # Return the best model
+    if os.path.exists(save_path):
+        model.load_state_dict(torch.load(save_path, map_location=device))
+    print(f"Model saved to {save_path} (best val acc {best_acc:.4f})")
+
+    return model
+
+def _collate_crops(batch):
+    """Keep differently sized crops as a list instead of stacking them"""
+    return tuple(zip(*batch))
+
+
+def _paste_on_canvas(crop, canvas_size, train):
+    """Place a bottle crop on a gray frame-sized canvas; returns (canvas, box)"""
+    width, height = canvas_size
+    crop_height, crop_width = crop.shape[1:]
+    # Bottles cover roughly a third to most of the frame height on the belt
+    scale = random.uniform(0.35, 0.9) if train else 0.6
+    factor = scale * min(height / crop_height, width / crop_width)
+    new_height, new_width = max(1, int(crop_height * factor)), max(1, int(crop_width * factor))
+    crop = F.interpolate(crop[None], size=(new_height, new_width), mode="bilinear",
+                         align_corners=False, antialias=True)[0]
+
+    x = random.randint(0, width - new_width) if train else (width - new_width) // 2
+    y = random.randint(0, height - new_height) if train else (height - new_height) // 2
+    canvas = torch.full((3, height, width), 0.5)
+    canvas[:, y:y + new_height, x:x + new_width] = crop
+    return canvas, torch.tensor([[x, y, x + new_width, y + new_height]], dtype=torch.float32)
+
+
+def train_material_head(data_dir, save_path="bottle_material_head.pth", backend=None, num_epochs=10,
+                        batch_size=8, lr=0.001, canvas_size=(320, 240), num_workers=4):
+    """
+    Train the material head of the fused detector (model.FusedBottleMaterialDetector)
+
+    Only the small head is trained; the detector stays frozen and provides the
+    FPN features. Uses the same train/val crop folders as
+    train_material_classifier(). Each crop is pasted onto a frame-sized canvas
+    so the head learns from features at the scale it sees in the real-time loop.
+    The head with the best val accuracy is saved to save_path. Enable it with
+    BOTTLE_MATERIAL_HEAD=<save_path>.
+    """
+    from model import build_material_head, load_model, resolve_backend
+
+    backend = resolve_backend(backend)
+    if not backend.startswith("fasterrcnn"):
+        raise ValueError(f"The material head needs a Faster R-CNN backend (FPN features and ROI pooling), "
+                         f"got '{backend}'")
+    detector = load_model(backend, bottle_only=False, material_head=None)
+    detector.eval()
+    for param in detector.parameters():
+        param.requires_grad_(False)
+    head = build_material_head(detector)
 
-def train_material_classifier(data_dir, save_path="bottle_material_classifier.pth"):
-    # Data transformations
     data_transforms = {
-        'train': transforms.Compose([
-            transforms.RandomResizedCrop(224),
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ]),
-        'val': transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ]),
+        'train': transforms.Compose([transforms.RandomHorizontalFlip(), transforms.ToTensor()]),
+        'val': transforms.ToTensor(),
     }
-    
-    # Create datasets
     image_datasets = {
         x: datasets.ImageFolder(os.path.join(data_dir, x), data_transforms[x])
         for x in ['train', 'val']
     }
-    
-    # Create dataloaders
+    # Crops have different sizes, so batches stay lists
     dataloaders = {
-        x: DataLoader(image_datasets[x], batch_size=4, shuffle=True, num_workers=4)
+        x: DataLoader(image_datasets[x], batch_size=batch_size, shuffle=(x == 'train'), num_workers=num_workers,
+                      collate_fn=_collate_crops)
         for x in ['train', 'val']
     }
-    
-    # Load pre-trained ResNet
-    model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
-    num_ftrs = model.fc.in_features
-    model.fc = nn.Linear(num_ftrs, 3)  # 3 classes: glass, metal, plastic
-    
-    # Loss function and optimizer
+
+    def head_logits(crops, train):
+        placed = [_paste_on_canvas(crop, canvas_size, train) for crop in crops]
+        canvases = [canvas for canvas, _ in placed]
+        with torch.no_grad():
+            image_list, _ = detector.transform(canvases)
+            features = detector.backbone(image_list.tensors)
+        # Boxes in the detector's internally resized coordinates
+        boxes = []
+        for (_, box), (new_height, new_width) in zip(placed, image_list.image_sizes):
+            scale = torch.tensor([new_width / canvas_size[0], new_height / canvas_size[1]] * 2)
+            boxes.append(box * scale)
+        return head(features, boxes, image_list.image_sizes)
+
     criterion = nn.CrossEntropyLoss()
-    optimizer = optim.SGD(model.parameters(), lr=0.001, momentum=0.9)
-    
-    # Training loop (simplified)
-    num_epochs = 25
+    optimizer = optim.Adam(head.parameters(), lr=lr)
+    best_acc = -1.0
+
     for epoch in range(num_epochs):
-        # Training phase
-        model.train()
-        running_loss = 0.0
-        running_corrects = 0
-        
-        for inputs, labels in dataloaders['train']:
-            optimizer.zero_grad()
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-            
-            _, preds = torch.max(outputs, 1)
-            running_loss += loss.item() * inputs.size(0)
-            running_corrects += torch.sum(preds == labels.data)
-        
-        epoch_loss = running_loss / len(image_datasets['train'])
-        epoch_acc = running_corrects.double() / len(image_datasets['train'])
-        
-        print(f'Epoch {epoch}/{num_epochs - 1} - Train Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
-    
-    # Save the model
-    torch.save(model.state_dict(), save_path)
-    print(f"Model saved to {save_path}")
-    
-    return model
+        for phase in ['train', 'val']:
+            head.train(phase == 'train')
+            running_loss = 0.0
+            running_corrects = 0
+
+            for crops, labels in dataloaders[phase]:
+                labels = torch.tensor(labels)
+                with torch.set_grad_enabled(phase == 'train'):
+                    outputs = head_logits(crops, phase == 'train')
+                    loss = criterion(outputs, labels)
+                    if phase == 'train':
+                        optimizer.zero_grad()
+                        loss.backward()
+                        optimizer.step()
+
+                running_loss += loss.item() * len(labels)
+                running_corrects += (outputs.argmax(dim=1) == labels).sum().item()
+
+            epoch_loss = running_loss / len(image_datasets[phase])
+            epoch_acc = running_corrects / len(image_datasets[phase])
+            print(f'Epoch {epoch}/{num_epochs - 1} - {phase.capitalize()} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+
+        if epoch_acc > best_acc:
+            best_acc = epoch_acc
+            torch.save({"backend": backend, "state_dict": head.state_dict()}, save_path)
+            print(f"   💾 Best material head saved to {save_path}")
+
+    # Return the best head
+    head.load_state_dict(torch.load(save_path, map_location="cpu")["state_dict"])
+    print(f"Material head saved to {save_path} (best val acc {best_acc:.4f})")
+
+    return head
 
 # To use this, you would need a dataset structure like:
 # data/
@@ -0,0 +1,303 @@
+"""
+Persistent Model-Serving Worker
+
+This module keeps the bottle detectors loaded and warmed up (one per model
+backend, see model.MODEL_BACKENDS), and serves them to the Flask app and the
+CLI detection tools through one typed `infer(frames, backend=None)` API.
+
+Serving Modes:
+- In-process: the first call to infer() loads the model once and every later
+  caller in the same process reuses it
+- Shared server: `python model_server.py` holds the only copy of the weights
+  and other processes connect to it over a local socket. Set the
+  BOTTLE_MODEL_SERVER environment variable (e.g. "127.0.0.1:6001") in the
+  Flask app / CLI tools to use it.
+
+Single-frame requests from concurrent callers are micro-batched into one
+forward pass (see batching.py). Tune with BOTTLE_MAX_BATCH_SIZE (1 disables
+batching) and BOTTLE_MAX_BATCH_WAIT_MS.
+
+Authentication:
+Requests are pickled, so only clients that know the server's authkey may
+connect. Set the same BOTTLE_MODEL_AUTHKEY in the server and its clients;
+it is required when the server listens on anything but a loopback address.
+Without it a loopback server generates a random key and writes it to a file
+only the current user can read (BOTTLE_MODEL_AUTHKEY_FILE, default
+~/.bottle_model_server_<port>.key), where clients on the same machine pick
+it up.
+
+Usage:
+    python model_server.py --host 127.0.0.1 --port 6001
+
+Functions:
+    infer(): Run a detector backend on a list of CHW float tensors
+    get_inference_client(): Get the shared (local or remote) client of a backend
+    get_inference_metrics(): Service and batching statistics
+    serve(): Run the shared model server
+    connect(): Connect to a running model server
+"""
+
+import ipaddress
+import os
+import secrets
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from batching import MicroBatchScheduler
+from model import get_model, resolve_backend
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 6001
+AUTHKEY = os.environ.get("BOTTLE_MODEL_AUTHKEY", "").encode() or None
+AUTHKEY_FILE = os.environ.get("BOTTLE_MODEL_AUTHKEY_FILE", "~/.bottle_model_server_{port}.key")
+
+# Detector input size used by the real-time loops (height, width)
+WARMUP_SIZE = (240, 320)
+
+# Micro-batching of concurrent single-frame requests
+MAX_BATCH_SIZE = int(os.environ.get("BOTTLE_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("BOTTLE_MAX_BATCH_WAIT_MS", "5"))
+
+Prediction = Dict[str, torch.Tensor]
+
+
+class InferenceService:
+    """Owns one loaded detector backend and runs inference on it"""
+
+    def __init__(self, model=None, backend=None, warmup=True, max_batch_size=MAX_BATCH_SIZE,
+                 max_batch_wait_ms=MAX_BATCH_WAIT_MS):
+        start = time.time()
+        self.backend = resolve_backend(backend)
+        self.model = model if model is not None else get_model(self.backend)
+        self.load_time = time.time() - start
+        self.requests_served = 0
+        self.frames_served = 0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self.scheduler = None
+        if max_batch_size > 1:
+            self.scheduler = MicroBatchScheduler(self._forward, max_batch_size, max_batch_wait_ms)
+
+        if warmup:
+            self.warmup()
+
+    def warmup(self, size=WARMUP_SIZE):
+        """Run one dummy frame so the first real request is not slow"""
+        start = time.time()
+        self._forward([torch.zeros(3, *size)])
+        print(f"🔥 Detector {self.backend} warmed up in {time.time() - start:.2f}s")
+
+    def infer(self, frames: Sequence[torch.Tensor]) -> List[Prediction]:
+        """Run the detector on CHW float tensors in [0, 1]"""
+        with self._stats_lock:
+            self.requests_served += 1
+        if self.scheduler is not None:
+            return self.scheduler.infer(frames)
+        return self._forward(frames)
+
+    def _forward(self, frames: Sequence[torch.Tensor]) -> List[Prediction]:
+        """One forward pass over a batch of frames"""
+        with self._lock, torch.inference_mode():
+            preds = self.model(list(frames))
+            self.frames_served += len(frames)
+        return preds
+
+    def infer_arrays(self, frames: Sequence[np.ndarray]) -> List[Dict[str, np.ndarray]]:
+        """Socket-friendly variant of infer() that works on NumPy arrays"""
+        preds = self.infer([torch.from_numpy(frame) for frame in frames])
+        return [{key: value.numpy() for key, value in pred.items()} for pred in preds]
+
+    def info(self) -> dict:
+        """Basic statistics about this service"""
+        return {
+            "pid": os.getpid(),
+            "backend": self.backend,
+            "load_time": round(self.load_time, 2),
+            "requests_served": self.requests_served,
+            "frames_served": self.frames_served,
+            "batching": self.scheduler.metrics() if self.scheduler is not None else None,
+        }
+
+
+class RemoteInferenceClient:
+    """Client for a model server running in another process"""
+
+    def __init__(self, proxy, address):
+        # Manager proxies open one connection per calling thread, so concurrent
+        # callers reach the server in parallel and can be batched together
+        self._proxy = proxy
+        self.address = address
+
+    def infer(self, frames: Sequence[torch.Tensor]) -> List[Prediction]:
+        """Send frames to the model server and return torch predictions"""
+        arrays = [frame.detach().cpu().numpy() for frame in frames]
+        preds = self._proxy.infer_arrays(arrays)
+        return [{key: torch.from_numpy(value) for key, value in pred.items()} for pred in preds]
+
+    def info(self) -> dict:
+        return self._proxy.info()
+
+
+class _ServerManager(BaseManager):
+    pass
+
+
+class _ClientManager(BaseManager):
+    pass
+
+
+_ClientManager.register("get_service")
+
+
+def parse_address(address) -> Tuple[str, int]:
+    """Parse "host:port" (or just "port") into an address tuple"""
+    host, _, port = str(address).rpartition(":")
+    return (host or DEFAULT_HOST, int(port))
+
+
+def _is_loopback(host) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _authkey_file(port) -> str:
+    return os.path.expanduser(AUTHKEY_FILE.format(port=port))
+
+
+def _server_authkey(host, port) -> bytes:
+    """BOTTLE_MODEL_AUTHKEY, or a random key shared through the key file on loopback"""
+    if AUTHKEY:
+        return AUTHKEY
+    if not _is_loopback(host):
+        raise RuntimeError(f"Set BOTTLE_MODEL_AUTHKEY to serve on {host}: requests are pickled and "
+                           f"anyone who can connect without a secret key can run code on this machine")
+    authkey = secrets.token_hex(32).encode()
+    path = _authkey_file(port)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    # O_CREAT does not change the mode of an existing file
+    os.chmod(path, 0o600)
+    print(f"🔑 Generated model server authkey in {path}")
+    return authkey
+
+
+def _client_authkey(port) -> bytes:
+    """BOTTLE_MODEL_AUTHKEY, or the key a loopback server wrote to the key file"""
+    if AUTHKEY:
+        return AUTHKEY
+    path = _authkey_file(port)
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    except OSError as e:
+        raise RuntimeError(f"No BOTTLE_MODEL_AUTHKEY set and no key file at {path}: {e}")
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, authkey=None, backends=None):
+    """
+    Load the models once and serve them to other processes over a local socket
+
+    `backends` are loaded up front (default: the configured default backend);
+    other backends are loaded on their first request. The authkey defaults to
+    BOTTLE_MODEL_AUTHKEY (see Authentication above).
+    """
+    authkey = authkey or _server_authkey(host, port)
+    services = {}
+    services_lock = threading.Lock()
+
+    def get_service(backend=None):
+        backend = resolve_backend(backend)
+        with services_lock:
+            if backend not in services:
+                services[backend] = InferenceService(backend=backend)
+            return services[backend]
+
+    for backend in backends or [None]:
+        get_service(backend)
+    _ServerManager.register("get_service", callable=get_service)
+
+    manager = _ServerManager(address=(host, port), authkey=authkey)
+    server = manager.get_server()
+
+    print(f"✅ Model server ready on {host}:{port} (backends: {', '.join(services)})")
+    print("   Press Ctrl+C to stop")
+    server.serve_forever()
+
+
+def connect(address, authkey=None, backend=None):
+    """Connect to a backend of a running model server"""
+    address = parse_address(address)
+    authkey = authkey or _client_authkey(address[1])
+    manager = _ClientManager(address=address, authkey=authkey)
+    manager.connect()
+    return RemoteInferenceClient(manager.get_service(resolve_backend(backend)), address)
+
+
+# Shared clients for this process, one per backend
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def get_inference_client(backend=None):
+    """
+    Get the shared inference client of a backend for this process
+
+    Uses the model server named by BOTTLE_MODEL_SERVER when it is reachable,
+    otherwise loads the model in-process once.
+    """
+    backend = resolve_backend(backend)
+
+    if backend not in _clients:
+        with _client_lock:
+            if backend not in _clients:
+                client = None
+                address = os.environ.get("BOTTLE_MODEL_SERVER")
+                if address:
+                    try:
+                        client = connect(address, backend=backend)
+                        print(f"✅ Connected to model server at {address} ({backend})")
+                    except Exception as e:
+                        print(f"⚠️ Model server {address} not available ({e}), loading model locally")
+                if client is None:
+                    client = InferenceService(backend=backend)
+                _clients[backend] = client
+    return _clients[backend]
+
+
+def infer(frames: Sequence[torch.Tensor], backend=None) -> List[Prediction]:
+    """Run a shared detector backend on a list of CHW float tensors"""
+    return get_inference_client(backend).infer(frames)
+
+
+def get_inference_metrics() -> dict:
+    """Statistics of the loaded inference clients, without loading any model"""
+    if not _clients:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "backends": {backend: client.info() for backend, client in list(_clients.items())},
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shared bottle detection model server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", action="append", dest="backends",
+                        help="Backend to preload (repeatable, default: BOTTLE_MODEL_BACKEND)")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, backends=args.backends)
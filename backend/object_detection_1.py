@@ -16,6 +16,8 @@ Performance Optimizations:
 - Reduced resolution processing (320x240)
 - Optimized tensor operations
 - Minimal memory allocation
+- Threaded capture: inference always gets the latest frame, stale frames are dropped
+- One staged detection pipeline for every mode (see detection_pipeline.py)
 
 Usage:
     python object_detection_1.py
@@ -38,12 +40,15 @@ from PIL import Image
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import cv2
-import numpy as np
 import time
 import threading
-import base64
 from collections import deque
-from model import model  # Import the model from your model.py file
+from model_server import infer  # Shared, preloaded detector (see model_server.py)
+from detection_pipeline import (
+    DetectionPipeline, SavedFramesSink, EventRecorderSink, DisplaySink, CallbackSink,
+    AutoStop, DurationLimit, MaxFrames, draw_bottles, encode_frame_base64
+)
+from material_classification import get_material_classifier
 
 # Global variables for frame saving and monitoring
 current_frame = None
@@ -61,8 +66,7 @@ def detect_image(img_path):
     img_tensor = transform(img)
 
     # Run detection
-    with torch.no_grad():
-        preds = model([img_tensor])
+    preds = infer([img_tensor])
 
     # Extract predictions
     boxes = preds[0]["boxes"]
@@ -85,9 +89,44 @@ def detect_image(img_path):
     print(f"Detected {bottle_count} bottles")
     plt.show()
 
-def detect_webcam_optimized():
+def _store_detection(frame, results):
+    """Update the global detection variables and the saved_frames deque"""
+    global current_frame, detection_results
+    
+    with frame_lock:
+        current_frame = frame.copy()
+        detection_results = results
+        
+        # Save frame to deque
+        saved_frames.append({
+            'frame': frame.copy(),
+            'detections': results.copy(),
+            'save_time': time.strftime("%Y-%m-%d %H:%M:%S")
+        })
+
+def _print_session_summary(state, detection_count):
+    """Print frame, detection and per-stage timing statistics of a pipeline run"""
+    print("\n📊 SESSION SUMMARY:")
+    print(f"   Total frames processed: {state.frame_number}")
+    print(f"   Detection events: {detection_count}")
+    print(f"   Saved frames: {len(saved_frames)}")
+    print(f"   Stale frames dropped: {state.capture_stats.get('frames_dropped', 0)}")
+    if state.frame_number > 0:
+        print(f"   Detection rate: {(detection_count/state.frame_number*100):.1f}%")
+    else:
+        print("   Detection rate: No frames processed")
+    print(f"   Stage timings (ms): {state.timing_report()}")
+
+def _draw_stats(display_frame, lines):
+    """Draw (text, highlighted) status lines in the top-left corner"""
+    for i, (text, highlighted) in enumerate(lines):
+        cv2.putText(display_frame, text, (10, 30 + 30 * i), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0) if highlighted else (255, 255, 255), 2)
+
+def detect_webcam_optimized(source=None):
     """
     Optimized real-time bottle detection with improved FPS performance
+    `source` selects the frame source (see frame_source.py); default is the webcam
     Features:
     - Frame skipping for better performance
     - Reduced resolution processing
@@ -96,12 +135,44 @@ def detect_webcam_optimized():
     - Terminal display of detection results
     - Auto-stop camera and display image when bottle detected
     """
-    global current_frame, detection_results, saved_frames
+    # Performance optimization parameters
+    HIGH_CONFIDENCE_THRESHOLD = 0.8  # High confidence threshold for auto-stop display
+    
+    # Only save and auto-stop for HIGH CONFIDENCE detections
+    saver = SavedFramesSink(_store_detection, min_confidence=HIGH_CONFIDENCE_THRESHOLD)
+    
+    def report(state):
+        if state.detected and len(state.high_confidence):
+            # Display detection info in terminal
+            print(f"\n🍾 HIGH CONFIDENCE BOTTLES DETECTED! Frame #{state.frame_number}")
+            print(f"   High confidence count: {len(state.high_confidence)} bottles")
+            print(f"   Total bottles seen: {len(state.detections)} bottles")
+            print(f"   Time: {time.strftime('%H:%M:%S')}")
+            print(f"   High confidence scores: {['%.2f' % c for c in state.high_confidence['confidence']]}")
+            print(f"   Frame saved to variable (Total saved: {len(saved_frames)})")
+            print("-" * 60)
+            print("🎯 STOPPING CAMERA AND DISPLAYING HIGH CONFIDENCE BOTTLE IMAGE...")
+    
+    def overlay(state, display_frame):
+        # Show all detections but highlight high confidence
+        draw_bottles(display_frame, state.detections, HIGH_CONFIDENCE_THRESHOLD)
+        _draw_stats(display_frame, [
+            (f"FPS: {state.fps:.1f}", False),
+            (f"High Conf Events: {saver.count}", False),
+            (f"All Bottles: {len(state.detections)}", len(state.detections) > 0),
+            (f"High Conf Now: {len(state.high_confidence)}", len(state.high_confidence) > 0),
+        ])
     
-    # Initialize webcam
-    cap = cv2.VideoCapture(0)
+    pipeline = DetectionPipeline(
+        source,
+        sinks=[saver, CallbackSink(report), DisplaySink('Auto-Stop Bottle Detection', overlay)],
+        stop_policies=[AutoStop()],
+        detection_interval=3,  # Process every 3rd frame for detection
+        confidence_threshold=0.6,  # Base confidence threshold
+        high_confidence_threshold=HIGH_CONFIDENCE_THRESHOLD,
+    )
     
-    if not cap.isOpened():
+    if not pipeline.open():
         print("❌ Error: Could not open webcam")
         print("   Troubleshooting:")
         print("   1. Check if camera is connected and not used by another app")
@@ -109,217 +180,27 @@ def detect_webcam_optimized():
         print("   3. Check camera permissions")
         return
     
-    # Test camera capture
-    ret, test_frame = cap.read()
-    if not ret:
-        print("❌ Error: Camera connected but cannot capture frames")
-        print("   This might be a driver or permission issue")
-        cap.release()
-        return
-    
-    print(f"✅ Camera initialized successfully - Frame size: {test_frame.shape}")
-    
-    # Set camera properties for better performance
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    cap.set(cv2.CAP_PROP_FPS, 30)
-    
     print("Real-time bottle detection started...")
     print("Camera will automatically stop and display image when bottle is detected!")
     print("Press 'q' to quit manually")
     print("-" * 60)
     
-    # Performance optimization parameters
-    DETECTION_INTERVAL = 3  # Process every 3rd frame for detection
-    RESIZE_WIDTH = 320  # Smaller resolution for faster processing
-    RESIZE_HEIGHT = 240
-    CONFIDENCE_THRESHOLD = 0.6  # Base confidence threshold
-    HIGH_CONFIDENCE_THRESHOLD = 0.8  # High confidence threshold for auto-stop display
-    
-    # Create optimized transform
-    transform = T.Compose([
-        T.Resize((RESIZE_HEIGHT, RESIZE_WIDTH)),  # Reduce resolution
-        T.ToTensor()
-    ])
-    
-    # FPS tracking
-    fps_counter = 0
-    fps_start_time = time.time()
-    frame_count = 0
-    detection_count = 0
-    
-    # Detection state
-    last_detection_time = 0
-    bottles_detected_current = 0
-    
-    while True:
-        start_time = time.time()
-        
-        # Capture frame
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Failed to capture image")
-            break
-        
-        frame_count += 1
-        display_frame = frame.copy()
-        
-        # Only run detection every DETECTION_INTERVAL frames
-        if frame_count % DETECTION_INTERVAL == 0:
-            # Resize frame for faster processing
-            small_frame = cv2.resize(frame, (RESIZE_WIDTH, RESIZE_HEIGHT))
-            rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_frame)
-            
-            # Transform and run detection
-            img_tensor = transform(pil_image)
-            
-            with torch.no_grad():
-                preds = model([img_tensor])
-            
-            # Extract predictions
-            boxes = preds[0]["boxes"]
-            labels = preds[0]["labels"]
-            scores = preds[0]["scores"]
-            
-            # Scale boxes back to original size
-            scale_x = frame.shape[1] / RESIZE_WIDTH
-            scale_y = frame.shape[0] / RESIZE_HEIGHT
-            
-            bottles_detected_current = 0
-            high_confidence_bottles = 0
-            bottle_info = []
-            high_confidence_bottle_info = []
-            
-            for box, label, score in zip(boxes, labels, scores):
-                if label.item() == 44 and score > CONFIDENCE_THRESHOLD:  # 44 = bottle
-                    bottles_detected_current += 1
-                    
-                    # Scale coordinates back to original frame size
-                    x1, y1, x2, y2 = box.tolist()
-                    x1 = int(x1 * scale_x)
-                    y1 = int(y1 * scale_y)
-                    x2 = int(x2 * scale_x)
-                    y2 = int(y2 * scale_y)
-                    
-                    bottle_data = {
-                        'bbox': (x1, y1, x2, y2),
-                        'confidence': score.item()
-                    }
-                    
-                    bottle_info.append(bottle_data)
-                    
-                    # Check if this is a high confidence detection
-                    if score > HIGH_CONFIDENCE_THRESHOLD:
-                        high_confidence_bottles += 1
-                        high_confidence_bottle_info.append(bottle_data)
-            
-            # Only save and auto-stop for HIGH CONFIDENCE detections
-            if high_confidence_bottles > 0:
-                with frame_lock:
-                    current_frame = frame.copy()
-                    detection_results = {
-                        'bottle_count': high_confidence_bottles,
-                        'bottles': high_confidence_bottle_info,
-                        'timestamp': time.time(),
-                        'frame_number': frame_count
-                    }
-                    
-                    # Save frame to deque
-                    saved_frames.append({
-                        'frame': frame.copy(),
-                        'detections': detection_results.copy(),
-                        'save_time': time.strftime("%Y-%m-%d %H:%M:%S")
-                    })
-                
-                detection_count += 1
-                last_detection_time = time.time()
-                
-                # Display detection info in terminal
-                print(f"\n🍾 HIGH CONFIDENCE BOTTLES DETECTED! Frame #{frame_count}")
-                print(f"   High confidence count: {high_confidence_bottles} bottles")
-                print(f"   Total bottles seen: {bottles_detected_current} bottles")
-                print(f"   Time: {time.strftime('%H:%M:%S')}")
-                print(f"   High confidence scores: {[f'{b['confidence']:.2f}' for b in high_confidence_bottle_info]}")
-                print(f"   Frame saved to variable (Total saved: {len(saved_frames)})")
-                print("-" * 60)
-                print("🎯 STOPPING CAMERA AND DISPLAYING HIGH CONFIDENCE BOTTLE IMAGE...")
-                
-                # Stop the camera loop
-                break
-        
-        # Draw detection boxes on display frame (show all detections but highlight high confidence)
-        if bottles_detected_current > 0:
-            for bottle in bottle_info:
-                x1, y1, x2, y2 = bottle['bbox']
-                confidence = bottle['confidence']
-                
-                # Use different colors for high vs regular confidence
-                if confidence > HIGH_CONFIDENCE_THRESHOLD:
-                    color = (0, 255, 0)  # Green for high confidence
-                    thickness = 3
-                    label_text = f"HIGH: {confidence:.2f}"
-                else:
-                    color = (0, 165, 255)  # Orange for regular confidence
-                    thickness = 2
-                    label_text = f"Bottle: {confidence:.2f}"
-                
-                # Draw rectangle
-                cv2.rectangle(display_frame, (x1, y1), (x2, y2), color, thickness)
-                
-                # Draw label
-                cv2.putText(display_frame, label_text, (x1, y1-10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-        
-        # Calculate and display FPS
-        fps_counter += 1
-        if time.time() - fps_start_time >= 1.0:
-            current_fps = fps_counter / (time.time() - fps_start_time)
-            fps_counter = 0
-            fps_start_time = time.time()
-            
-            # Display FPS and stats on frame
-            cv2.putText(display_frame, f"FPS: {current_fps:.1f}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(display_frame, f"High Conf Events: {detection_count}", (10, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(display_frame, f"All Bottles: {bottles_detected_current}", (10, 90), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0) if bottles_detected_current > 0 else (255, 255, 255), 2)
-            if 'high_confidence_bottles' in locals():
-                cv2.putText(display_frame, f"High Conf Now: {high_confidence_bottles}", (10, 120), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0) if high_confidence_bottles > 0 else (255, 255, 255), 2)
-        
-        # Display the frame
-        cv2.imshow('Auto-Stop Bottle Detection', display_frame)
-        
-        # Handle key presses
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
-        
-        # Frame rate limiting (optional, remove for maximum speed)
-        # time.sleep(0.01)  # Small delay to prevent excessive CPU usage
+    state = pipeline.run()
     
-    # Cleanup
-    cap.release()
-    cv2.destroyAllWindows()
+    if state.frame_number == 0:
+        print("❌ Error: Camera connected but cannot capture frames")
+        print("   This might be a driver or permission issue")
+        return
     
     # Display bottle image if HIGH CONFIDENCE bottles detected
-    if 'high_confidence_bottles' in locals() and high_confidence_bottles > 0 and current_frame is not None:
+    if state.stop_reason == AutoStop.reason and current_frame is not None:
         display_bottle_detection_image()
-    elif bottles_detected_current > 0:
-        print("⚠️  Only low confidence bottles detected. Auto-stop requires high confidence (>0.8)")
-        print(f"   Highest confidence seen: {max([b['confidence'] for b in bottle_info]) if bottle_info else 0:.2f}")
+    elif len(state.detections):
+        print(f"⚠️  Only low confidence bottles detected. Auto-stop requires high confidence (>{HIGH_CONFIDENCE_THRESHOLD})")
+        print(f"   Highest confidence seen: {state.detections['confidence'].max():.2f}")
     
     # Final statistics
-    print(f"\n📊 SESSION SUMMARY:")
-    print(f"   Total frames processed: {frame_count}")
-    print(f"   Detection events: {detection_count}")
-    print(f"   Saved frames: {len(saved_frames)}")
-    if frame_count > 0:
-        print(f"   Detection rate: {(detection_count/frame_count*100):.1f}%")
-    else:
-        print("   Detection rate: No frames processed")
+    _print_session_summary(state, saver.count)
 
 def display_bottle_detection_image():
     """Display the detected bottle image using matplotlib"""
@@ -374,452 +255,189 @@ def display_bottle_detection_image():
     
     print("✅ Image displayed successfully!")
     print(f"   Bottles detected: {bottle_count}")
-    print(f"   Confidence scores: {[f'{b['confidence']:.2f}' for b in bottles]}")
+    print(f"   Confidence scores: {['%.2f' % b['confidence'] for b in bottles]}")
 
-def detect_webcam_continuous():
+def detect_webcam_continuous(source=None):
     """
     Continuous real-time bottle detection (original behavior)
     Runs until user presses 'q' - doesn't auto-stop on detection
+    `source` selects the frame source (see frame_source.py); default is the webcam
     """
-    global current_frame, detection_results, saved_frames
+    CONFIDENCE_THRESHOLD = 0.6
+    
+    # Save every frame with detected bottles
+    saver = SavedFramesSink(_store_detection, min_confidence=CONFIDENCE_THRESHOLD)
+    
+    def report(state):
+        if state.detected and len(state.detections):
+            # Display detection info in terminal
+            print(f"\n🍾 BOTTLES DETECTED! Frame #{state.frame_number}")
+            print(f"   Count: {len(state.detections)} bottles")
+            print(f"   Time: {time.strftime('%H:%M:%S')}")
+            print(f"   Confidence scores: {['%.2f' % c for c in state.detections['confidence']]}")
+            print(f"   Frame saved to variable (Total saved: {len(saved_frames)})")
+            print("-" * 60)
+    
+    def overlay(state, display_frame):
+        # Draw detection boxes (use last detection results)
+        draw_bottles(display_frame, state.detections, CONFIDENCE_THRESHOLD, high_label="Bottle")
+        _draw_stats(display_frame, [
+            (f"FPS: {state.fps:.1f}", False),
+            (f"Detections: {saver.count}", False),
+            (f"Bottles: {len(state.detections)}", len(state.detections) > 0),
+        ])
     
-    # Initialize webcam
-    cap = cv2.VideoCapture(0)
+    pipeline = DetectionPipeline(
+        source,
+        sinks=[saver, CallbackSink(report), DisplaySink('Continuous Bottle Detection', overlay)],
+        detection_interval=3,  # Process every 3rd frame for detection
+        confidence_threshold=CONFIDENCE_THRESHOLD,
+        high_confidence_threshold=CONFIDENCE_THRESHOLD,
+    )
     
-    if not cap.isOpened():
+    if not pipeline.open():
         print("Error: Could not open webcam")
         return
     
-    # Set camera properties for better performance
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    cap.set(cv2.CAP_PROP_FPS, 30)
-    
     print("Continuous real-time bottle detection started...")
     print("Press 'q' to quit manually")
     print("Frames with detected bottles will be automatically saved to variable")
     print("-" * 60)
     
-    # Performance optimization parameters
-    DETECTION_INTERVAL = 3  # Process every 3rd frame for detection
-    RESIZE_WIDTH = 320  # Smaller resolution for faster processing
-    RESIZE_HEIGHT = 240
-    CONFIDENCE_THRESHOLD = 0.6
-    
-    # Create optimized transform
-    transform = T.Compose([
-        T.Resize((RESIZE_HEIGHT, RESIZE_WIDTH)),  # Reduce resolution
-        T.ToTensor()
-    ])
-    
-    # FPS tracking
-    fps_counter = 0
-    fps_start_time = time.time()
-    frame_count = 0
-    detection_count = 0
-    
-    # Detection state
-    last_detection_time = 0
-    bottles_detected_current = 0
-    bottle_info = []
-    
-    while True:
-        start_time = time.time()
-        
-        # Capture frame
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Failed to capture image")
-            break
-        
-        frame_count += 1
-        display_frame = frame.copy()
-        
-        # Only run detection every DETECTION_INTERVAL frames
-        if frame_count % DETECTION_INTERVAL == 0:
-            # Resize frame for faster processing
-            small_frame = cv2.resize(frame, (RESIZE_WIDTH, RESIZE_HEIGHT))
-            rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(rgb_frame)
-            
-            # Transform and run detection
-            img_tensor = transform(pil_image)
-            
-            with torch.no_grad():
-                preds = model([img_tensor])
-            
-            # Extract predictions
-            boxes = preds[0]["boxes"]
-            labels = preds[0]["labels"]
-            scores = preds[0]["scores"]
-            
-            # Scale boxes back to original size
-            scale_x = frame.shape[1] / RESIZE_WIDTH
-            scale_y = frame.shape[0] / RESIZE_HEIGHT
-            
-            bottles_detected_current = 0
-            bottle_info = []
-            
-            for box, label, score in zip(boxes, labels, scores):
-                if label.item() == 44 and score > CONFIDENCE_THRESHOLD:  # 44 = bottle
-                    bottles_detected_current += 1
-                    
-                    # Scale coordinates back to original frame size
-                    x1, y1, x2, y2 = box.tolist()
-                    x1 = int(x1 * scale_x)
-                    y1 = int(y1 * scale_y)
-                    x2 = int(x2 * scale_x)
-                    y2 = int(y2 * scale_y)
-                    
-                    bottle_info.append({
-                        'bbox': (x1, y1, x2, y2),
-                        'confidence': score.item()
-                    })
-            
-            # Update global variables if bottles detected
-            if bottles_detected_current > 0:
-                with frame_lock:
-                    current_frame = frame.copy()
-                    detection_results = {
-                        'bottle_count': bottles_detected_current,
-                        'bottles': bottle_info,
-                        'timestamp': time.time(),
-                        'frame_number': frame_count
-                    }
-                    
-                    # Save frame to deque
-                    saved_frames.append({
-                        'frame': frame.copy(),
-                        'detections': detection_results.copy(),
-                        'save_time': time.strftime("%Y-%m-%d %H:%M:%S")
-                    })
-                
-                detection_count += 1
-                last_detection_time = time.time()
-                
-                # Display detection info in terminal
-                print(f"\n🍾 BOTTLES DETECTED! Frame #{frame_count}")
-                print(f"   Count: {bottles_detected_current} bottles")
-                print(f"   Time: {time.strftime('%H:%M:%S')}")
-                print(f"   Confidence scores: {[f'{b['confidence']:.2f}' for b in bottle_info]}")
-                print(f"   Frame saved to variable (Total saved: {len(saved_frames)})")
-                print("-" * 60)
-        
-        # Draw detection boxes on display frame (use last detection results)
-        if bottles_detected_current > 0:
-            for bottle in bottle_info:
-                x1, y1, x2, y2 = bottle['bbox']
-                confidence = bottle['confidence']
-                
-                # Draw rectangle
-                cv2.rectangle(display_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                
-                # Draw label
-                label_text = f"Bottle: {confidence:.2f}"
-                cv2.putText(display_frame, label_text, (x1, y1-10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        
-        # Calculate and display FPS
-        fps_counter += 1
-        if time.time() - fps_start_time >= 1.0:
-            current_fps = fps_counter / (time.time() - fps_start_time)
-            fps_counter = 0
-            fps_start_time = time.time()
-            
-            # Display FPS and stats on frame
-            cv2.putText(display_frame, f"FPS: {current_fps:.1f}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(display_frame, f"Detections: {detection_count}", (10, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(display_frame, f"Bottles: {bottles_detected_current}", (10, 90), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0) if bottles_detected_current > 0 else (255, 255, 255), 2)
-        
-        # Display the frame
-        cv2.imshow('Continuous Bottle Detection', display_frame)
-        
-        # Handle key presses
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
-    
-    # Cleanup
-    cap.release()
-    cv2.destroyAllWindows()
+    state = pipeline.run()
     
     # Final statistics
-    print(f"\n📊 SESSION SUMMARY:")
-    print(f"   Total frames processed: {frame_count}")
-    print(f"   Detection events: {detection_count}")
-    print(f"   Saved frames: {len(saved_frames)}")
-    if frame_count > 0:
-        print(f"   Detection rate: {(detection_count/frame_count*100):.1f}%")
-    else:
-        print("   Detection rate: No frames processed")
+    _print_session_summary(state, saver.count)
+
+def _material_classifier(classify_materials):
+    """Material classifier for the second pipeline stage, or None when disabled"""
+    if classify_materials is False:
+        return None
+    classifier = get_material_classifier()
+    if classifier is None and classify_materials:
+        print("⚠️ Material classification requested but BOTTLE_MATERIAL_CHECKPOINT is not set")
+    return classifier
 
-def detect_realtime_for_api():
+def detect_realtime_for_api(source=None, backend=None, classify_materials=None, source_name=None):
     """
     Real-time bottle detection with camera window display
     Shows live camera feed until bottle is detected, then closes and returns result
+    `source` selects the frame source (see frame_source.py); default is the webcam
+    `source_name` is its configured name (names the /api/stream preview)
+    `backend` selects the detector (see model.py); default is BOTTLE_MODEL_BACKEND
+    `classify_materials` adds material fields to the bottles (default: on when
+    BOTTLE_MATERIAL_CHECKPOINT is set)
     """
-    global current_frame, detection_results, saved_frames
+    # Performance optimization parameters
+    HIGH_CONFIDENCE_THRESHOLD = 0.75  # Lower threshold for API use
+    MAX_FRAMES = 600  # Maximum frames to process (20 seconds at 30 FPS)
     
     try:
-        # Initialize webcam
-        cap = cv2.VideoCapture(0)
+        # Annotated high confidence frame goes to the global variables
+        saver = SavedFramesSink(_store_detection, min_confidence=HIGH_CONFIDENCE_THRESHOLD, annotate=True)
         
-        if not cap.isOpened():
-            # Try alternative camera indices
-            for i in range(1, 4):
-                cap = cv2.VideoCapture(0)
-                if cap.isOpened():
-                    print(f"✅ Camera found at index {i}")
-                    break
-            else:
-                return {
-                    "success": False,
-                    "error": "Could not open webcam. Check camera connection and permissions."
-                }
+        def overlay(state, display_frame):
+            draw_bottles(display_frame, state.detections, HIGH_CONFIDENCE_THRESHOLD,
+                         high_label="BOTTLE DETECTED", label_background=True, font_scale=0.7)
+            
+            # Add status text to display frame
+            cv2.putText(display_frame, f"Scanning for bottles... {state.elapsed:.1f}s", (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            cv2.putText(display_frame, f"Frame: {state.frame_number}", (10, 60), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            cv2.putText(display_frame, "Press 'q' to quit", (10, display_frame.shape[0] - 20), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
         
-        # Test camera capture
-        ret, test_frame = cap.read()
-        if not ret:
-            cap.release()
+        def progress(state):
+            # Print progress every 5 seconds
+            if state.frame_number % 150 == 0:
+                print(f"⏱️  Scanning... {state.frame_number} frames processed in {state.elapsed:.1f}s")
+        
+        pipeline = DetectionPipeline(
+            source,
+            sinks=[
+                saver,
+                # Show detection for 2 seconds before closing
+                DisplaySink('Bottle Detection - Live Camera', overlay, position=(100, 100),
+                            hold_seconds=2, hold_text="BOTTLE CAPTURED! Closing camera..."),
+                CallbackSink(progress),
+            ],
+            stop_policies=[AutoStop(), MaxFrames(MAX_FRAMES)],
+            detection_interval=2,  # Process every 2nd frame for detection
+            confidence_threshold=0.6,
+            high_confidence_threshold=HIGH_CONFIDENCE_THRESHOLD,
+            backend=backend,
+            material_classifier=_material_classifier(classify_materials),
+            stream_overlay=overlay,  # Same annotations in the /api/stream preview
+            source_name=source_name,
+        )
+        
+        # Initialize frame source on its own capture thread
+        # (the webcam source already falls back to camera indices 1-3)
+        if not pipeline.open():
             return {
                 "success": False,
-                "error": "Camera connected but cannot capture frames. Check drivers."
+                "error": "Could not open webcam. Check camera connection and permissions."
             }
         
-        print(f"✅ Camera initialized for API - Frame size: {test_frame.shape}")
-        
-        # Set camera properties for better performance
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        cap.set(cv2.CAP_PROP_FPS, 30)
-        
         print("🎯 Real-time detection started - Camera window will open!")
         print("   Show a bottle to the camera to capture it")
         print("   Press 'q' to quit manually")
         
-        # Create camera window
-        cv2.namedWindow('Bottle Detection - Live Camera', cv2.WINDOW_AUTOSIZE)
-        cv2.moveWindow('Bottle Detection - Live Camera', 100, 100)
-        
-        # Performance optimization parameters
-        DETECTION_INTERVAL = 2  # Process every 2nd frame for detection
-        RESIZE_WIDTH = 320
-        RESIZE_HEIGHT = 240
-        CONFIDENCE_THRESHOLD = 0.6
-        HIGH_CONFIDENCE_THRESHOLD = 0.75  # Lower threshold for API use
-        MAX_FRAMES = 600  # Maximum frames to process (20 seconds at 30 FPS)
-        
-        # Create optimized transform
-        transform = T.Compose([
-            T.Resize((RESIZE_HEIGHT, RESIZE_WIDTH)),
-            T.ToTensor()
-        ])
+        state = pipeline.run()
         
-        frame_count = 0
-        detection_count = 0
-        start_time = time.time()
+        if state.frame_number == 0:
+            return {
+                "success": False,
+                "error": "Camera connected but cannot capture frames. Check drivers."
+            }
         
-        while frame_count < MAX_FRAMES:
-            # Capture frame
-            ret, frame = cap.read()
-            if not ret:
-                print("❌ Failed to read frame from camera")
-                break
-            
-            frame_count += 1
-            display_frame = frame.copy()
-            
-            # Only run detection every DETECTION_INTERVAL frames
-            if frame_count % DETECTION_INTERVAL == 0:
-                # Resize frame for faster processing
-                small_frame = cv2.resize(frame, (RESIZE_WIDTH, RESIZE_HEIGHT))
-                rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(rgb_frame)
-                
-                # Transform and run detection
-                img_tensor = transform(pil_image)
-                
-                with torch.no_grad():
-                    preds = model([img_tensor])
-                
-                # Extract predictions
-                boxes = preds[0]["boxes"]
-                labels = preds[0]["labels"]
-                scores = preds[0]["scores"]
-                
-                # Scale boxes back to original size
-                scale_x = frame.shape[1] / RESIZE_WIDTH
-                scale_y = frame.shape[0] / RESIZE_HEIGHT
-                
-                bottles_detected = 0
-                high_confidence_bottles = 0
-                bottle_info = []
-                
-                for box, label, score in zip(boxes, labels, scores):
-                    if label.item() == 44 and score > CONFIDENCE_THRESHOLD:  # 44 = bottle
-                        bottles_detected += 1
-                        
-                        # Scale coordinates back to original frame size
-                        x1, y1, x2, y2 = box.tolist()
-                        x1 = int(x1 * scale_x)
-                        y1 = int(y1 * scale_y)
-                        x2 = int(x2 * scale_x)
-                        y2 = int(y2 * scale_y)
-                        
-                        bottle_data = {
-                            'bbox': [x1, y1, x2, y2],
-                            'confidence': float(score.item())
-                        }
-                        
-                        bottle_info.append(bottle_data)
-                        
-                        # Check if this is a high confidence detection
-                        if score > HIGH_CONFIDENCE_THRESHOLD:
-                            high_confidence_bottles += 1
-                
-                # Draw all detections on display frame
-                for bottle in bottle_info:
-                    x1, y1, x2, y2 = bottle['bbox']
-                    confidence = bottle['confidence']
-                    
-                    # Use different colors for high vs regular confidence
-                    if confidence > HIGH_CONFIDENCE_THRESHOLD:
-                        color = (0, 255, 0)  # Green for high confidence
-                        thickness = 3
-                        label_text = f"BOTTLE DETECTED: {confidence:.2f}"
-                    else:
-                        color = (0, 165, 255)  # Orange for regular confidence
-                        thickness = 2
-                        label_text = f"Bottle: {confidence:.2f}"
-                    
-                    # Draw rectangle
-                    cv2.rectangle(display_frame, (x1, y1), (x2, y2), color, thickness)
-                    
-                    # Draw label with background
-                    label_size = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)[0]
-                    cv2.rectangle(display_frame, (x1, y1-30), (x1 + label_size[0], y1), color, -1)
-                    cv2.putText(display_frame, label_text, (x1, y1-10), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                
-                # Stop on high confidence detection
-                if high_confidence_bottles > 0:
-                    print(f"🍾 HIGH CONFIDENCE BOTTLE DETECTED! Frame #{frame_count}")
-                    print(f"   Count: {high_confidence_bottles} high confidence bottles")
-                    print(f"   Total: {bottles_detected} bottles detected")
-                    print(f"   Processing time: {time.time() - start_time:.2f}s")
-                    
-                    # Show detection for 2 seconds before closing
-                    for i in range(60):  # 2 seconds at 30 FPS
-                        cv2.putText(display_frame, "BOTTLE CAPTURED! Closing camera...", (50, 50), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 3)
-                        cv2.imshow('Bottle Detection - Live Camera', display_frame)
-                        cv2.waitKey(33)  # ~30 FPS
-                    
-                    # Close camera window
-                    cv2.destroyAllWindows()
-                    
-                    # Prepare final detection frame
-                    detection_frame = frame.copy()
-                    for bottle in bottle_info:
-                        if bottle['confidence'] > HIGH_CONFIDENCE_THRESHOLD:
-                            x1, y1, x2, y2 = bottle['bbox']
-                            cv2.rectangle(detection_frame, (x1, y1), (x2, y2), (0, 255, 0), 3)
-                            label_text = f"Bottle: {bottle['confidence']:.2f}"
-                            cv2.putText(detection_frame, label_text, (x1, y1-10), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                    
-                    # Convert image to base64
-                    try:
-                        _, buffer = cv2.imencode('.jpg', detection_frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-                        image_base64 = base64.b64encode(buffer).decode('utf-8')
-                        
-                        # Update global variables
-                        with frame_lock:
-                            current_frame = detection_frame.copy()
-                            detection_results = {
-                                'bottle_count': high_confidence_bottles,
-                                'bottles': [b for b in bottle_info if b['confidence'] > HIGH_CONFIDENCE_THRESHOLD],
-                                'timestamp': time.time(),
-                                'frame_number': frame_count
-                            }
-                            
-                            # Save frame to deque
-                            saved_frames.append({
-                                'frame': detection_frame.copy(),
-                                'detections': detection_results.copy(),
-                                'save_time': time.strftime("%Y-%m-%d %H:%M:%S")
-                            })
-                        
-                        # Cleanup
-                        cap.release()
-                        cv2.destroyAllWindows()
-                        
-                        return {
-                            "success": True,
-                            "image": f"data:image/jpeg;base64,{image_base64}",
-                            "detection_data": {
-                                "bottle_count": high_confidence_bottles,
-                                "bottles": [b for b in bottle_info if b['confidence'] > HIGH_CONFIDENCE_THRESHOLD],
-                                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                                "processing_time": round(time.time() - start_time, 2),
-                                "frames_processed": frame_count
-                            }
-                        }
-                        
-                    except Exception as e:
-                        print(f"Error encoding image: {e}")
-                        cap.release()
-                        cv2.destroyAllWindows()
-                        return {
-                            "success": False,
-                            "error": f"Image encoding failed: {str(e)}"
-                        }
-            
-            # Add status text to display frame
-            elapsed = time.time() - start_time
-            cv2.putText(display_frame, f"Scanning for bottles... {elapsed:.1f}s", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(display_frame, f"Frame: {frame_count}", (10, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            cv2.putText(display_frame, "Press 'q' to quit", (10, display_frame.shape[0] - 20), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        # Stop on high confidence detection
+        if state.stop_reason == AutoStop.reason:
+            results = saver.last_results
+            print(f"🍾 HIGH CONFIDENCE BOTTLE DETECTED! Frame #{state.frame_number}")
+            print(f"   Count: {results['bottle_count']} high confidence bottles")
+            print(f"   Total: {len(state.detections)} bottles detected")
+            print(f"   Processing time: {state.elapsed:.2f}s")
+            print(f"   Stage timings (ms): {state.timing_report()}")
+            if state.material_stats:
+                print(f"   Material classification: {state.material_stats}")
             
-            # Display the frame
-            cv2.imshow('Bottle Detection - Live Camera', display_frame)
-            
-            # Handle key presses
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                print("🛑 Detection stopped by user")
-                break
+            # Convert image to base64
+            try:
+                image_base64 = encode_frame_base64(saver.last_frame, quality=90)
+            except Exception as e:
+                print(f"Error encoding image: {e}")
+                return {
+                    "success": False,
+                    "error": f"Image encoding failed: {str(e)}"
+                }
             
-            # Print progress every 5 seconds
-            if frame_count % 150 == 0:
-                elapsed = time.time() - start_time
-                print(f"⏱️  Scanning... {frame_count} frames processed in {elapsed:.1f}s")
+            return {
+                "success": True,
+                "image": f"data:image/jpeg;base64,{image_base64}",
+                "detection_data": {
+                    "bottle_count": results['bottle_count'],
+                    "bottles": results['bottles'],
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "processing_time": round(state.elapsed, 2),
+                    "frames_processed": state.frame_number
+                }
+            }
         
-        # Cleanup - no bottles found or timeout
-        cap.release()
-        cv2.destroyAllWindows()
+        if state.stop_reason == "manual":
+            print("🛑 Detection stopped by user")
         
+        # No bottles found or timeout
         return {
             "success": False,
-            "message": f"No high-confidence bottles detected in {frame_count} frames ({time.time() - start_time:.1f}s)",
-            "frames_processed": frame_count,
-            "processing_time": round(time.time() - start_time, 2)
+            "message": f"No high-confidence bottles detected in {state.frame_number} frames ({state.elapsed:.1f}s)",
+            "frames_processed": state.frame_number,
+            "processing_time": round(state.elapsed, 2)
         }
         
     except Exception as e:
-        # Ensure camera and windows are cleaned up on any error
-        try:
-            cap.release()
-            cv2.destroyAllWindows()
-        except:
-            pass
-        
+        # The pipeline releases the camera and windows on any error
         print(f"❌ Detection API error: {e}")
         return {
             "success": False,
@@ -827,116 +445,42 @@ def detect_realtime_for_api():
         }
 
 
-def detect_realtime_continuous_for_api(duration_seconds=10):
+def detect_realtime_continuous_for_api(duration_seconds=10, source=None, classify_materials=None):
     """
     Continuous real-time detection for API with time limit
     Returns all detections found within the time period
+    `source` selects the frame source (see frame_source.py); default is the webcam
+    `classify_materials` as in detect_realtime_for_api()
     """
-    global current_frame, detection_results, saved_frames
-    
     try:
-        # Initialize webcam
-        cap = cv2.VideoCapture(0)
-        
-        if not cap.isOpened():
+        recorder = EventRecorderSink(min_confidence=0.6)
+        
+        def report(state):
+            if state.detected and len(state.detections):
+                print(f"🍾 Detection event {len(recorder.events)}: {len(state.detections)} bottles")
+        
+        pipeline = DetectionPipeline(
+            source,
+            sinks=[recorder, CallbackSink(report)],
+            stop_policies=[DurationLimit(duration_seconds)],
+            detection_interval=3,
+            confidence_threshold=0.6,
+            material_classifier=_material_classifier(classify_materials),
+        )
+        
+        if not pipeline.open():
             return {
                 "success": False,
                 "error": "Could not open webcam"
             }
         
-        # Set camera properties
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        cap.set(cv2.CAP_PROP_FPS, 30)
-        
         print(f"🎯 Continuous detection started for {duration_seconds} seconds...")
         
-        # Parameters
-        DETECTION_INTERVAL = 3
-        RESIZE_WIDTH = 320
-        RESIZE_HEIGHT = 240
-        CONFIDENCE_THRESHOLD = 0.6
-        
-        transform = T.Compose([
-            T.Resize((RESIZE_HEIGHT, RESIZE_WIDTH)),
-            T.ToTensor()
-        ])
-        
-        frame_count = 0
-        detection_events = []
-        start_time = time.time()
-        end_time = start_time + duration_seconds
+        state = pipeline.run()
         
-        while time.time() < end_time:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            frame_count += 1
-            
-            if frame_count % DETECTION_INTERVAL == 0:
-                # Process frame
-                small_frame = cv2.resize(frame, (RESIZE_WIDTH, RESIZE_HEIGHT))
-                rgb_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(rgb_frame)
-                img_tensor = transform(pil_image)
-                
-                with torch.no_grad():
-                    preds = model([img_tensor])
-                
-                boxes = preds[0]["boxes"]
-                labels = preds[0]["labels"]
-                scores = preds[0]["scores"]
-                
-                # Scale boxes back
-                scale_x = frame.shape[1] / RESIZE_WIDTH
-                scale_y = frame.shape[0] / RESIZE_HEIGHT
-                
-                bottles_detected = 0
-                bottle_info = []
-                
-                for box, label, score in zip(boxes, labels, scores):
-                    if label.item() == 44 and score > CONFIDENCE_THRESHOLD:
-                        bottles_detected += 1
-                        
-                        x1, y1, x2, y2 = box.tolist()
-                        x1 = int(x1 * scale_x)
-                        y1 = int(y1 * scale_y)
-                        x2 = int(x2 * scale_x)
-                        y2 = int(y2 * scale_y)
-                        
-                        bottle_info.append({
-                            'bbox': [x1, y1, x2, y2],
-                            'confidence': float(score.item())
-                        })
-                
-                if bottles_detected > 0:
-                    # Save detection event
-                    detection_frame = frame.copy()
-                    for bottle in bottle_info:
-                        x1, y1, x2, y2 = bottle['bbox']
-                        cv2.rectangle(detection_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    
-                    _, buffer = cv2.imencode('.jpg', detection_frame)
-                    image_base64 = base64.b64encode(buffer).decode('utf-8')
-                    
-                    detection_events.append({
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "bottle_count": bottles_detected,
-                        "bottles": bottle_info,
-                        "image": f"data:image/jpeg;base64,{image_base64}",
-                        "frame_number": frame_count
-                    })
-                    
-                    print(f"🍾 Detection event {len(detection_events)}: {bottles_detected} bottles")
-        
-        cap.release()
-        
-        if detection_events:
-            # Return the best detection (highest confidence)
-            best_detection = max(detection_events, 
-                               key=lambda x: max(b['confidence'] for b in x['bottles']))
-            
+        # Return the best detection (highest confidence)
+        best_detection = recorder.best_event()
+        if best_detection:
             return {
                 "success": True,
                 "image": best_detection["image"],
@@ -944,22 +488,18 @@ def detect_realtime_continuous_for_api(duration_seconds=10):
                     "bottle_count": best_detection["bottle_count"],
                     "bottles": best_detection["bottles"],
                     "timestamp": best_detection["timestamp"],
-                    "total_events": len(detection_events),
-                    "processing_time": round(time.time() - start_time, 2)
+                    "total_events": len(recorder.events),
+                    "processing_time": round(state.elapsed, 2)
                 }
             }
         else:
             return {
                 "success": False,
                 "message": f"No bottles detected in {duration_seconds} seconds",
-                "processing_time": round(time.time() - start_time, 2)
+                "processing_time": round(state.elapsed, 2)
             }
             
     except Exception as e:
-        try:
-            cap.release()
-        except:
-            pass
         return {
             "success": False,
             "error": str(e)
@@ -982,7 +522,7 @@ def print_detection_summary():
     for i, frame_data in enumerate(frames, 1):
         detections = frame_data['detections']
         print(f"Frame {i}: {detections['bottle_count']} bottles at {frame_data['save_time']}")
-        print(f"         Confidences: {[f'{b['confidence']:.2f}' for b in detections['bottles']]}")
+        print(f"         Confidences: {['%.2f' % b['confidence'] for b in detections['bottles']]}")
     print("-" * 70)
 
 def main():
@@ -1085,8 +625,7 @@ def test_detection_system():
         test_transform = T.Compose([T.ToTensor()])
         dummy_image = torch.zeros(3, 224, 224)
         
-        with torch.no_grad():
-            test_pred = model([dummy_image])
+        test_pred = infer([dummy_image])
         print("✓ Model loaded successfully")
         
         # Test camera access
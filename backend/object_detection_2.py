@@ -5,16 +5,19 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import cv2
 import numpy as np
-from model import model  # Your Faster R-CNN model
+from model_server import infer  # Shared, preloaded Faster R-CNN detector
+from model import MODEL_RUNTIME, OPTIMIZED_MODEL
+from material_classification import MATERIAL_LABELS, classify_materials
 
 # Additional imports for material classification
 from torchvision.models import resnet50, ResNet50_Weights
 import torch.nn as nn
 
 class BottleMaterialClassifier(nn.Module):
-    def __init__(self, num_classes=3):
+    def __init__(self, num_classes=3, pretrained=True):
         super(BottleMaterialClassifier, self).__init__()
-        self.resnet = resnet50(weights=ResNet50_Weights.DEFAULT)
+        # pretrained=False skips the ImageNet download when a checkpoint is loaded anyway
+        self.resnet = resnet50(weights=ResNet50_Weights.DEFAULT if pretrained else None)
         # Replace the final layer for our classification task
         num_features = self.resnet.fc.in_features
         self.resnet.fc = nn.Linear(num_features, num_classes)
@@ -22,19 +25,35 @@ class BottleMaterialClassifier(nn.Module):
     def forward(self, x):
         return self.resnet(x)
 
-def load_material_classifier(checkpoint_path=None):
-    """Load the bottle material classifier"""
-    model = BottleMaterialClassifier(num_classes=3)  # glass, metal, plastic
+def load_material_classifier(checkpoint_path=None, optimized=None, runtime=None):
+    """
+    Load the bottle material classifier
+    optimized=True (default: BOTTLE_OPTIMIZED_MODEL=1) loads the cached INT8 build
+    runtime="torchscript" / "onnxruntime" (default: BOTTLE_MODEL_RUNTIME) loads an exported model
+    """
+    runtime = runtime or MODEL_RUNTIME
+    if runtime != "torch":
+        from export_models import load_exported_material_classifier
+        return load_exported_material_classifier(checkpoint_path, runtime)
+
+    if optimized is None:
+        optimized = OPTIMIZED_MODEL
+    if optimized:
+        from optimize_model import load_optimized_material_classifier
+        return load_optimized_material_classifier(checkpoint_path)
+
+    # glass, metal, plastic; the ImageNet weights are only needed without a checkpoint
+    model = BottleMaterialClassifier(num_classes=3, pretrained=not checkpoint_path)
     if checkpoint_path:
         model.load_state_dict(torch.load(checkpoint_path, map_location='cpu'))
     model.eval()
     return model
 
 # Material labels
-material_labels = {0: "Glass", 1: "Metal", 2: "Plastic"}
+material_labels = MATERIAL_LABELS
 
 def detect_bottles_and_materials(img_path, material_model=None):
-    """Detect bottles and classify their materials"""
+    """Detect bottles and classify their materials (one batched classifier pass per image)"""
     # Transformation
     transform = T.Compose([T.ToTensor()])
     
@@ -43,56 +62,44 @@ def detect_bottles_and_materials(img_path, material_model=None):
     img_tensor = transform(img)
 
     # Run detection
-    with torch.no_grad():
-        preds = model([img_tensor])
+    preds = infer([img_tensor])
 
-    # Extract predictions
-    boxes = preds[0]["boxes"]
-    labels = preds[0]["labels"]
-    scores = preds[0]["scores"]
+    # Extract predictions (COCO bottle class id = 44)
+    keep = (preds[0]["labels"] == 44) & (preds[0]["scores"] > 0.5)
+    boxes = preds[0]["boxes"][keep]
+    scores = preds[0]["scores"][keep]
 
-    # Prepare material classification transform
-    material_transform = T.Compose([
-        T.Resize((224, 224)),
-        T.ToTensor(),
-        T.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ])
+    # Classify the material of all bottles in one batch
+    materials = classify_materials(material_model, img_tensor, boxes) if material_model else []
     
-    # COCO bottle class id = 44
     fig, ax = plt.subplots(1, figsize=(10, 10))
     ax.imshow(img)
 
     bottle_count = 0
-    for box, label, score in zip(boxes, labels, scores):
-        if label.item() == 44 and score > 0.5:  # 44 = bottle
-            bottle_count += 1
-            x1, y1, x2, y2 = box.tolist()
-            
-            # Crop the bottle region for material classification
-            if material_model:
-                bottle_region = img.crop((x1, y1, x2, y2))
-                bottle_tensor = material_transform(bottle_region).unsqueeze(0)
-                
-                # Classify material
-                with torch.no_grad():
-                    material_output = material_model(bottle_tensor)
-                    material_pred = torch.argmax(material_output, dim=1).item()
-                    material_name = material_labels.get(material_pred, "Unknown")
-                
-                label_text = f"Bottle({material_name}): {score:.2f}"
-                color = 'red'
-            else:
-                label_text = f"Bottle: {score:.2f}"
-                color = 'red'
-                material_name = "Unknown"
-            
-            rect = patches.Rectangle((x1, y1), x2-x1, y2-y1, linewidth=2, 
-                                   edgecolor=color, facecolor='none')
-            ax.add_patch(rect)
-            ax.text(x1, y1-10, label_text, color=color, fontsize=12, backgroundcolor="white")
+    results = []
+    for i, (box, score) in enumerate(zip(boxes.tolist(), scores.tolist())):
+        bottle_count += 1
+        x1, y1, x2, y2 = box
+        
+        if materials:
+            material_name, material_probability = materials[i]
+            label_text = f"Bottle({material_name} {material_probability:.2f}): {score:.2f}"
+            color = 'red'
+        else:
+            label_text = f"Bottle: {score:.2f}"
+            color = 'red'
+            material_name, material_probability = "Unknown", None
+        results.append({'bbox': box, 'confidence': score, 'material': material_name,
+                        'material_confidence': material_probability})
+        
+        rect = patches.Rectangle((x1, y1), x2-x1, y2-y1, linewidth=2, 
+                               edgecolor=color, facecolor='none')
+        ax.add_patch(rect)
+        ax.text(x1, y1-10, label_text, color=color, fontsize=12, backgroundcolor="white")
 
     print(f"Detected {bottle_count} bottles")
     plt.show()
+    return results
 
 def main():
     # For now, we'll run without material classification
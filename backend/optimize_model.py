@@ -0,0 +1,249 @@
+"""
+CPU-Optimized Model Builds
+
+Opt-in INT8 / channels-last builds of the bottle detector (model.py) and the
+material classifier (object_detection_2.py) for CPU-only deployments.
+
+Optimizations:
+- Detector: backbone runs in channels-last memory format, and the Linear
+  layers of the ROI box head (the 12544x1024 fc6 dominates) are dynamically
+  quantized to INT8. Static quantization is not available for the torchvision
+  detectors: their forward pass is not FX-traceable.
+- Material classifier: statically quantized to INT8 with FX graph mode when
+  calibration images are given, otherwise only the final Linear layer is
+  dynamically quantized. Runs in channels-last memory format.
+- Inference runs under torch.inference_mode (see model_server.py).
+
+The converted weights are cached in models/optimized/, keyed by backend,
+detector settings, checkpoint contents (material classifier and fused
+material head) and torch version, so later starts
+rebuild the (weight-free) architecture and load the INT8 state dict directly.
+Set BOTTLE_OPTIMIZED_MODEL=1 to make the Flask app and CLI tools use them.
+
+Usage:
+    python optimize_model.py path/to/images [--backend NAME] [--material-checkpoint PATH] [--rebuild]
+
+Functions:
+    optimize_detector(): Apply channels-last + dynamic INT8 to a detector
+    optimize_material_classifier(): Apply static or dynamic INT8 to the classifier
+    load_optimized_detector(): Cached optimized detector
+    load_optimized_material_classifier(): Cached optimized material classifier
+    detector_key(): Cache key of a detector build (settings + material head contents)
+    compare_material_classifiers(): Latency / top-1 agreement of two classifiers
+"""
+
+import hashlib
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from material_classification import MATERIAL_INPUT_SIZE, normalize_image
+from model import MODEL_CONFIG, artifact_path, load_model, model_dir, resolve_backend
+
+OPTIMIZED_DIR = os.path.join(model_dir, "optimized")
+
+
+class ChannelsLast(nn.Module):
+    """Run a convolutional module on channels-last input"""
+
+    def __init__(self, module):
+        super().__init__()
+        self.module = module.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.module(x.contiguous(memory_format=torch.channels_last))
+
+
+# ----------------- Detector -----------------
+def optimize_detector(detector):
+    """Channels-last backbone and dynamic INT8 Linear layers (modifies the detector)"""
+    # Unwrap BottleOnlyDetector / FusedBottleMaterialDetector
+    target = getattr(detector, "detector", detector)
+    target.backbone = ChannelsLast(target.backbone)
+    quantize_dynamic(detector, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return detector.eval()
+
+
+def load_optimized_detector(backend=None, rebuild=False, **overrides):
+    """Load the optimized detector from the cache, converting the fp32 model on a miss"""
+    backend = resolve_backend(backend)
+    path = artifact_path(OPTIMIZED_DIR, backend, detector_key(**overrides))
+
+    if os.path.exists(path) and not rebuild:
+        detector = optimize_detector(load_model(backend, pretrained=False, **overrides))
+        detector.load_state_dict(torch.load(path, map_location="cpu"))
+        print(f"✅ Loaded optimized detector from {path}")
+        return detector
+
+    start = time.time()
+    detector = optimize_detector(load_model(backend, **overrides))
+    os.makedirs(OPTIMIZED_DIR, exist_ok=True)
+    torch.save(detector.state_dict(), path)
+    print(f"✅ Optimized detector {backend} built in {time.time() - start:.2f}s, cached at {path}")
+    return detector
+
+
+# ----------------- Material classifier -----------------
+def material_tensor(frame, size=MATERIAL_INPUT_SIZE):
+    """BGR frame -> normalized 1x3xHxW classifier input"""
+    import cv2
+
+    rgb = cv2.cvtColor(cv2.resize(frame, (size, size)), cv2.COLOR_BGR2RGB)
+    tensor = torch.from_numpy(rgb).permute(2, 0, 1).float().div_(255.0)
+    return normalize_image(tensor).unsqueeze(0)
+
+
+def load_calibration_batches(image_dir, limit=32, batch_size=8):
+    """Classifier input batches from an image directory"""
+    from frame_source import ImageDirectorySource
+
+    tensors = []
+    for frame in ImageDirectorySource(image_dir):
+        tensors.append(material_tensor(frame))
+        if len(tensors) >= limit:
+            break
+    return [torch.cat(tensors[i:i + batch_size]) for i in range(0, len(tensors), batch_size)]
+
+
+def optimize_material_classifier(classifier, calibration_batches=None):
+    """
+    INT8 material classifier in channels-last format
+
+    With calibration batches the whole ResNet is statically quantized (FX
+    graph mode); without them only the final Linear layer is quantized
+    dynamically, since static activation ranges cannot be guessed.
+    """
+    classifier.eval()
+    if calibration_batches is None:
+        quantize_dynamic(classifier, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    else:
+        example = (torch.zeros(1, 3, MATERIAL_INPUT_SIZE, MATERIAL_INPUT_SIZE),)
+        prepared = prepare_fx(classifier.resnet, get_default_qconfig_mapping(), example)
+        with torch.inference_mode():
+            for batch in calibration_batches:
+                prepared(batch)
+        classifier.resnet = convert_fx(prepared)
+    classifier.resnet = ChannelsLast(classifier.resnet)
+    return classifier
+
+
+def file_digest(path):
+    """SHA-1 of a file's contents (None for no file)"""
+    if not path:
+        return None
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def detector_key(**overrides):
+    """Detector settings plus the contents of the fused material head checkpoint, if any"""
+    config = {**MODEL_CONFIG, **overrides}
+    return {**config, "material_head_checkpoint": file_digest(config.get("material_head"))}
+
+
+def load_optimized_material_classifier(checkpoint_path=None, calibration_dir=None, rebuild=False):
+    """
+    Load the optimized material classifier from the cache, converting on a miss
+
+    A cached static INT8 build is preferred; calibration_dir is only needed to
+    create one.
+    """
+    from object_detection_2 import BottleMaterialClassifier, load_material_classifier
+
+    key = {"checkpoint": file_digest(checkpoint_path)}
+    static_path = artifact_path(OPTIMIZED_DIR, "material_classifier", {**key, "mode": "static"})
+    dynamic_path = artifact_path(OPTIMIZED_DIR, "material_classifier", {**key, "mode": "dynamic"})
+
+    if not rebuild:
+        for path, static in ((static_path, True), (dynamic_path, False)):
+            if os.path.exists(path):
+                classifier = BottleMaterialClassifier(num_classes=3, pretrained=False)
+                # Placeholder calibration: the observed ranges are overwritten by the cache
+                calibration = [torch.zeros(1, 3, MATERIAL_INPUT_SIZE, MATERIAL_INPUT_SIZE)] if static else None
+                classifier = optimize_material_classifier(classifier, calibration)
+                classifier.load_state_dict(torch.load(path, map_location="cpu"))
+                print(f"✅ Loaded optimized material classifier from {path}")
+                return classifier.eval()
+
+    start = time.time()
+    calibration = load_calibration_batches(calibration_dir) if calibration_dir else None
+    if calibration_dir and not calibration:
+        print(f"⚠️ No calibration images in {calibration_dir}, using dynamic quantization")
+        calibration = None
+    classifier = load_material_classifier(checkpoint_path, optimized=False, runtime="torch")
+    classifier = optimize_material_classifier(classifier, calibration)
+    path = static_path if calibration else dynamic_path
+    os.makedirs(OPTIMIZED_DIR, exist_ok=True)
+    torch.save(classifier.state_dict(), path)
+    print(f"✅ Optimized material classifier built in {time.time() - start:.2f}s, cached at {path}")
+    return classifier.eval()
+
+
+def compare_material_classifiers(reference, candidate, batches, warmup=1):
+    """Latency (ms/batch) and top-1 agreement of two classifiers on the same batches"""
+    results = {}
+    with torch.inference_mode():
+        for name, classifier in (("fp32", reference), ("optimized", candidate)):
+            for batch in batches[:warmup]:
+                classifier(batch)
+            preds, latencies = [], []
+            for batch in batches:
+                start = time.perf_counter()
+                preds.append(classifier(batch).argmax(dim=1))
+                latencies.append(time.perf_counter() - start)
+            results[name] = {"preds": torch.cat(preds), "mean_ms": float(np.mean(latencies) * 1000.0)}
+
+    agreement = (results["fp32"]["preds"] == results["optimized"]["preds"]).float().mean().item()
+    speedup = results["fp32"]["mean_ms"] / results["optimized"]["mean_ms"]
+    print(f"\n📊 MATERIAL CLASSIFIER ({sum(len(b) for b in batches)} crops)")
+    print(f"   fp32:      {results['fp32']['mean_ms']:.1f} ms/batch")
+    print(f"   optimized: {results['optimized']['mean_ms']:.1f} ms/batch ({speedup:.2f}x)")
+    print(f"   Top-1 agreement: {agreement:.3f}")
+    return {"fp32_ms": results["fp32"]["mean_ms"], "optimized_ms": results["optimized"]["mean_ms"],
+            "speedup": speedup, "top1_agreement": agreement}
+
+
+def main():
+    import argparse
+
+    from detector_benchmark import compare_detectors, load_benchmark_frames
+    from object_detection_2 import load_material_classifier
+
+    parser = argparse.ArgumentParser(description="Build the INT8 / channels-last models and compare them with fp32")
+    parser.add_argument("image_dir", help="Directory of test / calibration images")
+    parser.add_argument("--backend", default=None, help="Detector backend (default: BOTTLE_MODEL_BACKEND)")
+    parser.add_argument("--material-checkpoint", default=None, help="Trained material classifier weights")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of images")
+    parser.add_argument("--threshold", type=float, default=0.6, help="Confidence threshold for agreement")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore cached artifacts")
+    args = parser.parse_args()
+
+    tensors = load_benchmark_frames(args.image_dir, args.limit)
+    if not tensors:
+        print(f"❌ No images found in {args.image_dir}")
+        return
+
+    detectors = {
+        "fp32": load_model(args.backend),
+        "int8 + channels-last": load_optimized_detector(args.backend, rebuild=args.rebuild),
+    }
+    compare_detectors(detectors, tensors, confidence_threshold=args.threshold)
+
+    batches = load_calibration_batches(args.image_dir, limit=args.limit or 32)
+    compare_material_classifiers(
+        load_material_classifier(args.material_checkpoint, optimized=False, runtime="torch"),
+        load_optimized_material_classifier(args.material_checkpoint, args.image_dir, rebuild=args.rebuild),
+        batches,
+    )
+
+
+if __name__ == "__main__":
+    main()
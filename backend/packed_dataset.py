@@ -0,0 +1,260 @@
+"""
+Packed Memory-Mapped Image Dataset for Material-Classifier Training
+
+datasets.ImageFolder opens and JPEG-decodes every image with PIL on every
+epoch, which dominates CPU training time. pack_image_folder() decodes each
+split once into one contiguous uint8 array of fixed-size RGB images:
+
+    images.npy    uint8 [num_images, size, size, 3], read with mmap
+    labels.npy    int64 [num_images]
+    index.json    classes, source files and the byte offset of every image
+
+PackedImageDataset reads it without decoding: a single image is a zero-copy
+tensor view of the memory map, and a batch of indices is gathered with one
+vectorized read. Augmentation is done on whole uint8 batches with tensor ops
+on the CPU (random resized crops and flips through one affine grid_sample,
+normalization), so no per-image PIL transforms are left.
+
+Images are resized (not cropped) to size x size when packing, like the
+square crops the detector pipeline hands to the classifier. A split is
+repacked automatically when its files change (name, size or mtime).
+
+Usage:
+    python packed_dataset.py path/to/data [--size 256]    # Pack train/val, report speedup
+
+Classes:
+    PackedImageDataset: Batches from a packed split
+
+Functions:
+    pack_image_folder(): Decode an ImageFolder split into the packed format
+    benchmark_epoch(): Time one data-loading epoch, ImageFolder vs packed
+"""
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
+from torchvision import datasets
+
+from material_classification import MATERIAL_INPUT_SIZE, MATERIAL_MEAN, MATERIAL_STD
+
+PACK_SIZE = 256
+IMAGES_FILE = "images.npy"
+LABELS_FILE = "labels.npy"
+INDEX_FILE = "index.json"
+
+
+def _folder_signature(folder):
+    """Name / size / mtime of every file, to detect changed splits"""
+    signature = []
+    for path, label in folder.samples:
+        stat = os.stat(path)
+        signature.append([os.path.relpath(path, folder.root), label, stat.st_size, int(stat.st_mtime)])
+    return signature
+
+
+class _DecodeDataset(Dataset):
+    """Decode + resize with PIL, used once while packing"""
+
+    def __init__(self, samples, size):
+        self.samples = samples
+        self.size = size
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, i):
+        image = Image.open(self.samples[i][0]).convert("RGB").resize((self.size, self.size), Image.BILINEAR)
+        return torch.from_numpy(np.asarray(image).copy())
+
+
+def pack_image_folder(split_dir, pack_dir, size=PACK_SIZE, num_workers=4, force=False):
+    """
+    Decode an ImageFolder split into pack_dir (skipped when it is up to date)
+
+    Returns the pack time in seconds (0.0 when the existing pack was reused).
+    """
+    folder = datasets.ImageFolder(split_dir)
+    signature = _folder_signature(folder)
+    index_path = os.path.join(pack_dir, INDEX_FILE)
+    if not force and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("size") == size and index.get("files") == signature:
+            return 0.0
+
+    start = time.time()
+    os.makedirs(pack_dir, exist_ok=True)
+    tmp_path = os.path.join(pack_dir, IMAGES_FILE + ".tmp")
+    images = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                       shape=(len(folder.samples), size, size, 3))
+    # Decode in parallel workers, write sequentially into the memory map
+    loader = DataLoader(_DecodeDataset(folder.samples, size), batch_size=64, num_workers=num_workers)
+    row = 0
+    for batch in loader:
+        images[row:row + len(batch)] = batch.numpy()
+        row += len(batch)
+    images.flush()
+    header_offset = images.offset
+    del images
+    os.replace(tmp_path, os.path.join(pack_dir, IMAGES_FILE))
+    np.save(os.path.join(pack_dir, LABELS_FILE), np.array(folder.targets, dtype=np.int64))
+
+    image_bytes = size * size * 3
+    with open(index_path, "w") as f:
+        json.dump({
+            "size": size,
+            "classes": folder.classes,
+            "files": signature,
+            "offsets": [header_offset + i * image_bytes for i in range(len(folder.samples))],
+        }, f)
+
+    elapsed = time.time() - start
+    print(f"📦 Packed {len(folder.samples)} images from {split_dir} in {elapsed:.1f}s "
+          f"({len(folder.samples) / max(elapsed, 1e-9):.1f} images/sec)")
+    return elapsed
+
+
+class PackedImageDataset(Dataset):
+    """
+    Images from a packed split
+
+    dataset[i] is a zero-copy (size, size, 3) uint8 view and its label.
+    dataset[[i, j, ...]] returns a ready batch (float NCHW, normalized, with
+    random crops / flips when train=True) and its labels; use it with
+    batch_loader() so every DataLoader step is one vectorized read.
+
+    The memory map is opened lazily in each process that reads from it, so
+    DataLoader workers started with spawn (Windows, macOS) get the path
+    instead of a pickled copy of every image.
+    """
+
+    def __init__(self, pack_dir, train=False, output_size=MATERIAL_INPUT_SIZE,
+                 scale=(0.08, 1.0), ratio=(3.0 / 4.0, 4.0 / 3.0)):
+        self.images_path = os.path.join(pack_dir, IMAGES_FILE)
+        self._images = None
+        self.labels = torch.from_numpy(np.load(os.path.join(pack_dir, LABELS_FILE)))
+        with open(os.path.join(pack_dir, INDEX_FILE)) as f:
+            self.classes = json.load(f)["classes"]
+        self.train = train
+        self.output_size = output_size
+        self.scale = scale
+        self.ratio = ratio
+        self.mean = torch.tensor(MATERIAL_MEAN).view(1, 3, 1, 1) * 255.0
+        self.std = torch.tensor(MATERIAL_STD).view(1, 3, 1, 1) * 255.0
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode="c")
+        return self._images
+
+    def __getstate__(self):
+        # Workers reopen the memory map instead of receiving the array by value
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            # Copy-on-write memory map: a zero-copy view that never writes back to the pack
+            return torch.from_numpy(self.images[index]), self.labels[index]
+
+        # Sorted indices keep the memory-mapped read sequential
+        index = np.sort(np.asarray(index))
+        batch = torch.from_numpy(self.images[index]).permute(0, 3, 1, 2).float()
+        return self.augment(batch), self.labels[index]
+
+    def _random_boxes(self, count, size):
+        """RandomResizedCrop boxes for a whole batch (vectorized, with center-crop fallback)"""
+        area = size * size * np.random.uniform(*self.scale, count)
+        log_ratio = np.random.uniform(math.log(self.ratio[0]), math.log(self.ratio[1]), count)
+        aspect = np.exp(log_ratio)
+        width = np.sqrt(area * aspect)
+        height = np.sqrt(area / aspect)
+        invalid = (width > size) | (height > size)
+        width[invalid] = height[invalid] = size
+        x1 = np.random.uniform(0, 1, count) * (size - width)
+        y1 = np.random.uniform(0, 1, count) * (size - height)
+        return np.stack([x1, y1, x1 + width, y1 + height], axis=1)
+
+    def augment(self, batch):
+        """uint8-valued float NCHW batch -> normalized classifier input"""
+        count, size = batch.shape[0], batch.shape[-1]
+        if self.train:
+            # Crop, resize and flip every image with one affine grid_sample
+            x1, y1, x2, y2 = torch.from_numpy(self._random_boxes(count, size)).float().unbind(1)
+            flip = torch.where(torch.rand(count) < 0.5, -1.0, 1.0)
+            theta = torch.zeros(count, 2, 3)
+            theta[:, 0, 0] = (x2 - x1) / size * flip
+            theta[:, 0, 2] = (x1 + x2) / size - 1.0
+            theta[:, 1, 1] = (y2 - y1) / size
+            theta[:, 1, 2] = (y1 + y2) / size - 1.0
+            grid = F.affine_grid(theta, (count, 3, self.output_size, self.output_size), align_corners=False)
+            batch = F.grid_sample(batch, grid, mode="bilinear", align_corners=False)
+        else:
+            offset = (size - self.output_size) // 2
+            batch = batch[:, :, offset:offset + self.output_size, offset:offset + self.output_size]
+        return (batch - self.mean) / self.std
+
+    def batch_loader(self, batch_size, shuffle=None, num_workers=0, pin_memory=False):
+        """DataLoader that hands whole index batches to __getitem__"""
+        shuffle = self.train if shuffle is None else shuffle
+        sampler = BatchSampler(RandomSampler(self) if shuffle else SequentialSampler(self), batch_size, False)
+        return DataLoader(self, sampler=sampler, batch_size=None, num_workers=num_workers,
+                          pin_memory=pin_memory, persistent_workers=(num_workers > 0))
+
+
+def benchmark_epoch(split_dir, pack_dir, transform, batch_size=32, num_workers=4):
+    """Time one data-loading epoch with ImageFolder + PIL transforms and with the packed split"""
+    results = {}
+    folder_loader = DataLoader(datasets.ImageFolder(split_dir, transform), batch_size=batch_size,
+                               shuffle=True, num_workers=num_workers)
+    packed_loader = PackedImageDataset(pack_dir, train=True).batch_loader(batch_size, num_workers=num_workers)
+
+    for name, loader in (("imagefolder", folder_loader), ("packed", packed_loader)):
+        start = time.time()
+        images = 0
+        for inputs, _ in loader:
+            images += len(inputs)
+        results[name] = time.time() - start
+        print(f"   {name:<12} {results[name]:.2f}s/epoch ({images / max(results[name], 1e-9):.1f} images/sec)")
+
+    speedup = results["imagefolder"] / max(results["packed"], 1e-9)
+    print(f"   Epoch speedup: {speedup:.2f}x")
+    return {**results, "speedup": speedup}
+
+
+def main():
+    import argparse
+
+    from model_creation import MATERIAL_TRANSFORMS
+
+    parser = argparse.ArgumentParser(description="Pack ImageFolder train/val splits into memory-mapped arrays")
+    parser.add_argument("data_dir", help="Folder with train/ and val/ subfolders")
+    parser.add_argument("--pack-dir", default=None, help="Output folder (default: <data_dir>/.packed)")
+    parser.add_argument("--size", type=int, default=PACK_SIZE, help="Packed image size")
+    parser.add_argument("--workers", type=int, default=4, help="Decode / loader workers")
+    args = parser.parse_args()
+
+    pack_dir = args.pack_dir or os.path.join(args.data_dir, ".packed")
+    for split in ("train", "val"):
+        pack_image_folder(os.path.join(args.data_dir, split), os.path.join(pack_dir, split), args.size,
+                          args.workers, force=True)
+
+    print("\n📊 Training data-loading epoch:")
+    benchmark_epoch(os.path.join(args.data_dir, "train"), os.path.join(pack_dir, "train"),
+                    MATERIAL_TRANSFORMS["train"], num_workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
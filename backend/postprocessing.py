@@ -0,0 +1,86 @@
+"""
+Vectorized Detector Postprocessing
+
+Turns raw detector output (boxes / labels / scores tensors for up to 100
+proposals) into bottle detections in frame coordinates using masked tensor
+operations, with a single tensor -> NumPy transfer per frame instead of one
+.item() / .tolist() call per proposal.
+
+Detections are kept as a compact structured NumPy array (DETECTION_DTYPE)
+inside the pipeline and only converted to dicts / JSON at the API boundary.
+
+Functions:
+    postprocess_detections(): Detector output -> structured detection array
+    postprocess_materials(): Fused detector material output for the same rows
+    detections_to_dicts(): Structured array -> [{'bbox': [...], 'confidence': ...}]
+    empty_detections(): Zero-length detection array
+"""
+
+import numpy as np
+import torch
+
+# COCO class id of "bottle"
+BOTTLE_LABEL = 44
+
+# One row per detection: integer box in frame coordinates and its score
+DETECTION_DTYPE = np.dtype([
+    ("bbox", np.int32, (4,)),
+    ("confidence", np.float32),
+])
+
+
+def empty_detections():
+    """Zero-length detection array"""
+    return np.empty(0, dtype=DETECTION_DTYPE)
+
+
+def postprocess_detections(pred, frame_shape, input_size=None, confidence_threshold=0.6,
+                           label=BOTTLE_LABEL):
+    """
+    Filter one image's detector output and scale boxes to the frame
+
+    `input_size` is the (width, height) the frame was resized to before
+    inference; None means it was not resized. Boxes are truncated to integer
+    pixels like the original per-box int() conversion.
+    """
+    boxes, labels, scores = pred["boxes"], pred["labels"], pred["scores"]
+
+    keep = (labels == label) & (scores > confidence_threshold)
+    boxes = boxes[keep]
+    scores = scores[keep]
+
+    if input_size is not None:
+        width, height = input_size
+        scale_x = frame_shape[1] / width
+        scale_y = frame_shape[0] / height
+        # Scale in double precision so truncation matches int(x * scale)
+        boxes = boxes.double() * torch.tensor([scale_x, scale_y, scale_x, scale_y], dtype=torch.float64)
+
+    detections = np.empty(len(scores), dtype=DETECTION_DTYPE)
+    detections["bbox"] = boxes.to(torch.int32).numpy()
+    detections["confidence"] = scores.numpy()
+    return detections
+
+
+def postprocess_materials(pred, confidence_threshold=0.6, label=BOTTLE_LABEL):
+    """
+    (material_name, probability) per detection of postprocess_detections()
+
+    Only for predictions of the fused detector, which carry "materials" and
+    "material_scores"; rows are filtered exactly like the detections.
+    """
+    from material_classification import MATERIAL_LABELS
+
+    keep = (pred["labels"] == label) & (pred["scores"] > confidence_threshold)
+    return [
+        (MATERIAL_LABELS.get(index, "Unknown"), probability)
+        for index, probability in zip(pred["materials"][keep].tolist(), pred["material_scores"][keep].tolist())
+    ]
+
+
+def detections_to_dicts(detections):
+    """Convert a structured detection array to JSON-friendly dicts"""
+    return [
+        {'bbox': bbox, 'confidence': confidence}
+        for bbox, confidence in zip(detections["bbox"].tolist(), detections["confidence"].tolist())
+    ]
@@ -0,0 +1,197 @@
+"""
+Cached, Coalesced InfluxDB Queries
+
+Every dashboard refresh used to send the same Flux query to InfluxDB Cloud.
+QueryCache sits in front of the query API:
+
+- Fresh hits: results younger than `ttl` seconds are served from memory.
+- Stale-while-revalidate: results up to `ttl + stale_ttl` seconds old are
+  still served immediately while one background refresh fetches new ones.
+- Single-flight: concurrent misses for the same query share one upstream
+  call; the other callers wait for its result instead of querying again.
+- Bounded: at most `max_entries` results, least recently used evicted first.
+- Failed queries are not cached; a failed background refresh keeps serving
+  the stale result until it expires.
+
+Any object with a query(flux) method works as the upstream API, e.g. a
+fake one returning canned rows (see main()).
+
+Configuration (environment variables):
+    BOTTLE_QUERY_CACHE_TTL     Fresh time in seconds (default 2)
+    BOTTLE_QUERY_CACHE_STALE   Extra seconds a stale result may be served (default 30)
+    BOTTLE_QUERY_CACHE_SIZE    Maximum cached queries (default 128)
+
+Usage:
+    python query_cache.py    # Coalescing / hit-rate demo against a fake query API
+
+Classes:
+    QueryCache: TTL / LRU cache with single-flight loads and background refresh
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+QUERY_CACHE_TTL = float(os.environ.get("BOTTLE_QUERY_CACHE_TTL", "2"))
+QUERY_CACHE_STALE = float(os.environ.get("BOTTLE_QUERY_CACHE_STALE", "30"))
+QUERY_CACHE_SIZE = int(os.environ.get("BOTTLE_QUERY_CACHE_SIZE", "128"))
+
+
+class QueryCache:
+    """TTL- and size-bounded result cache with single-flight loads"""
+
+    def __init__(self, ttl=QUERY_CACHE_TTL, stale_ttl=QUERY_CACHE_STALE, max_entries=QUERY_CACHE_SIZE,
+                 refresh_workers=2):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max(1, int(max_entries))
+        # key -> (value, loaded_at)
+        self._entries = OrderedDict()
+        # key -> Future of the load in progress
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="query-refresh")
+        self._counters = dict.fromkeys(("hits", "stale_hits", "misses", "coalesced", "upstream_calls",
+                                        "refreshes", "errors", "evictions"), 0)
+        self._upstream_time = 0.0
+
+    def _count(self, name, amount=1):
+        self._counters[name] += amount
+
+    def get(self, key, loader):
+        """Cached value of key, calling loader() (once for all concurrent callers) if needed"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = now - loaded_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._count("hits")
+                    return value
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._count("stale_hits")
+                    if key not in self._inflight:
+                        self._inflight[key] = Future()
+                        self._count("refreshes")
+                        self._refresher.submit(self._load, key, loader, self._inflight[key])
+                    return value
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self._count("coalesced")
+                owner = False
+            else:
+                future = self._inflight[key] = Future()
+                self._count("misses")
+                owner = True
+
+        if owner:
+            self._load(key, loader, future)
+        return future.result()
+
+    def _load(self, key, loader, future):
+        start = time.time()
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._count("upstream_calls")
+                self._count("errors")
+                self._upstream_time += time.time() - start
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count("evictions")
+            self._inflight.pop(key, None)
+            self._count("upstream_calls")
+            self._upstream_time += time.time() - start
+        future.set_result(value)
+
+    def query(self, query_api, flux, transform=None):
+        """Run a Flux query through the cache; transform(tables) shapes the cached result"""
+        def load():
+            tables = query_api.query(flux)
+            return transform(tables) if transform else tables
+        return self.get(flux, load)
+
+    def invalidate(self, key=None):
+        """Drop one cached result, or all of them"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Hit / miss / coalescing counters and upstream latency"""
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            upstream_time = self._upstream_time
+        requests = counters["hits"] + counters["stale_hits"] + counters["misses"] + counters["coalesced"]
+        served_from_cache = counters["hits"] + counters["stale_hits"] + counters["coalesced"]
+        return {
+            **counters,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl,
+            "stale_ttl_s": self.stale_ttl,
+            "hit_rate": round(served_from_cache / requests, 3) if requests else None,
+            "avg_upstream_ms": round(upstream_time / counters["upstream_calls"] * 1000.0, 1)
+            if counters["upstream_calls"] else None,
+        }
+
+
+def main():
+    """Hammer a fake, slow query API from many threads and print the cache statistics"""
+
+    class FakeQueryApi:
+        def __init__(self, latency=0.2):
+            self.latency = latency
+            self.calls = 0
+
+        def query(self, flux):
+            self.calls += 1
+            time.sleep(self.latency)
+            return [{"query": flux, "call": self.calls}]
+
+    upstream = FakeQueryApi()
+    cache = QueryCache(ttl=0.5, stale_ttl=2.0)
+    flux = 'from(bucket: "waste") |> range(start: -1h)'
+    latencies = []
+
+    def client():
+        for _ in range(20):
+            start = time.time()
+            cache.query(upstream, flux)
+            latencies.append(time.time() - start)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=client) for _ in range(50)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    print(f"📊 {len(latencies)} requests from {len(threads)} clients in {time.time() - start:.1f}s")
+    print(f"   Upstream queries: {upstream.calls}")
+    print(f"   p50 / p99 latency: {latencies[len(latencies) // 2] * 1000:.1f} / "
+          f"{latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"   Cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
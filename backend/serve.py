@@ -0,0 +1,312 @@
+"""
+Production Server for the Flask API
+
+`python app.py` runs the Werkzeug development server with the reloader: the
+app is imported twice (reloader parent and child), requests are handled by
+one process, and Ctrl+C leaves a running detection holding the camera.
+This launcher serves the same app with a production server instead:
+
+- gunicorn (Linux / macOS): --workers processes with --threads threads each
+  (gthread workers), or uvicorn workers (--worker-class uvicorn; the Flask
+  app runs behind asgiref's WSGI -> ASGI adapter)
+- waitress (Windows): one process with --threads threads
+- werkzeug: threaded development server without the reloader (no extra
+  dependency)
+
+Model Preloading (--preload, gunicorn only):
+The master process loads the detector weights once before forking, so every
+worker shares that copy copy-on-write instead of loading its own; gc.freeze()
+keeps the garbage collector from touching (and so copying) the preloaded
+objects. Only the weights are loaded in the master. app.py is imported by
+each worker after the fork, because the threads it starts (job workers,
+pollers, InfluxDB writer) do not survive a fork. Each worker then warms up
+its inference service and limits torch to its share of the CPU cores.
+Preloading requires the eager torch runtime (ONNX Runtime sessions are not
+fork-safe) and is skipped when BOTTLE_MODEL_SERVER is set.
+
+Graceful Shutdown:
+On SIGTERM / SIGINT running detections are stopped so the camera is
+released, queued jobs fail instead of starting, and queued InfluxDB writes
+are flushed (app.shutdown_app()).
+
+One Worker by Default:
+Jobs, SSE subscribers and live streams live in the memory of one worker
+process. With several workers, GET /api/jobs/<id> often reaches a worker
+that never saw the job, and job events go only to the clients of the worker
+that ran it; the frontend (which posts a job and then polls it) breaks. So
+the launcher refuses --workers > 1 unless --stateless-workers is given, for
+deployments whose clients only use the synchronous endpoints (e.g.
+/api/detect-bottle, which waits for its job in the same worker). Scale the
+frontend's server with --threads instead. Also note that a camera can only
+be opened by one worker at a time, and that SSE and MJPEG streams hold one
+thread each for as long as they are open.
+
+Usage:
+    python serve.py                                       # gunicorn, 1 worker x 8 threads
+    python serve.py --threads 16 --preload                # model loaded before serving
+    python serve.py --worker-class uvicorn
+    python serve.py --server waitress --threads 16        # Windows
+    python serve.py --workers 4 --threads 2 --preload --stateless-workers
+                                                          # /api/detect-bottle only, 4 workers, one model copy
+
+Configuration (environment variables, overridden by the options):
+    BOTTLE_SERVER          gunicorn, waitress or werkzeug (default: first one installed)
+    BOTTLE_BIND            Address to listen on (default 0.0.0.0:5000)
+    BOTTLE_WORKERS         Worker processes (default 1)
+    BOTTLE_THREADS         Threads per worker (default 8)
+    BOTTLE_WORKER_CLASS    gthread or uvicorn (default gthread)
+    BOTTLE_PRELOAD=1       Preload the model in the master process
+    BOTTLE_STATELESS_WORKERS=1   Allow more than one worker (see above)
+    BOTTLE_HEADLESS        Set to 1 unless given (no OpenCV windows on a server)
+
+Functions:
+    preload_models(): Load detector weights before forking workers
+    run_gunicorn(), run_waitress(), run_werkzeug(): Server backends
+"""
+
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+
+# A production server has no display for the OpenCV windows
+os.environ.setdefault("BOTTLE_HEADLESS", "1")
+
+try:
+    from gunicorn.app.base import BaseApplication
+    GUNICORN_AVAILABLE = True
+except ImportError:
+    GUNICORN_AVAILABLE = False
+
+try:
+    import waitress
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+SERVERS = ("gunicorn", "waitress", "werkzeug")
+WORKER_CLASSES = {
+    "gthread": "gthread",
+    "uvicorn": "uvicorn.workers.UvicornWorker",
+}
+SHUTDOWN_TIMEOUT = 10.0
+
+
+def default_server():
+    if GUNICORN_AVAILABLE:
+        return "gunicorn"
+    if WAITRESS_AVAILABLE:
+        return "waitress"
+    return "werkzeug"
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+def load_app(asgi=False):
+    """Import the Flask app (optionally wrapped as an ASGI app)"""
+    from app import app
+
+    if asgi:
+        from asgiref.wsgi import WsgiToAsgi
+        return WsgiToAsgi(app)
+    return app
+
+
+def shutdown(timeout=SHUTDOWN_TIMEOUT):
+    """Graceful shutdown of the app in this process (no-op if it was never imported)"""
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.shutdown_app(timeout)
+
+
+def preload_models(backends=None):
+    """
+    Load detector weights in this (master) process so forked workers share them
+
+    Returns False when preloading does not apply (model server or non-torch runtime).
+    """
+    if os.environ.get("BOTTLE_MODEL_SERVER"):
+        print("⚠️ BOTTLE_MODEL_SERVER is set, workers use the model server; not preloading")
+        return False
+    from model import MODEL_RUNTIME, get_model, resolve_backend
+
+    if MODEL_RUNTIME != "torch":
+        print(f"⚠️ Preloading is not fork-safe with the {MODEL_RUNTIME} runtime; workers load their own model")
+        return False
+    for backend in backends or [None]:
+        start = time.time()
+        get_model(backend)
+        print(f"✅ Preloaded detector {resolve_backend(backend)} in {time.time() - start:.2f}s "
+              f"(shared copy-on-write by all workers)")
+    # Preloaded objects go to the permanent generation: collections in the workers
+    # no longer write to them, so their memory pages stay shared
+    gc.freeze()
+    return True
+
+
+# ----------------- gunicorn -----------------
+def _post_fork(server, worker):
+    """Give every worker its share of the CPU cores for torch intra-op threads"""
+    if "torch" in sys.modules:
+        import torch
+
+        workers = max(1, server.cfg.workers)
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def _post_worker_init_factory(preloaded, backends):
+    def post_worker_init(worker):
+        # Stop detections as soon as SIGTERM / SIGINT arrives, so requests waiting for
+        # a detection finish within the graceful timeout. uvicorn workers handle the
+        # signal themselves and re-raise it after their shutdown; exit normally then,
+        # so worker_exit still runs.
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(signum)
+
+            def handler(signum, frame, previous=previous):
+                if "detection_pipeline" in sys.modules:
+                    sys.modules["detection_pipeline"].stop_all_pipelines(timeout=0)
+                if callable(previous):
+                    previous(signum, frame)
+                else:
+                    sys.exit(0)
+            signal.signal(signum, handler)
+
+        if preloaded:
+            # Warm up this worker's inference service on the shared weights
+            from model_server import get_inference_client
+            for backend in backends or [None]:
+                get_inference_client(backend)
+    return post_worker_init
+
+
+def _worker_exit(server, worker):
+    shutdown()
+
+
+if GUNICORN_AVAILABLE:
+    class GunicornServer(BaseApplication):
+        """gunicorn application serving app.py with the given settings"""
+
+        def __init__(self, options, asgi=False):
+            self.options = options
+            self.asgi = asgi
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app(self.asgi)
+
+
+MULTI_WORKER_ERROR = ("--workers > 1 breaks job polling (/api/jobs/<id>), SSE events and live streams, "
+                      "which live in one worker; the frontend needs them. Use --threads, or pass "
+                      "--stateless-workers if clients only use /api/detect-bottle")
+
+
+def run_gunicorn(bind, workers, threads, worker_class="gthread", preload=False, backends=None,
+                 stateless_workers=False):
+    if not GUNICORN_AVAILABLE:
+        raise RuntimeError("gunicorn is not installed (pip install gunicorn)")
+    if workers > 1 and not stateless_workers:
+        raise ValueError(MULTI_WORKER_ERROR)
+    if workers > 1:
+        print(f"⚠️ {workers} workers: /api/jobs/<id>, SSE events and live streams are not reliable")
+    if worker_class not in WORKER_CLASSES:
+        raise ValueError(f"Unknown worker class '{worker_class}'. Available: {', '.join(WORKER_CLASSES)}")
+
+    preloaded = preload and preload_models(backends)
+    options = {
+        "bind": bind,
+        "workers": workers,
+        "threads": threads,
+        "worker_class": WORKER_CLASSES[worker_class],
+        # /api/detect-bottle waits up to 25s for its detection
+        "timeout": 120,
+        "graceful_timeout": int(SHUTDOWN_TIMEOUT) + 5,
+        "post_fork": _post_fork,
+        "post_worker_init": _post_worker_init_factory(preloaded, backends),
+        "worker_exit": _worker_exit,
+    }
+    print(f"🚀 gunicorn on {bind}: {workers} {worker_class} worker(s) x {threads} thread(s)"
+          f"{', shared preloaded model' if preloaded else ''}")
+    GunicornServer(options, asgi=worker_class == "uvicorn").run()
+
+
+# ----------------- Single-process servers -----------------
+def _serve_until_signal(serve):
+    """Run a blocking server; SIGTERM / SIGINT trigger the graceful shutdown"""
+    def handle_signal(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    try:
+        serve()
+    finally:
+        shutdown()
+
+
+def run_waitress(bind, threads, preload=False, backends=None):
+    if not WAITRESS_AVAILABLE:
+        raise RuntimeError("waitress is not installed (pip install waitress)")
+    app = load_app()
+    if preload:
+        from model_server import get_inference_client
+        for backend in backends or [None]:
+            get_inference_client(backend)
+    print(f"🚀 waitress on {bind}: 1 process x {threads} thread(s)")
+    _serve_until_signal(lambda: waitress.serve(app, listen=bind, threads=threads))
+
+
+def run_werkzeug(bind, preload=False, backends=None):
+    host, port = parse_bind(bind)
+    app = load_app()
+    if preload:
+        from model_server import get_inference_client
+        for backend in backends or [None]:
+            get_inference_client(backend)
+    print(f"🚀 Werkzeug (threaded, no reloader) on {bind}")
+    _serve_until_signal(lambda: app.run(host=host, port=port, threaded=True, debug=False, use_reloader=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the bottle detection API with a production server")
+    parser.add_argument("--server", choices=SERVERS, default=os.environ.get("BOTTLE_SERVER", default_server()))
+    parser.add_argument("--bind", default=os.environ.get("BOTTLE_BIND", "0.0.0.0:5000"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BOTTLE_WORKERS", "1")))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("BOTTLE_THREADS", "8")))
+    parser.add_argument("--worker-class", choices=tuple(WORKER_CLASSES),
+                        default=os.environ.get("BOTTLE_WORKER_CLASS", "gthread"))
+    parser.add_argument("--preload", action="store_true", default=os.environ.get("BOTTLE_PRELOAD", "0") == "1",
+                        help="Load the model once before the workers start")
+    parser.add_argument("--backend", action="append", dest="backends",
+                        help="Detector backend to preload (repeatable, default: BOTTLE_MODEL_BACKEND)")
+    parser.add_argument("--stateless-workers", action="store_true",
+                        default=os.environ.get("BOTTLE_STATELESS_WORKERS", "0") == "1",
+                        help="Allow --workers > 1 for clients that only use /api/detect-bottle")
+    args = parser.parse_args()
+
+    if args.server == "gunicorn":
+        if args.workers > 1 and not args.stateless_workers:
+            parser.error(MULTI_WORKER_ERROR)
+        run_gunicorn(args.bind, args.workers, args.threads, args.worker_class, args.preload, args.backends,
+                     args.stateless_workers)
+    else:
+        if args.workers != 1:
+            print(f"⚠️ {args.server} runs one process; ignoring --workers {args.workers}")
+        if args.server == "waitress":
+            run_waitress(args.bind, args.threads, args.preload, args.backends)
+        else:
+            run_werkzeug(args.bind, args.preload, args.backends)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import json
+
+from event_stream import Broadcaster, format_sse
+
+
+def data_of(message):
+    return json.loads(message.split("data: ", 1)[1])
+
+
+def test_format_sse():
+    assert format_sse({"a": 1}, "job", 3) == 'id: 3\nevent: job\ndata: {"a":1}\n\n'
+
+
+def test_published_events_reach_every_subscriber():
+    broadcaster = Broadcaster("test")
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+    broadcaster.publish("job", {"n": 1})
+
+    for subscription in (first, second):
+        assert data_of(subscription.queue.get_nowait()) == {"n": 1}
+    assert broadcaster.published == 1 and broadcaster.subscriber_count == 2
+
+
+def test_new_subscriber_gets_latest_event_of_each_type():
+    broadcaster = Broadcaster("test")
+    broadcaster.publish("job", {"n": 1})
+    broadcaster.publish("job", {"n": 2})
+    broadcaster.publish("stats", {"n": 3})
+
+    subscription = broadcaster.subscribe()
+    assert [data_of(subscription.queue.get_nowait()) for _ in range(2)] == [{"n": 2}, {"n": 3}]
+    assert subscription.queue.empty()
+
+
+def test_slow_subscriber_drops_oldest_events():
+    broadcaster = Broadcaster("test", queue_size=2)
+    subscription = broadcaster.subscribe()
+    for n in range(5):
+        broadcaster.publish(f"event{n}", {"n": n})
+
+    assert [data_of(subscription.queue.get_nowait()) for _ in range(2)] == [{"n": 3}, {"n": 4}]
+    assert subscription.dropped == 3
+
+
+def test_close_ends_the_stream_and_unsubscribes():
+    broadcaster = Broadcaster("test")
+    subscription = broadcaster.subscribe()
+    broadcaster.publish("job", {"n": 1})
+    broadcaster.close()
+
+    messages = list(subscription.messages(heartbeat=0.1))
+    assert messages[0].startswith("retry:")
+    assert [data_of(message) for message in messages[1:]] == [{"n": 1}]
+    assert broadcaster.subscriber_count == 0
@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+from export_models import ONNXRUNTIME_AVAILABLE, OnnxRuntimeDetector, export_detector
+from model import BOTTLE_LABEL, FusedBottleMaterialDetector, build_material_head, load_model
+
+BACKEND = "fasterrcnn_mobilenet_v3_large_320_fpn"
+
+
+@pytest.fixture(scope="module")
+def fused_bottle_only():
+    torch.manual_seed(0)
+    detector = load_model(BACKEND, pretrained=False, bottle_only=True)
+    fused = FusedBottleMaterialDetector(detector, build_material_head(detector)).eval()
+    # Untrained weights: keep every box so there is something to check
+    fused.detector.roi_heads.score_thresh = 0.0
+    return fused
+
+
+@pytest.mark.parametrize("runtime", ["torchscript", "onnxruntime"])
+def test_exported_fused_bottle_only_detector_keeps_bottle_label(fused_bottle_only, runtime, tmp_path):
+    if runtime == "onnxruntime" and not ONNXRUNTIME_AVAILABLE:
+        pytest.skip("onnxruntime not installed")
+    path = export_detector(fused_bottle_only, runtime, str(tmp_path / f"fused.{runtime}"))
+    exported = torch.jit.load(path) if runtime == "torchscript" else OnnxRuntimeDetector(path)
+
+    with torch.no_grad():
+        labels = exported([torch.rand(3, 240, 320)])[0]["labels"]
+    assert len(labels) > 0
+    assert labels.tolist() == [BOTTLE_LABEL] * len(labels)
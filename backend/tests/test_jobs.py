@@ -0,0 +1,39 @@
+from jobs import Job, JobStore
+
+
+def finished_job(kind="detect"):
+    job = Job(kind)
+    job._finish(result={})
+    return job
+
+
+def test_store_evicts_least_recently_used_finished_job():
+    store = JobStore(capacity=2)
+    first, second, third = finished_job(), finished_job(), finished_job()
+    store.add(first)
+    store.add(second)
+    # Reading a job marks it as recently used
+    assert store.get(first.id) is first
+    store.add(third)
+
+    assert store.get(second.id) is None
+    assert store.get(first.id) is first and store.get(third.id) is third
+    assert store.evicted == 1 and len(store) == 2
+
+
+def test_store_never_evicts_queued_or_running_jobs():
+    store = JobStore(capacity=1)
+    queued, running = Job("detect"), Job("detect")
+    running._start()
+    store.add(queued)
+    store.add(running)
+
+    assert len(store) == 2 and store.evicted == 0
+    finished = finished_job()
+    store.add(finished)
+    assert store.get(finished.id) is None
+    assert store.counts() == {"queued": 1, "running": 1, "completed": 0, "failed": 0}
+
+
+def test_unknown_job_id():
+    assert JobStore().get("missing") is None
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from joystick_history import TimeWindowBuffer
+
+
+def test_same_time_records_with_different_values_are_kept():
+    now = datetime.now(timezone.utc)
+    buffer = TimeWindowBuffer()
+    assert buffer.add([{"time": now, "material": "glass"}, {"time": now, "material": "metal"}]) == 2
+    # Overlapping sync: only the new record is added
+    assert buffer.add([{"time": now, "material": "glass"}, {"time": now, "material": "plastic"}]) == 1
+    assert len(buffer) == 3
+
+
+def test_since_newest_first_with_limit_and_eviction():
+    now = datetime.now(timezone.utc)
+    buffer = TimeWindowBuffer(window=timedelta(minutes=10))
+    buffer.add([{"time": now - timedelta(minutes=m), "material": str(m)} for m in (0, 1, 2, 30)])
+    assert buffer.evict(now) == 1
+
+    assert [r["material"] for r in buffer.since()] == ["0", "1", "2"]
+    assert [r["material"] for r in buffer.since(limit=2)] == ["0", "1"]
+    assert [r["material"] for r in buffer.since(now - timedelta(minutes=1))] == ["0"]
+
+
+def test_negative_limit_is_rejected():
+    with pytest.raises(ValueError):
+        TimeWindowBuffer().since(limit=-1)
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from query_cache import QueryCache
+
+FLUX = 'from(bucket: "waste") |> range(start: -1h)'
+
+
+class FakeQueryApi:
+    """Stands in for the InfluxDB query API: counts calls, optionally slow or failing"""
+
+    def __init__(self, latency=0.0, error=None):
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def query(self, flux):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+        return [{"query": flux, "call": call}]
+
+
+def call_of(tables):
+    return tables[0]["call"]
+
+
+def test_concurrent_misses_share_one_upstream_query():
+    cache = QueryCache(ttl=60, stale_ttl=0)
+    upstream = FakeQueryApi(latency=0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.query(upstream, FLUX))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert upstream.calls == 1
+    assert [call_of(result) for result in results] == [1] * 10
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 9 and stats["upstream_calls"] == 1
+
+
+def test_fresh_results_are_served_from_memory():
+    cache = QueryCache(ttl=60, stale_ttl=0)
+    upstream = FakeQueryApi()
+    assert [call_of(cache.query(upstream, FLUX)) for _ in range(3)] == [1, 1, 1]
+    assert upstream.calls == 1
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["hit_rate"] == round(2 / 3, 3) and stats["entries"] == 1
+
+
+def test_transform_result_is_cached():
+    cache = QueryCache(ttl=60, stale_ttl=0)
+    upstream = FakeQueryApi()
+    assert cache.query(upstream, FLUX, transform=len) == 1
+    assert cache.query(upstream, FLUX, transform=len) == 1
+    assert upstream.calls == 1
+
+
+def test_expired_results_are_queried_again():
+    cache = QueryCache(ttl=0.05, stale_ttl=0)
+    upstream = FakeQueryApi()
+    assert call_of(cache.query(upstream, FLUX)) == 1
+    time.sleep(0.1)
+    assert call_of(cache.query(upstream, FLUX)) == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_stale_result_is_served_while_refreshing_in_the_background():
+    cache = QueryCache(ttl=0.5, stale_ttl=60)
+    upstream = FakeQueryApi(latency=0.2)
+    assert call_of(cache.query(upstream, FLUX)) == 1
+    time.sleep(0.6)
+
+    start = time.time()
+    assert call_of(cache.query(upstream, FLUX)) == 1
+    assert time.time() - start < 0.1
+    time.sleep(0.3)
+    assert call_of(cache.query(upstream, FLUX)) == 2
+    stats = cache.stats()
+    assert stats["stale_hits"] == 1 and stats["refreshes"] == 1 and stats["upstream_calls"] == 2
+
+
+def test_failed_queries_are_not_cached():
+    cache = QueryCache(ttl=60, stale_ttl=0)
+    with pytest.raises(ConnectionError):
+        cache.query(FakeQueryApi(error=ConnectionError("InfluxDB down")), FLUX)
+    assert call_of(cache.query(FakeQueryApi(), FLUX)) == 1
+    assert cache.stats()["errors"] == 1
+
+
+def test_least_recently_used_query_is_evicted():
+    cache = QueryCache(ttl=60, stale_ttl=0, max_entries=2)
+    upstream = FakeQueryApi()
+    cache.query(upstream, "a")
+    cache.query(upstream, "b")
+    cache.query(upstream, "a")
+    cache.query(upstream, "c")
+
+    assert upstream.calls == 3
+    cache.query(upstream, "a")
+    assert upstream.calls == 3
+    cache.query(upstream, "b")
+    assert upstream.calls == 4
+    assert cache.stats()["evictions"] == 2
@@ -12,43 +12,43 @@ const UserDashboard = () => {
     glass: 30,
   };
 
-  const fetchJoystickData = async () => {
-    try {
-      const res = await fetch("http://localhost:5000/api/joystick");
-      if (!res.ok) throw new Error("Failed to fetch data");
-      const data = await res.json();
+  const showJoystickData = (data) => {
+    if (Array.isArray(data)) {
+      let total = 0;
+      const records = data.map((row) => {
+        const material = row.material || "unknown";
+        const reward = materialRewards[material] || 0;
+        total += reward;
+        return {
+          dateTime: row.time ? new Date(row.time).toLocaleString() : "-",
+          type: material,
+          quantity: 1,
+          amount: reward,
+        };
+      });
 
-      if (Array.isArray(data)) {
-        let total = 0;
-        const records = data.map((row) => {
-          const material = row.material || "unknown";
-          const reward = materialRewards[material] || 0;
-          total += reward;
-          return {
-            dateTime: row.time ? new Date(row.time).toLocaleString() : "-",
-            type: material,
-            quantity: 1,
-            amount: reward,
-          };
-        });
+      setWasteRecords(records);
+      setTotalReward(total);
+      setError("");
 
-        setWasteRecords(records);
-        setTotalReward(total);
-
-        if (records.length > 0) {
-          setLatestMaterial(records[records.length - 1].type); // ✅ latest record
-        }
+      if (records.length > 0) {
+        setLatestMaterial(records[records.length - 1].type); // ✅ latest record
       }
-    } catch (err) {
-      console.error("Error fetching joystick data:", err);
-      setError("⚠️ Unable to fetch waste records. Please try again later.");
     }
   };
 
   useEffect(() => {
-    fetchJoystickData();
-    const interval = setInterval(fetchJoystickData, 3000);
-    return () => clearInterval(interval);
+    // The backend pushes joystick updates; no polling
+    const source = new EventSource("http://localhost:5000/api/events/joystick");
+    source.addEventListener("joystick", (event) => {
+      showJoystickData(JSON.parse(event.data));
+    });
+    source.onerror = () => {
+      // EventSource reconnects by itself
+      console.error("Joystick event stream disconnected");
+      setError("⚠️ Unable to fetch waste records. Please try again later.");
+    };
+    return () => source.close();
   }, []);
 
   return (
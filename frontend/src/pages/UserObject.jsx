@@ -13,7 +13,6 @@ const UserObject = () => {
   const [detectionProgress, setDetectionProgress] = useState(0);
   const [detectionTime, setDetectionTime] = useState(null);
   const [cameraStatus, setCameraStatus] = useState("idle");
-  const intervalRef = useRef(null);
   const detectionIntervalRef = useRef(null);
   const navigate = useNavigate();
 
@@ -28,6 +27,34 @@ const UserObject = () => {
     return colors[material?.toLowerCase()] || colors.default;
   };
 
+  // Resolves with the finished job, using pushed job events instead of polling
+  const waitForJob = (jobId) =>
+    new Promise((resolve, reject) => {
+      const events = new EventSource("http://localhost:5000/api/events/detections");
+      const check = async () => {
+        try {
+          const res = await fetch(`http://localhost:5000/api/jobs/${jobId}`);
+          if (!res.ok) throw new Error("Detection job was lost");
+          const job = await res.json();
+          if (job.status === "completed" || job.status === "failed") {
+            events.close();
+            resolve(job);
+          }
+        } catch (err) {
+          events.close();
+          reject(err);
+        }
+      };
+      // Also catches a job that finished before the stream was connected
+      events.onopen = check;
+      events.addEventListener("job", (event) => {
+        const job = JSON.parse(event.data);
+        if (job.job_id === jobId && (job.status === "completed" || job.status === "failed")) {
+          check();
+        }
+      });
+    });
+
   const startObjectDetection = async () => {
     setShowPopup(true);
     setIsDetecting(true);
@@ -56,17 +83,23 @@ const UserObject = () => {
         setCameraStatus("processing");
       }, 1500);
 
-      // Call the real-time object detection API
-      const response = await fetch("http://localhost:5000/api/detect-bottle", {
+      // Queue a detection job, then poll it until it has finished
+      const response = await fetch("http://localhost:5000/api/jobs", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ mode: "real-time-auto-stop" }),
+        body: JSON.stringify({ type: "detect-bottle" }),
       });
 
       if (response.ok) {
-        const result = await response.json();
+        const { job_id: jobId } = await response.json();
+        const job = await waitForJob(jobId);
+
+        const result = job.result || { success: false, message: job.error };
+        if (!result.success && !result.message) {
+          result.message = result.error;
+        }
         setDetectionProgress(80);
         setDetectionStatus("Processing detection results...");
         setCameraStatus("analyzing");
@@ -132,25 +165,22 @@ const UserObject = () => {
     setCameraStatus("idle");
   };
 
-  const fetchData = async () => {
-    try {
-      const res = await fetch("http://localhost:5000/api/joystick");
-      const json = await res.json();
+  useEffect(() => {
+    // Joystick updates are pushed by the backend
+    const source = new EventSource("http://localhost:5000/api/events/joystick");
+    source.addEventListener("joystick", (event) => {
+      const json = JSON.parse(event.data);
       if (json.length > 0) {
         setData(json);
         setLatestMaterial(json[0].material);
       }
-    } catch (err) {
-      console.error("Error fetching joystick data:", err);
-    } finally {
       setLoading(false);
-    }
-  };
-
-  useEffect(() => {
-    fetchData();
-    intervalRef.current = setInterval(fetchData, 2000);
-    return () => clearInterval(intervalRef.current);
+    });
+    source.onerror = () => {
+      console.error("Joystick event stream disconnected");
+      setLoading(false);
+    };
+    return () => source.close();
   }, []);
 
   if (loading) {